@@ -153,6 +153,80 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
+# ==========================
+# RUTAS: PROVEEDOR Y CACHÉ DE DISTANCIAS
+# ==========================
+
+# "cached" (Google + caché en BD), "google" o "haversine" (estimación local sin red)
+RUTAS_DISTANCE_PROVIDER = os.getenv("RUTAS_DISTANCE_PROVIDER", "cached")
+# Si Google no responde, estimar con haversine x factor de ruta en vez de abortar
+RUTAS_DISTANCE_FALLBACK = os.getenv("RUTAS_DISTANCE_FALLBACK", "True") == "True"
+RUTAS_ROAD_FACTOR = float(os.getenv("RUTAS_ROAD_FACTOR", "1.3"))
+
+RUTAS_DISTANCE_CACHE_TTL_DAYS = int(os.getenv("RUTAS_DISTANCE_CACHE_TTL_DAYS", "30"))
+RUTAS_DISTANCE_CACHE_MAX_ENTRIES = int(os.getenv("RUTAS_DISTANCE_CACHE_MAX_ENTRIES", "200000"))
+
+# Búsqueda local para rutas sobre el límite exacto: 2opt, or_opt, 3opt, lk
+RUTAS_LOCAL_SEARCH = tuple(os.getenv("RUTAS_LOCAL_SEARCH", "2opt,or_opt").split(","))
+
+# Requests concurrentes a la Distance Matrix API (bloques de <= 100 elementos)
+RUTAS_MATRIX_MAX_WORKERS = int(os.getenv("RUTAS_MATRIX_MAX_WORKERS", "4"))
+
+# Multi-arranque del TSP heurístico: 1 = una sola corrida (vecino más cercano)
+RUTAS_MULTISTART_STARTS = int(os.getenv("RUTAS_MULTISTART_STARTS", "1"))
+# Procesos para el multi-arranque (0 = os.cpu_count())
+RUTAS_MULTISTART_WORKERS = int(os.getenv("RUTAS_MULTISTART_WORKERS", "0"))
+RUTAS_MULTISTART_SEED = int(os.getenv("RUTAS_MULTISTART_SEED", "0"))
+
+# Presupuesto de tiempo por defecto del TSP (ms, 0 = sin límite); el formulario puede fijar otro
+RUTAS_TIME_LIMIT_MS = int(os.getenv("RUTAS_TIME_LIMIT_MS", "0"))
+
+# Procesos del pool que ejecuta las optimizaciones fuera del request (0 = en el mismo proceso)
+RUTAS_JOB_WORKERS = int(os.getenv("RUTAS_JOB_WORKERS", "2"))
+
+# Segundos sin latido tras los cuales un job pendiente se reencola y uno en proceso se marca con error
+RUTAS_JOB_STALE_S = int(os.getenv("RUTAS_JOB_STALE_S", "300"))
+
+# Búsqueda local tras agregar o borrar un punto del último plan (re-optimización incremental)
+RUTAS_INCREMENTAL_TIME_LIMIT_MS = int(os.getenv("RUTAS_INCREMENTAL_TIME_LIMIT_MS", "200"))
+
+# Caché de geocodificación (direcciones normalizadas)
+RUTAS_GEOCODE_CACHE_TTL_DAYS = int(os.getenv("RUTAS_GEOCODE_CACHE_TTL_DAYS", "90"))
+# Importación masiva: requests por segundo a la Geocoding API e hilos concurrentes
+RUTAS_GEOCODE_RATE_LIMIT = float(os.getenv("RUTAS_GEOCODE_RATE_LIMIT", "40"))
+RUTAS_GEOCODE_MAX_WORKERS = int(os.getenv("RUTAS_GEOCODE_MAX_WORKERS", "8"))
+# Topes del CSV subido desde el mapa (el comando importar_puntos no los aplica)
+RUTAS_IMPORT_MAX_BYTES = int(os.getenv("RUTAS_IMPORT_MAX_BYTES", str(2 * 1024 * 1024)))
+RUTAS_IMPORT_MAX_FILAS = int(os.getenv("RUTAS_IMPORT_MAX_FILAS", "5000"))
+
+# Soluciones memorizadas por selección, extremos y parámetros (0 entradas = desactivada)
+RUTAS_RESULT_CACHE_TTL_HOURS = int(os.getenv("RUTAS_RESULT_CACHE_TTL_HOURS", "24"))
+RUTAS_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RUTAS_RESULT_CACHE_MAX_ENTRIES", "500"))
+
+# Mapa: puntos por viewport agrupados en celdas de N px; con pocos puntos visibles no se agrupa
+RUTAS_MAPA_CLUSTER_PX = int(os.getenv("RUTAS_MAPA_CLUSTER_PX", "60"))
+RUTAS_MAPA_MAX_SIN_AGRUPAR = int(os.getenv("RUTAS_MAPA_MAX_SIN_AGRUPAR", "300"))
+# Checkboxes del formulario de optimización; sobre este número se ofrece "todos los puntos"
+RUTAS_MAPA_MAX_PUNTOS_FORMULARIO = int(os.getenv("RUTAS_MAPA_MAX_PUNTOS_FORMULARIO", "500"))
+
+# Matriz global punto x punto en disco (memmap); vacío = desactivada, cada optimización arma la suya
+RUTAS_MATRIZ_GLOBAL_DIR = os.getenv("RUTAS_MATRIZ_GLOBAL_DIR", "")
+# Filas máximas del archivo (float32: 5000 filas = 100 MB); con más puntos se usa el camino normal
+RUTAS_MATRIZ_GLOBAL_MAX_PUNTOS = int(os.getenv("RUTAS_MATRIZ_GLOBAL_MAX_PUNTOS", "5000"))
+
+# Comparación de orígenes/destinos candidatos: procesos (0 = os.cpu_count(), 1 = en el request)
+RUTAS_ESCENARIOS_WORKERS = int(os.getenv("RUTAS_ESCENARIOS_WORKERS", "0"))
+
+# Cliente HTTP de Google Maps (rutas.maps_client): conexiones por proceso y timeouts (s)
+RUTAS_MAPS_POOL_SIZE = int(os.getenv("RUTAS_MAPS_POOL_SIZE", "16"))
+RUTAS_MAPS_CONNECT_TIMEOUT = float(os.getenv("RUTAS_MAPS_CONNECT_TIMEOUT", "3.05"))
+RUTAS_MAPS_READ_TIMEOUT = float(os.getenv("RUTAS_MAPS_READ_TIMEOUT", "10"))
+# Reintentos ante errores de red, HTTP 429/5xx y OVER_QUERY_LIMIT (backoff exponencial con jitter)
+RUTAS_MAPS_MAX_RETRIES = int(os.getenv("RUTAS_MAPS_MAX_RETRIES", "3"))
+RUTAS_MAPS_BACKOFF_S = float(os.getenv("RUTAS_MAPS_BACKOFF_S", "0.25"))
+# Segundo request si el primero tarda más de N ms (0 = desactivado; los requests extra se cobran)
+RUTAS_MAPS_HEDGE_MS = int(os.getenv("RUTAS_MAPS_HEDGE_MS", "0"))
+
 
 
 # ========== AGREGAR ESTAS LÍNEAS AL FINAL DE settings.py ==========
@@ -246,4 +320,4 @@ if not DEBUG:
     CSRF_COOKIE_SECURE = True
     SECURE_BROWSER_XSS_FILTER = True
     SECURE_CONTENT_TYPE_NOSNIFF = True
-    X_FRAME_OPTIONS = 'DENY'
\ No newline at end of file
+    X_FRAME_OPTIONS = 'DENY'
@@ -89,8 +89,10 @@ class VentaAdmin(admin.ModelAdmin):
         "kilos_total",
         "monto_total",
         "canal",
+        "punto_entrega",
+        "entregada",
     )
-    list_filter = ("canal", "fecha", "tipo_documento")
+    list_filter = ("canal", "fecha", "tipo_documento", "entregada")
     date_hierarchy = "fecha"
     search_fields = ("cliente__nombre", "numero_documento")
     ordering = ("-id",)
@@ -33,6 +33,8 @@ class VentaForm(forms.ModelForm):
             "numero_documento",
             "canal",
             "kilos_total",      # ✅ kilos (antes era total)
+            "punto_entrega",
+            "entregada",
             "observaciones",
         ]
 
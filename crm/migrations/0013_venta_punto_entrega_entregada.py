@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0003_distanciacache"),
+        ("crm", "0012_alter_cliente_options_alter_gastooperacional_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="venta",
+            name="entregada",
+            field=models.BooleanField(
+                db_index=True,
+                default=False,
+                help_text="Marcar cuando la venta ya fue despachada.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="venta",
+            name="punto_entrega",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="ventas",
+                to="rutas.puntoentrega",
+            ),
+        ),
+    ]
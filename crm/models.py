@@ -99,6 +99,20 @@ class Venta(models.Model):
     )
     numero_documento = models.CharField(max_length=30, blank=True, db_index=True)
 
+    # Despacho: punto de entrega del mapa de rutas (sus kilos son la demanda del CVRP)
+    punto_entrega = models.ForeignKey(
+        "rutas.PuntoEntrega",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="ventas",
+    )
+    entregada = models.BooleanField(
+        default=False,
+        db_index=True,
+        help_text="Marcar cuando la venta ya fue despachada."
+    )
+
     # ✅ NUEVO: Meta con índices
     class Meta:
         verbose_name = "Venta"
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import OptimizacionJob
+
+
+@admin.register(OptimizacionJob)
+class OptimizacionJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "usuario", "estado", "creado_en", "iniciado_en", "terminado_en", "tiempos")
+    list_filter = ("estado",)
+    readonly_fields = ("parametros", "resultado", "error", "tiempos", "creado_en", "iniciado_en", "terminado_en")
@@ -0,0 +1,111 @@
+# rutas/anytime.py
+"""
+Solver "anytime" para el TSP con presupuesto de tiempo (time_limit_ms).
+
+Siempre hay una mejor ruta disponible:
+1) vecino más cercano (inmediato)
+2) búsqueda local completa (rutas.local_search), la misma ruta base que el
+   solver sin límite (optimizer._solve_tsp_heuristic): si termina dentro de
+   time_limit_ms el resultado nunca es peor que ese. Si el deadline llega
+   antes, se entrega lo que alcanzó a mejorar (estadística base_completa
+   en False).
+3) búsqueda local iterada hasta el deadline: perturbación double-bridge
+   (A B C D -> A C B D, conserva el sentido de los tramos, segura en
+   asimétrico) + búsqueda local; se acepta solo si mejora. La búsqueda tras
+   cada perturbación parte solo con los nodos de los arcos cortados activos
+   (don't-look bits), así cada iteración cuesta ~O(k) y no O(n).
+
+Cada mejora se informa con on_improve(progreso), donde progreso es un dict
+{'costo', 'ms', 'iteracion', 'ruta'}; lo usa el endpoint SSE del mapa.
+"""
+import time
+
+import numpy as np
+
+from . import local_search, multistart
+
+DEFAULT_SEED = 0
+MIN_KICK_NODES = 8  # con menos paradas la perturbación no aporta
+
+
+def solve(d, delivery_indices, start_index, end_index, methods, time_limit_ms,
+          on_improve=None, seed=DEFAULT_SEED):
+    """
+    Args:
+        d: matriz de costos (local_search.cost_array)
+        delivery_indices, start_index, end_index: como en optimizer.solve_tsp
+        methods: movimientos de búsqueda local
+        time_limit_ms: presupuesto de tiempo de reloj
+        on_improve: callback opcional por cada mejora
+        seed: semilla de las perturbaciones (resultado reproducible a igual
+            cantidad de iteraciones)
+
+    Returns:
+        (mejor_ruta, estadisticas) con 'iteraciones', 'mejoras', 'ms' y
+        'base_completa' (la búsqueda local base terminó antes del deadline).
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + time_limit_ms / 1000.0
+    end = start_index if end_index is None else end_index
+
+    # Listas de vecinos solo desde CANDIDATE_THRESHOLD, como improve(); con
+    # menos puntos la búsqueda tras cada perturbación ve todos los nodos
+    n_route = len(delivery_indices) + 2
+    if n_route > local_search.CANDIDATE_THRESHOLD:
+        neighbors = local_search.neighbor_lists(d)
+    else:
+        neighbors = None
+    kick_neighbors = local_search.neighbor_lists(d, k=d.shape[0] - 1) if neighbors is None else neighbors
+
+    stats = {'iteraciones': 0, 'mejoras': 0, 'ms': 0.0, 'base_completa': True}
+
+    def report(route, cost, iteration):
+        stats['mejoras'] += 1
+        if on_improve is not None:
+            on_improve({
+                'costo': cost,
+                'ms': (time.perf_counter() - t0) * 1000,
+                'iteracion': iteration,
+                'ruta': list(route),
+            })
+
+    best = multistart.randomized_nearest_neighbor(d, delivery_indices, start_index) + [end]
+    best_cost = local_search.route_cost(d, best)
+    report(best, best_cost, 0)
+
+    # La ruta base es la del solver sin límite de tiempo si alcanza a terminar
+    route = local_search.improve(d, best, methods, neighbors=neighbors, deadline=deadline)
+    stats['base_completa'] = time.perf_counter() < deadline
+    cost = local_search.route_cost(d, route)
+    if cost < best_cost - local_search.IMPROVEMENT_EPS:
+        best, best_cost = route, cost
+        report(best, best_cost, 0)
+
+    rng = np.random.default_rng(seed)
+    iteration = 0
+    while len(best) - 2 >= MIN_KICK_NODES and time.perf_counter() < deadline:
+        iteration += 1
+        kicked, touched = double_bridge(best, rng)
+        candidate = local_search.improve(
+            d, kicked, methods, neighbors=kick_neighbors, deadline=deadline, active=touched
+        )
+        cost = local_search.route_cost(d, candidate)
+        if cost < best_cost - local_search.IMPROVEMENT_EPS:
+            best, best_cost = candidate, cost
+            report(best, best_cost, iteration)
+
+    stats['iteraciones'] = iteration
+    stats['ms'] = (time.perf_counter() - t0) * 1000
+    return best, stats
+
+
+def double_bridge(route, rng):
+    """
+    Intercambia dos segmentos consecutivos elegidos al azar (extremos fijos).
+
+    Returns:
+        (ruta_perturbada, nodos en los extremos de los arcos cortados)
+    """
+    i, j, k = (int(x) for x in np.sort(rng.choice(np.arange(1, len(route) - 1), size=3, replace=False)))
+    touched = [route[x] for x in (i - 1, i, j - 1, j, k - 1, k)]
+    return route[:i] + route[j:k] + route[i:j] + route[k:], touched
@@ -0,0 +1,275 @@
+# rutas/benchmark.py
+"""
+Benchmark de los solvers TSP sobre instancias sintéticas fijas.
+
+Cada instancia se genera con una semilla fija (mismo tipo, tamaño y semilla
+= misma matriz en cualquier máquina), así dos reportes de commits distintos
+se comparan fila a fila. Tipos de instancia:
+- uniforme: puntos uniformes en un cuadrado de LADO_KM, distancia euclidiana
+- clusters: grupos gaussianos (barrios con muchas entregas juntas)
+- santiago: coordenadas alrededor de Santiago, haversine x factor de ruta
+  (la matriz del proveedor 'haversine')
+- asimetrica: uniforme con un recargo aleatorio por sentido (calles de un
+  sentido), d[i, j] != d[j, i]
+
+Por instancia y solver se mide tiempo (mediana y mínimo de varias
+repeticiones), memoria máxima (tracemalloc, en una corrida aparte para no
+inflar los tiempos) y distancia. La brecha (gap_pct) es contra el óptimo
+cuando hay un solver exacto, si no contra la mejor distancia encontrada.
+Los solvers exactos se comparan entre sí: si no dan la misma distancia la
+instancia queda en 'discrepancias'.
+
+Uso: python manage.py benchmark_rutas (ver --help).
+"""
+import csv
+import io
+import math
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from django.utils import timezone
+
+from . import distance_providers, local_search, optimizer
+
+TIPOS = ('uniforme', 'clusters', 'santiago', 'asimetrica')
+LADO_KM = 20.0
+SANTIAGO = (-33.45, -70.66)
+BRUTEFORCE_MAX_POINTS = 8  # 8! = 40320 permutaciones, ~0.5 s
+TOLERANCIA_EXACTOS = 1e-6
+MIN_DELTA_MS = 1.0
+
+# Tamaños (puntos de entrega) de la suite por defecto
+TAMANOS_EXACTOS = (7, 12)
+TAMANOS_HEURISTICOS = (50, 200)
+
+COLUMNAS = (
+    'instancia', 'tipo', 'n', 'seed', 'solver', 'distancia', 'optimo', 'gap_pct',
+    'ms_mediana', 'ms_min', 'memoria_kb', 'repeticiones',
+)
+
+
+# --- Instancias ---
+
+def generar(tipo, n, seed=0):
+    """
+    Matriz de distancias (km, float64) de n puntos de entrega más el
+    depósito (índice 0), para una ruta cerrada.
+    """
+    rng = np.random.default_rng([seed, n, TIPOS.index(tipo)])
+    m = n + 1
+
+    if tipo == 'santiago':
+        lat = SANTIAGO[0] + rng.normal(0, 0.06, m)
+        lng = SANTIAGO[1] + rng.normal(0, 0.08, m)
+        return distance_providers.haversine_matrix(np.column_stack([lat, lng])) \
+            * distance_providers.DEFAULT_ROAD_FACTOR
+
+    if tipo == 'clusters':
+        centros = rng.uniform(0, LADO_KM, (max(2, int(math.sqrt(m) / 2)), 2))
+        xy = centros[rng.integers(len(centros), size=m)] + rng.normal(0, LADO_KM / 40, (m, 2))
+    elif tipo in ('uniforme', 'asimetrica'):
+        xy = rng.uniform(0, LADO_KM, (m, 2))
+    else:
+        raise ValueError(f"Tipo de instancia desconocido: {tipo}")
+
+    d = np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+    if tipo == 'asimetrica':
+        d *= rng.uniform(1.0, 1.3, (m, m))
+        np.fill_diagonal(d, 0.0)
+    return d
+
+
+def suite(tipos=TIPOS, tamanos_exactos=TAMANOS_EXACTOS, tamanos_heuristicos=TAMANOS_HEURISTICOS, seed=0):
+    """Lista de (nombre, tipo, n, seed) de la suite."""
+    return [
+        (f"{tipo}-{n}-s{seed}", tipo, n, seed)
+        for tipo in tipos
+        for n in (*tamanos_exactos, *tamanos_heuristicos)
+    ]
+
+
+# --- Solvers ---
+
+def _delivery(d):
+    return list(range(1, len(d)))
+
+
+def _vecino_2opt(d):
+    route = optimizer._nearest_neighbor(local_search.cost_array(d), _delivery(d), 0) + [0]
+    return optimizer._two_opt(d, route)
+
+
+def _heuristica(methods):
+    def resolver(d, time_limit_ms=None):
+        route, _ = optimizer._solve_tsp_heuristic(d, _delivery(d), 0, None, methods, starts=1)
+        return route
+    return resolver
+
+
+def _anytime(d, time_limit_ms=None):
+    # solve_tsp usa Held-Karp con pocos puntos; aquí se fuerza el anytime
+    route, _ = optimizer.anytime.solve(
+        local_search.cost_array(d), _delivery(d), 0, None,
+        local_search.DEFAULT_LOCAL_SEARCH, time_limit_ms,
+    )
+    return route
+
+
+# nombre -> (resolver(d, time_limit_ms), exacto, máximo de puntos de entrega)
+SOLVERS = {
+    'held_karp': (
+        lambda d, time_limit_ms=None: optimizer._solve_tsp_held_karp(d, _delivery(d), 0, None)[0],
+        True, optimizer.HELD_KARP_MAX_POINTS,
+    ),
+    'fuerza_bruta': (
+        lambda d, time_limit_ms=None: optimizer._solve_tsp_bruteforce(d, _delivery(d), 0, None)[0],
+        True, BRUTEFORCE_MAX_POINTS,
+    ),
+    'nn_2opt': (lambda d, time_limit_ms=None: _vecino_2opt(d), False, None),
+    '2opt_oropt': (_heuristica(('2opt', 'or_opt')), False, None),
+    'lk': (_heuristica(('lk',)), False, None),
+    'anytime': (_anytime, False, None),
+}
+
+
+# --- Ejecución ---
+
+def _medir(resolver, d, time_limit_ms, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        route = resolver(d, time_limit_ms=time_limit_ms)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+
+    tracemalloc.start()
+    try:
+        resolver(d, time_limit_ms=time_limit_ms)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return route, tiempos, pico
+
+
+def _ruta_valida(route, n):
+    return route[0] == 0 and route[-1] == 0 and sorted(route[1:-1]) == list(range(1, n + 1))
+
+
+def ejecutar(instancias, solvers=tuple(SOLVERS), repeticiones=3, time_limit_ms=100, on_result=None):
+    """
+    Corre cada solver sobre cada instancia (los exactos solo hasta su
+    máximo de puntos).
+
+    Args:
+        instancias: salida de suite()
+        solvers: nombres de SOLVERS
+        on_result: callback(fila) por cada medición (progreso del comando)
+
+    Returns:
+        dict con 'meta', 'resultados' (filas con las COLUMNAS) y
+        'discrepancias' (instancias donde los solvers exactos no coinciden
+        o alguna ruta no es válida)
+    """
+    resultados, discrepancias = [], []
+
+    for nombre, tipo, n, seed in instancias:
+        d = generar(tipo, n, seed)
+        filas, exactos = [], {}
+
+        for solver in solvers:
+            resolver, exacto, max_puntos = SOLVERS[solver]
+            if max_puntos is not None and n > max_puntos:
+                continue
+            route, tiempos, pico = _medir(resolver, d, time_limit_ms, repeticiones)
+            if not _ruta_valida(route, n):
+                discrepancias.append({'instancia': nombre, 'solver': solver, 'motivo': 'ruta inválida'})
+                continue
+            distancia = round(optimizer._route_distance(d, route), 6)
+            if exacto:
+                exactos[solver] = distancia
+            filas.append({
+                'instancia': nombre, 'tipo': tipo, 'n': n, 'seed': seed, 'solver': solver,
+                'distancia': distancia,
+                'ms_mediana': round(statistics.median(tiempos), 3),
+                'ms_min': round(min(tiempos), 3),
+                'memoria_kb': round(pico / 1024, 1),
+                'repeticiones': repeticiones,
+            })
+
+        if exactos and max(exactos.values()) - min(exactos.values()) > TOLERANCIA_EXACTOS:
+            discrepancias.append({'instancia': nombre, 'solver': ','.join(exactos), 'motivo': str(exactos)})
+
+        referencia = min(exactos.values()) if exactos else min((f['distancia'] for f in filas), default=None)
+        for fila in filas:
+            fila['optimo'] = bool(exactos)
+            fila['gap_pct'] = round(100 * (fila['distancia'] - referencia) / referencia, 4) if referencia else 0.0
+            resultados.append(fila)
+            if on_result is not None:
+                on_result(fila)
+
+    return {'meta': metadatos(repeticiones, time_limit_ms), 'resultados': resultados,
+            'discrepancias': discrepancias}
+
+
+def metadatos(repeticiones, time_limit_ms):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'fecha': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'maquina': platform.machine(),
+        'repeticiones': repeticiones,
+        'time_limit_ms': time_limit_ms,
+    }
+
+
+# --- Reportes ---
+
+def a_csv(reporte):
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=COLUMNAS)
+    writer.writeheader()
+    writer.writerows(reporte['resultados'])
+    return salida.getvalue()
+
+
+def comparar(base, actual, umbral_pct=10.0):
+    """
+    Compara dos reportes fila a fila (misma instancia y solver).
+
+    Returns:
+        lista de dicts con 'instancia', 'solver', 'ms_pct' y 'distancia_pct'
+        (variación de actual contra base) y 'regresion' si el tiempo subió
+        más de umbral_pct o la distancia empeoró
+    """
+    previos = {(f['instancia'], f['solver']): f for f in base['resultados']}
+    cambios = []
+    for fila in actual['resultados']:
+        previa = previos.get((fila['instancia'], fila['solver']))
+        if previa is None:
+            continue
+        ms_pct = _variacion(previa['ms_mediana'], fila['ms_mediana'])
+        distancia_pct = _variacion(previa['distancia'], fila['distancia'])
+        cambios.append({
+            'instancia': fila['instancia'],
+            'solver': fila['solver'],
+            'ms_pct': ms_pct,
+            'distancia_pct': distancia_pct,
+            # Bajo MIN_DELTA_MS la variación es ruido del reloj
+            'regresion': (ms_pct > umbral_pct and fila['ms_mediana'] - previa['ms_mediana'] > MIN_DELTA_MS)
+            or distancia_pct > TOLERANCIA_EXACTOS,
+        })
+    return cambios
+
+
+def _variacion(antes, despues):
+    return round(100 * (despues - antes) / antes, 2) if antes else 0.0
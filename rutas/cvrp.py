@@ -0,0 +1,259 @@
+# rutas/cvrp.py
+"""
+Ruteo con capacidad y varios vehículos (CVRP) sobre la misma matriz de
+distancias que usa el TSP (índice 0 = origen/bodega).
+
+1) Construcción con ahorros de Clarke-Wright (matriz de ahorros vectorizada,
+   válida para matrices asimétricas y destino distinto del origen).
+2) Asignación de rutas a vehículos (más cargada -> más capacidad).
+3) Búsqueda local entre rutas: relocate (mover una parada) y exchange
+   (intercambiar dos paradas), minimizando litros (km / rendimiento de cada
+   vehículo) y respetando la capacidad.
+4) Búsqueda local dentro de cada ruta (rutas.local_search).
+
+Los vehículos son dicts: {'nombre', 'capacidad_kg', 'rendimiento_km_por_litro'}.
+"""
+import numpy as np
+
+from . import local_search
+from .optimizer import AUTO_RENDIMIENTO_KM_POR_LITRO, calculate_fuel_cost, route_legs
+
+MAX_PASSES = 50
+
+
+def solve_cvrp(distance_matrix, demands, vehicles, depot=0, end_index=None, local_search_methods=None):
+    """
+    Args:
+        distance_matrix: matriz n x n (ndarray o listas)
+        demands: kilos por índice de la matriz (origen y destino = 0)
+        vehicles: lista de dicts de vehículo
+        depot: índice del origen
+        end_index: índice del destino (None = volver al origen)
+
+    Returns:
+        dict con:
+        - 'rutas': una entrada por vehículo {'vehiculo', 'ruta', 'carga_kg',
+          'distancia_km', 'litros'} (ruta = índices con origen y destino)
+        - 'sin_asignar': índices que no caben en ningún vehículo
+        - 'distancia_total_km', 'litros_total'
+    """
+    d = local_search.cost_array(distance_matrix)
+    demands = np.asarray(demands, dtype=np.float64)
+    end = depot if end_index is None else end_index
+    customers = [i for i in range(d.shape[0]) if i not in (depot, end)]
+
+    capacities = np.array([float(v.get('capacidad_kg') or 0) for v in vehicles])
+    rendimientos = np.array([
+        float(v.get('rendimiento_km_por_litro') or AUTO_RENDIMIENTO_KM_POR_LITRO) for v in vehicles
+    ])
+
+    # Paradas que no caben ni en el vehículo más grande
+    too_heavy = [c for c in customers if demands[c] > capacities.max()]
+    customers = [c for c in customers if demands[c] <= capacities.max()]
+
+    routes = _clarke_wright(d, demands, customers, depot, end, capacities.max())
+    assigned, unassigned = _assign_to_vehicles(d, demands, routes, capacities, depot, end)
+
+    fuel_weights = 1.0 / rendimientos
+    assigned = _inter_route_search(d, demands, assigned, capacities, fuel_weights)
+
+    methods = local_search_methods or local_search.DEFAULT_LOCAL_SEARCH
+    assigned = [
+        local_search.improve(d, r, methods) if len(r) > 3 else r
+        for r in assigned
+    ]
+
+    distancias = np.array([float(route_legs(distance_matrix, r).sum(dtype=np.float64)) for r in assigned])
+    litros = calculate_fuel_cost(distancias, rendimientos)
+
+    result = []
+    for k, vehicle in enumerate(vehicles):
+        route = assigned[k]
+        result.append({
+            'vehiculo': vehicle,
+            'ruta': [int(x) for x in route],
+            'carga_kg': float(demands[route[1:-1]].sum()) if len(route) > 2 else 0.0,
+            'distancia_km': float(distancias[k]) if len(route) > 2 else 0.0,
+            'litros': float(litros[k]) if len(route) > 2 else 0.0,
+        })
+
+    return {
+        'rutas': result,
+        'sin_asignar': sorted(int(c) for c in too_heavy + unassigned),
+        'distancia_total_km': sum(r['distancia_km'] for r in result),
+        'litros_total': sum(r['litros'] for r in result),
+    }
+
+
+# --- Construcción: ahorros de Clarke-Wright ---
+
+def _clarke_wright(d, demands, customers, depot, end, capacity):
+    """
+    Parte con una ruta por parada y une la ruta que termina en i con la que
+    empieza en j por orden de ahorro s(i, j) = d[i, end] + d[depot, j] - d[i, j].
+    """
+    if not customers:
+        return []
+
+    c = np.asarray(customers, dtype=np.intp)
+    savings = d[c, end][:, None] + d[depot, c][None, :] - d[np.ix_(c, c)]
+    np.fill_diagonal(savings, -np.inf)
+
+    order = np.argsort(savings, axis=None)[::-1]
+    ii, jj = np.unravel_index(order, savings.shape)
+    positive = savings[ii, jj] > 0
+
+    route_of = {int(x): k for k, x in enumerate(c)}
+    routes = {k: [int(x)] for k, x in enumerate(c)}
+    loads = {k: float(demands[x]) for k, x in enumerate(c)}
+
+    for a, b in zip(ii[positive], jj[positive]):
+        i, j = int(c[a]), int(c[b])
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj:
+            continue
+        if routes[ri][-1] != i or routes[rj][0] != j:
+            continue
+        if loads[ri] + loads[rj] > capacity:
+            continue
+
+        routes[ri].extend(routes[rj])
+        loads[ri] += loads[rj]
+        for x in routes[rj]:
+            route_of[x] = ri
+        del routes[rj], loads[rj]
+
+    return [[depot] + r + [end] for r in routes.values()]
+
+
+def _assign_to_vehicles(d, demands, routes, capacities, depot, end):
+    """
+    Asigna rutas a vehículos (más carga -> más capacidad). Las rutas que sobran
+    se disuelven y sus paradas se insertan donde sea más barato y quepan.
+
+    Returns:
+        (rutas por vehículo en el orden de capacities, paradas sin asignar)
+    """
+    loads = [float(demands[r[1:-1]].sum()) for r in routes]
+    by_load = sorted(range(len(routes)), key=lambda k: loads[k], reverse=True)
+    free_vehicles = sorted(range(len(capacities)), key=lambda v: capacities[v], reverse=True)
+
+    assigned = [[depot, end] for _ in capacities]
+    leftovers = []
+
+    for k in by_load:
+        fit = [v for v in free_vehicles if capacities[v] >= loads[k]]
+        if fit:
+            v = min(fit, key=lambda v: capacities[v])  # mejor ajuste
+            assigned[v] = routes[k]
+            free_vehicles.remove(v)
+        else:
+            leftovers.extend(routes[k][1:-1])
+
+    unassigned = []
+    for stop in leftovers:
+        best = None
+        for v, route in enumerate(assigned):
+            if float(demands[route[1:-1]].sum()) + demands[stop] > capacities[v]:
+                continue
+            r = np.asarray(route)
+            cost = d[r[:-1], stop] + d[stop, r[1:]] - d[r[:-1], r[1:]]
+            p = int(np.argmin(cost))
+            if best is None or cost[p] < best[0]:
+                best = (float(cost[p]), v, p)
+        if best is None:
+            unassigned.append(stop)
+        else:
+            _, v, p = best
+            assigned[v] = assigned[v][:p + 1] + [stop] + assigned[v][p + 1:]
+
+    return assigned, unassigned
+
+
+# --- Búsqueda local entre rutas ---
+
+def _inter_route_search(d, demands, routes, capacities, fuel_weights):
+    """Relocate y exchange entre rutas hasta que no haya mejora en litros."""
+    routes = [list(r) for r in routes]
+    for _ in range(MAX_PASSES):
+        improved = _relocate_pass(d, demands, routes, capacities, fuel_weights)
+        improved = _exchange_pass(d, demands, routes, capacities, fuel_weights) or improved
+        if not improved:
+            break
+    return routes
+
+
+def _relocate_pass(d, demands, routes, capacities, fuel_weights):
+    improved = False
+    loads = [float(demands[r[1:-1]].sum()) for r in routes]
+
+    for a in range(len(routes)):
+        pos = 1
+        while pos < len(routes[a]) - 1:
+            ra = routes[a]
+            u = ra[pos]
+            prev, nxt = ra[pos - 1], ra[pos + 1]
+            removal = (d[prev, u] + d[u, nxt] - d[prev, nxt]) * fuel_weights[a]
+
+            best = None
+            for b in range(len(routes)):
+                if b == a or loads[b] + demands[u] > capacities[b]:
+                    continue
+                rb = np.asarray(routes[b])
+                insert = (d[rb[:-1], u] + d[u, rb[1:]] - d[rb[:-1], rb[1:]]) * fuel_weights[b]
+                p = int(np.argmin(insert))
+                delta = insert[p] - removal
+                if delta < -local_search.IMPROVEMENT_EPS and (best is None or delta < best[0]):
+                    best = (delta, b, p)
+
+            if best is None:
+                pos += 1
+                continue
+
+            _, b, p = best
+            del routes[a][pos]
+            routes[b].insert(p + 1, u)
+            loads[a] -= demands[u]
+            loads[b] += demands[u]
+            improved = True
+
+    return improved
+
+
+def _exchange_pass(d, demands, routes, capacities, fuel_weights):
+    improved = False
+    loads = [float(demands[r[1:-1]].sum()) for r in routes]
+
+    for a in range(len(routes)):
+        for b in range(a + 1, len(routes)):
+            if len(routes[a]) < 3 or len(routes[b]) < 3:
+                continue
+            for pa in range(1, len(routes[a]) - 1):
+                ra = routes[a]
+                rb = np.asarray(routes[b])
+                u = ra[pa]
+                a_prev, a_next = ra[pa - 1], ra[pa + 1]
+
+                vs = rb[1:-1]
+                b_prev, b_next = rb[:-2], rb[2:]
+
+                delta_a = (d[a_prev, vs] + d[vs, a_next] - d[a_prev, u] - d[u, a_next]) * fuel_weights[a]
+                delta_b = (d[b_prev, u] + d[u, b_next] - d[b_prev, vs] - d[vs, b_next]) * fuel_weights[b]
+                delta = delta_a + delta_b
+
+                feasible = (
+                    (loads[a] - demands[u] + demands[vs] <= capacities[a])
+                    & (loads[b] - demands[vs] + demands[u] <= capacities[b])
+                )
+                delta = np.where(feasible, delta, np.inf)
+
+                k = int(np.argmin(delta))
+                if delta[k] < -local_search.IMPROVEMENT_EPS:
+                    v = int(vs[k])
+                    routes[a][pa] = v
+                    routes[b][k + 1] = u
+                    loads[a] += demands[v] - demands[u]
+                    loads[b] += demands[u] - demands[v]
+                    improved = True
+
+    return improved
@@ -0,0 +1,101 @@
+# rutas/directions.py
+"""
+Geometría por calles de una ruta ya optimizada (Directions API).
+
+Se pide una sola vez, al guardar el plan, y las polilíneas codificadas
+(formato "encoded polyline" de Google) quedan en RutaPlan.polilineas; el
+mapa solo las decodifica. Cada request admite MAX_WAYPOINTS paradas
+intermedias, así que cada recorrido se parte en tramos que comparten el
+extremo y los tramos se piden en paralelo (mismo esquema que los bloques de
+la Distance Matrix en rutas.distance_providers).
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from . import maps_client
+from .distance_cache import coord_key
+from .distance_providers import DEFAULT_MATRIX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+MAX_WAYPOINTS = 25  # intermedios por request (más origen y destino)
+
+
+def tramos(puntos, max_waypoints=MAX_WAYPOINTS):
+    """Parte un recorrido en tramos de hasta max_waypoints + 2 puntos que comparten extremos."""
+    paso = max_waypoints + 1
+    return [puntos[i:i + paso + 1] for i in range(0, max(len(puntos) - 1, 1), paso)]
+
+
+def trazar(recorridos, api_key, mode="driving", max_workers=None):
+    """
+    Args:
+        recorridos: lista de recorridos, cada uno lista de (lat, lng) con
+            origen, paradas y destino
+
+    Returns:
+        lista (una por recorrido) de listas de polilíneas codificadas, una
+        por tramo; o None si algún request falla.
+    """
+    trabajos = [
+        (k, tramo)
+        for k, puntos in enumerate(recorridos)
+        if len(puntos) > 1
+        for tramo in tramos([coord_key(lat, lng) for lat, lng in puntos])
+    ]
+    resultado = [[] for _ in recorridos]
+    if not trabajos:
+        return resultado
+
+    max_workers = min(
+        len(trabajos),
+        max_workers or getattr(settings, 'RUTAS_MATRIX_MAX_WORKERS', DEFAULT_MATRIX_WORKERS),
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        polilineas = list(executor.map(
+            lambda trabajo: _request_directions(trabajo[1], api_key, mode),
+            trabajos,
+        ))
+
+    if any(p is None for p in polilineas):
+        return None
+
+    for (k, _), polilinea in zip(trabajos, polilineas):
+        resultado[k].append(polilinea)
+    return resultado
+
+
+def _request_directions(keys, api_key, mode="driving"):
+    """
+    Llama a la Directions API para un tramo (paradas en el orden dado).
+
+    Returns:
+        overview_polyline codificada, o None si falla.
+    """
+    params = {
+        "origin": keys[0],
+        "destination": keys[-1],
+        "mode": mode,
+        "key": api_key,
+    }
+    if len(keys) > 2:
+        # "via:" no cuenta como parada y no cambia el orden
+        params["waypoints"] = "|".join(f"via:{k}" for k in keys[1:-1])
+
+    try:
+        data = maps_client.get_json('directions', params)
+
+        if data['status'] == 'OK' and data.get('routes'):
+            return data['routes'][0]['overview_polyline']['points']
+        logger.error(f"Error en Directions API: {data['status']} - {data.get('error_message', '')}")
+        return None
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error de conexión con la Directions API: {e}")
+        return None
+    except (json.JSONDecodeError, KeyError) as e:
+        logger.error(f"Respuesta inesperada de la Directions API: {e}")
+        return None
@@ -0,0 +1,126 @@
+# rutas/distance_cache.py
+"""
+Caché persistente (en BD) de distancias par a par para la Distance Matrix API.
+
+- Las coordenadas se redondean (COORD_DECIMALS) para que el mismo punto
+  geocodificado dos veces caiga en la misma llave.
+- Cada entrada vence después de un TTL y se desalojan las menos usadas
+  recientemente (LRU) cuando la tabla supera el máximo configurado.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DistanciaCache
+
+logger = logging.getLogger(__name__)
+
+COORD_DECIMALS = 5  # ~1 metro
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+def coord_key(lat, lng):
+    """Llave normalizada 'lat,lng' redondeada a COORD_DECIMALS."""
+    return f"{float(lat):.{COORD_DECIMALS}f},{float(lng):.{COORD_DECIMALS}f}"
+
+
+def _ttl():
+    return timedelta(days=getattr(settings, 'RUTAS_DISTANCE_CACHE_TTL_DAYS', DEFAULT_TTL_DAYS))
+
+
+def _max_entries():
+    return getattr(settings, 'RUTAS_DISTANCE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def lookup(keys, mode="driving", destinos=None):
+    """
+    Busca en caché todos los pares (origen, destino) entre las llaves dadas
+    o, con destinos, solo los pares keys x destinos.
+
+    Returns:
+        dict {(origen_key, destino_key): distancia_km} solo con entradas vigentes.
+    """
+    keys = sorted(set(keys))
+    destinos = keys if destinos is None else sorted(set(destinos))
+    if not keys or not destinos:
+        return {}
+
+    vigentes = DistanciaCache.objects.filter(
+        origen__in=keys,
+        destino__in=destinos,
+        modo=mode,
+        creado_en__gte=timezone.now() - _ttl(),
+    )
+
+    found = {
+        (origen, destino): distancia
+        for origen, destino, distancia in vigentes.values_list('origen', 'destino', 'distancia_km')
+    }
+
+    # Marcar uso (LRU) en una sola UPDATE
+    if found:
+        vigentes.update(ultimo_uso=timezone.now())
+
+    return found
+
+
+def store(entries, mode="driving"):
+    """
+    Guarda (o refresca) pares en caché.
+
+    Args:
+        entries: iterable de (origen_key, destino_key, distancia_km, duracion_seg)
+    """
+    now = timezone.now()
+
+    # Un mismo par puede repetirse si dos puntos comparten coordenadas
+    unicos = {(origen, destino): (distancia, duracion) for origen, destino, distancia, duracion in entries}
+
+    objs = [
+        DistanciaCache(
+            origen=origen,
+            destino=destino,
+            modo=mode,
+            distancia_km=distancia,
+            duracion_seg=duracion,
+            creado_en=now,
+            ultimo_uso=now,
+        )
+        for (origen, destino), (distancia, duracion) in unicos.items()
+    ]
+    if not objs:
+        return 0
+
+    DistanciaCache.objects.bulk_create(
+        objs,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['origen', 'destino', 'modo'],
+        update_fields=['distancia_km', 'duracion_seg', 'creado_en', 'ultimo_uso'],
+    )
+    evict()
+    return len(objs)
+
+
+def evict():
+    """
+    Elimina entradas vencidas y, si aún se supera el máximo,
+    las menos usadas recientemente.
+    """
+    deleted, _ = DistanciaCache.objects.filter(creado_en__lt=timezone.now() - _ttl()).delete()
+
+    max_entries = _max_entries()
+    total = DistanciaCache.objects.count()
+    if total > max_entries:
+        # Exactamente los sobrantes, no todos los que empatan con el corte:
+        # las entradas de un mismo lote comparten ultimo_uso
+        sobrantes = DistanciaCache.objects.order_by('ultimo_uso', 'id').values('id')[:total - max_entries]
+        extra, _ = DistanciaCache.objects.filter(id__in=sobrantes).delete()
+        deleted += extra
+
+    if deleted:
+        logger.info(f"Caché de distancias: {deleted} entradas desalojadas")
+    return deleted
@@ -0,0 +1,443 @@
+# rutas/distance_providers.py
+"""
+Proveedores de matrices de distancia (km) para el optimizador.
+
+- GoogleDistanceProvider: Distance Matrix API, en bloques paralelos.
+- CachedDistanceProvider: envuelve a otro proveedor con la caché persistente
+  (rutas.distance_cache) y solo le pide los pares faltantes.
+- HaversineDistanceProvider: estimación local (gran círculo x factor de
+  desvío por calles), vectorizada con NumPy. No usa red: sirve para vistas
+  previas, instancias grandes, modo offline, tests y benchmarks.
+
+Todos reciben coordenadas como lista de tuplas (lat, lng) en grados y
+devuelven la matriz como ndarray MATRIX_DTYPE (km); los pares sin ruta
+quedan en inf (ver unreachable_mask).
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from django.conf import settings
+
+from . import distance_cache, maps_client
+
+logger = logging.getLogger(__name__)
+
+# Límites por request de la Distance Matrix API
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+DEFAULT_MATRIX_WORKERS = 4
+
+MATRIX_DTYPE = np.float32  # 4 bytes por par (vs ~32 de un float de Python en una lista)
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_ROAD_FACTOR = 1.3  # desvío típico calle vs línea recta en zona urbana
+
+
+class DistanceProvider:
+    """Interfaz común de los proveedores de distancias."""
+
+    name = "base"
+
+    def matrix_blocks(self, coords, blocks, mode="driving"):
+        """
+        Calcula los bloques pedidos.
+
+        Args:
+            coords: lista de (lat, lng)
+            blocks: lista de (origin_idx, dest_idx) con índices sobre coords
+
+        Returns:
+            dict {(i, j): (distancia_km, duracion_seg)}, o None si falla.
+            Un proveedor puede omitir (i, j) si entrega (j, i) (modo simétrico).
+        """
+        raise NotImplementedError
+
+    def matrix(self, coords, mode="driving"):
+        """Matriz completa n x n (ndarray, km), o None si falla."""
+        n = len(coords)
+        fetched = self.matrix_blocks(coords, [(list(range(n)), list(range(n)))], mode)
+        if fetched is None:
+            return None
+        return _assemble(n, fetched)
+
+
+def unreachable_mask(distance_matrix):
+    """Máscara booleana de los pares sin ruta."""
+    return ~np.isfinite(distance_matrix)
+
+
+def _assemble(n, fetched, distance_matrix=None, fill_transpose=True):
+    """
+    Rellena las celdas aún vacías (NaN) de una matriz n x n con los pares
+    obtenidos; las que falten se completan con su simétrico.
+
+    Con fill_transpose=False (matrices parciales) solo se completa el
+    simétrico de los pares obtenidos, el que omite un proveedor en modo
+    simétrico: las demás celdas vacías quedan en inf, no con el valor del
+    arco en sentido contrario.
+    """
+    if distance_matrix is None:
+        distance_matrix = np.full((n, n), np.nan, dtype=MATRIX_DTYPE)
+
+    if fetched:
+        idx = np.array(list(fetched.keys()), dtype=np.intp)
+        values = np.array([v[0] for v in fetched.values()], dtype=MATRIX_DTYPE)
+        free = np.isnan(distance_matrix[idx[:, 0], idx[:, 1]])
+        distance_matrix[idx[free, 0], idx[free, 1]] = values[free]
+        if not fill_transpose:
+            free = np.isnan(distance_matrix[idx[:, 1], idx[:, 0]])
+            distance_matrix[idx[free, 1], idx[free, 0]] = values[free]
+
+    if fill_transpose:
+        empty = np.isnan(distance_matrix)
+        distance_matrix[empty] = distance_matrix.T[empty]
+
+    np.fill_diagonal(distance_matrix, 0.0)
+    distance_matrix[np.isnan(distance_matrix)] = np.inf
+    return distance_matrix
+
+
+# --- Google Distance Matrix API ---
+
+class GoogleDistanceProvider(DistanceProvider):
+    """
+    Distance Matrix API en bloques legales (<= 25 origenes, <= 25 destinos,
+    <= 100 elementos) pedidos en paralelo por rutas.maps_client.
+
+    Con symmetric=True se pide solo un triángulo de cada bloque cuadrado
+    y se asume d(i, j) == d(j, i) para el resto (aproximación).
+    """
+
+    name = "google"
+
+    def __init__(self, api_key, symmetric=False, max_workers=None):
+        self.api_key = api_key
+        self.symmetric = symmetric
+        self.max_workers = max_workers or getattr(settings, 'RUTAS_MATRIX_MAX_WORKERS', DEFAULT_MATRIX_WORKERS)
+
+    def matrix_blocks(self, coords, blocks, mode="driving"):
+        keys = [distance_cache.coord_key(lat, lng) for lat, lng in coords]
+        tiles = []
+        for origin_idx, dest_idx in blocks:
+            tiles.extend(_tile_block(origin_idx, dest_idx, symmetric=self.symmetric))
+        return _fetch_tiles(tiles, keys, self.api_key, mode, self.max_workers)
+
+
+def _tile_block(origin_idx, dest_idx, symmetric=False):
+    """
+    Divide un rectángulo origenes x destinos en bloques legales para la API.
+
+    Si symmetric=True y el rectángulo es cuadrado con los mismos índices,
+    omite los bloques bajo la diagonal.
+    """
+    cols = min(len(dest_idx), MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST)
+    rows = min(len(origin_idx), MAX_ORIGINS_PER_REQUEST, max(1, MAX_ELEMENTS_PER_REQUEST // cols))
+    square = symmetric and origin_idx == dest_idx
+
+    tiles = []
+    for r in range(0, len(origin_idx), rows):
+        for c in range(0, len(dest_idx), cols):
+            if square and c + cols <= r:
+                continue
+            tiles.append((origin_idx[r:r + rows], dest_idx[c:c + cols]))
+    return tiles
+
+
+def _fetch_tiles(tiles, keys, api_key, mode="driving", max_workers=DEFAULT_MATRIX_WORKERS):
+    """
+    Pide los bloques en paralelo (pool acotado de threads sobre la Session
+    compartida de rutas.maps_client).
+
+    Returns:
+        dict {(i, j): (distancia_km, duracion_seg)}, o None si algún bloque falla.
+    """
+    if not tiles:
+        return {}
+
+    max_workers = min(len(tiles), max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blocks = list(executor.map(
+            lambda tile: _request_matrix_block(
+                [keys[i] for i in tile[0]],
+                [keys[j] for j in tile[1]],
+                api_key,
+                mode,
+            ),
+            tiles,
+        ))
+
+    if any(block is None for block in blocks):
+        return None
+
+    fetched = {}
+    for (origin_idx, dest_idx), block in zip(tiles, blocks):
+        for bi, i in enumerate(origin_idx):
+            for bj, j in enumerate(dest_idx):
+                fetched[(i, j)] = block[bi][bj]
+    return fetched
+
+
+def _request_matrix_block(origin_keys, dest_keys, api_key, mode="driving"):
+    """
+    Llama a la Distance Matrix API para un bloque origenes x destinos.
+
+    Returns:
+        lista de filas con tuplas (distancia_km, duracion_seg), o None si falla.
+        Los elementos sin ruta quedan como (inf, None).
+    """
+    params = {
+        "origins": "|".join(origin_keys),
+        "destinations": "|".join(dest_keys),
+        "mode": mode,
+        "key": api_key
+    }
+
+    try:
+        data = maps_client.get_json('distancematrix', params)
+
+        if data['status'] == 'OK':
+            block = []
+            for row_data in data['rows']:
+                row = []
+                for element in row_data['elements']:
+                    if element['status'] == 'OK':
+                        row.append((
+                            element['distance']['value'] / 1000,  # a km
+                            element.get('duration', {}).get('value'),
+                        ))
+                    else:
+                        row.append((float('inf'), None))
+                block.append(row)
+            return block
+        else:
+            logger.error(f"Error en Distance Matrix API: {data['status']} - {data.get('error_message', '')}")
+            return None
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error de conexión con la API de Google Maps: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        logger.error(f"Error al decodificar la respuesta JSON de la API: {e}")
+        return None
+
+
+# --- Caché persistente delante de otro proveedor ---
+
+class CachedDistanceProvider(DistanceProvider):
+    """
+    Consulta primero la caché persistente y solo pide al proveedor interno
+    los pares que faltan; lo obtenido se guarda en caché.
+    """
+
+    name = "cached"
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def matrix(self, coords, mode="driving"):
+        keys = np.array([distance_cache.coord_key(lat, lng) for lat, lng in coords])
+        n = len(keys)
+        if n == 0:
+            return np.zeros((0, 0), dtype=MATRIX_DTYPE)
+
+        # Trabajar sobre coordenadas únicas y expandir al final
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_keys = unique_keys.tolist()
+        unique_coords = [coords[i] for i in first]
+        u = len(unique_keys)
+        index = {k: i for i, k in enumerate(unique_keys)}
+
+        base = np.full((u, u), np.nan, dtype=MATRIX_DTYPE)
+        np.fill_diagonal(base, 0.0)
+
+        cached = distance_cache.lookup(unique_keys, mode)
+        for (origen, destino), distancia in cached.items():
+            base[index[origen], index[destino]] = distancia
+
+        missing = np.argwhere(np.isnan(base))
+
+        if len(missing) == 0:
+            logger.info(f"Matriz {n}x{n} servida completa desde caché")
+        else:
+            logger.info(
+                f"Matriz {n}x{n}: {len(cached)} pares en caché, "
+                f"{len(missing)} pares pedidos a '{self.inner.name}'"
+            )
+
+            fetched = self.inner.matrix_blocks(unique_coords, _missing_blocks(missing, u), mode)
+            if fetched is None:
+                return None
+
+            to_cache = [
+                (unique_keys[i], unique_keys[j], distancia, duracion)
+                for (i, j), (distancia, duracion) in fetched.items()
+                if distancia != float('inf') and i != j
+            ]
+            distance_cache.store(to_cache, mode)
+
+            base = _assemble(u, fetched, base)
+
+        return base[np.ix_(inverse, inverse)]
+
+    def matrix_blocks(self, coords, blocks, mode="driving"):
+        keys = [distance_cache.coord_key(lat, lng) for lat, lng in coords]
+        result = {}
+        for origin_idx, dest_idx in blocks:
+            cached = distance_cache.lookup([keys[i] for i in origin_idx], mode, [keys[j] for j in dest_idx])
+            missing = []
+            for i in origin_idx:
+                for j in dest_idx:
+                    distancia = 0.0 if keys[i] == keys[j] else cached.get((keys[i], keys[j]))
+                    if distancia is None:
+                        missing.append((i, j))
+                    else:
+                        result[(i, j)] = (distancia, None)
+
+            if missing:
+                missing = np.array(missing, dtype=np.intp)
+                fetched = self.inner.matrix_blocks(
+                    coords, [(np.unique(missing[:, 0]).tolist(), np.unique(missing[:, 1]).tolist())], mode
+                )
+                if fetched is None:
+                    return None
+                distance_cache.store([
+                    (keys[i], keys[j], distancia, duracion)
+                    for (i, j), (distancia, duracion) in fetched.items()
+                    if distancia != float('inf') and keys[i] != keys[j]
+                ], mode)
+                result.update(fetched)
+        return result
+
+
+def _missing_blocks(missing, n):
+    """
+    Agrupa los pares faltantes (array de (i, j)) en rectángulos (origenes, destinos):
+    - filas sin ningún par en caché (puntos nuevos) contra todos los destinos
+    - el resto de los pares faltantes en un solo rectángulo mínimo
+    """
+    per_row = np.bincount(missing[:, 0], minlength=n)
+    fresh = per_row >= n - 1
+    rest = missing[~fresh[missing[:, 0]]]
+
+    blocks = []
+    if fresh.any():
+        blocks.append((np.flatnonzero(fresh).tolist(), list(range(n))))
+    if len(rest):
+        blocks.append((np.unique(rest[:, 0]).tolist(), np.unique(rest[:, 1]).tolist()))
+    return blocks
+
+
+# --- Estimador local (sin red) ---
+
+class HaversineDistanceProvider(DistanceProvider):
+    """
+    Distancia de gran círculo x factor de desvío por calles.
+    Determinista y sin red; la duración no se estima (None).
+    """
+
+    name = "haversine"
+
+    def __init__(self, road_factor=None):
+        if road_factor is None:
+            road_factor = getattr(settings, 'RUTAS_ROAD_FACTOR', DEFAULT_ROAD_FACTOR)
+        self.road_factor = road_factor
+
+    def matrix_array(self, coords):
+        """Matriz n x n (ndarray float64, km) calculada de una sola vez."""
+        return haversine_matrix(coords) * self.road_factor
+
+    def matrix(self, coords, mode="driving"):
+        return self.matrix_array(coords).astype(MATRIX_DTYPE)
+
+    def matrix_blocks(self, coords, blocks, mode="driving"):
+        # Solo los rectángulos pedidos, no la matriz completa
+        result = {}
+        for origin_idx, dest_idx in blocks:
+            block = haversine_matrix(
+                [coords[i] for i in origin_idx], [coords[j] for j in dest_idx]
+            ) * self.road_factor
+            result.update(
+                ((i, j), (float(block[a, b]), None))
+                for a, i in enumerate(origin_idx)
+                for b, j in enumerate(dest_idx)
+            )
+        return result
+
+
+def haversine_matrix(coords, destinos=None):
+    """
+    Distancias de gran círculo (km) entre todas las coordenadas, vectorizado;
+    con destinos, solo coords x destinos.
+    """
+    if len(coords) == 0 or (destinos is not None and len(destinos) == 0):
+        return np.zeros((len(coords), 0 if destinos is None else len(destinos)))
+
+    rad = np.radians(np.asarray(coords, dtype=np.float64))
+    rad_d = rad if destinos is None else np.radians(np.asarray(destinos, dtype=np.float64))
+    lat, lng = rad[:, 0], rad[:, 1]
+    lat_d, lng_d = rad_d[:, 0], rad_d[:, 1]
+
+    dlat = lat[:, None] - lat_d[None, :]
+    dlng = lng[:, None] - lng_d[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat_d)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def calibrate_road_factor(mode="driving", sample_size=5000):
+    """
+    Estima el factor de desvío (mediana de distancia Google / gran círculo)
+    a partir de los pares guardados en la caché de distancias.
+
+    Returns:
+        float, o None si no hay pares suficientes.
+    """
+    from .models import DistanciaCache
+
+    pares = list(
+        DistanciaCache.objects.filter(modo=mode, distancia_km__gt=0)
+        .order_by('-ultimo_uso')
+        .values_list('origen', 'destino', 'distancia_km')[:sample_size]
+    )
+    if len(pares) < 10:
+        return None
+
+    origenes = np.array([[float(v) for v in o.split(',')] for o, _, _ in pares])
+    destinos = np.array([[float(v) for v in d.split(',')] for _, d, _ in pares])
+    ruta = np.array([km for _, _, km in pares])
+
+    o = np.radians(origenes)
+    d = np.radians(destinos)
+    a = (
+        np.sin((d[:, 0] - o[:, 0]) / 2) ** 2
+        + np.cos(o[:, 0]) * np.cos(d[:, 0]) * np.sin((d[:, 1] - o[:, 1]) / 2) ** 2
+    )
+    recta = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    validos = recta > 0.05  # evita pares casi idénticos
+    if validos.sum() < 10:
+        return None
+    return float(np.median(ruta[validos] / recta[validos]))
+
+
+# --- Selección de proveedor ---
+
+def get_provider(api_key=None, name=None, use_cache=True, symmetric=False):
+    """
+    Construye el proveedor configurado en settings.RUTAS_DISTANCE_PROVIDER:
+    - "google":    Google sin caché
+    - "cached":    Google con caché persistente (por defecto)
+    - "haversine": estimador local
+    """
+    name = name or getattr(settings, 'RUTAS_DISTANCE_PROVIDER', CachedDistanceProvider.name)
+
+    if name == HaversineDistanceProvider.name:
+        return HaversineDistanceProvider()
+
+    google = GoogleDistanceProvider(api_key, symmetric=symmetric)
+    if name == GoogleDistanceProvider.name or not use_cache:
+        return google
+    return CachedDistanceProvider(google)
@@ -0,0 +1,110 @@
+# rutas/escenarios.py
+"""
+Comparación de escenarios (origen, destino) para una misma selección de
+puntos: qué bodega conviene como salida y llegada.
+
+Todos los candidatos van en una sola matriz (services.evaluar_escenarios
+la arma una vez); cada escenario toma su submatriz [origen] + paradas +
+[destino] con np.ix_ y se resuelve igual que una optimización normal
+(TSP o CVRP). Los escenarios se reparten en un ProcessPoolExecutor: la
+matriz se entrega una vez por proceso en el initializer, como en
+rutas.multistart. Se usa el contexto spawn (igual que rutas.jobs), así que
+cada proceso configura Django antes de importar el optimizador.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Con menos paradas cada escenario se resuelve en milisegundos y levantar
+# los procesos (spawn + django.setup) cuesta más que resolverlos en serie
+MIN_PUNTOS_POOL = 12
+
+# Estado de cada proceso del pool (se llena en _init_worker)
+_worker = {}
+
+
+def evaluar(distance_matrix, puntos_idx, escenarios, params, workers=None):
+    """
+    Args:
+        distance_matrix: matriz con todos los candidatos y las paradas
+        puntos_idx: índices de las paradas en la matriz
+        escenarios: lista de (origen_idx, destino_idx)
+        params: 'num_vehiculos', 'capacidad_kg', 'rendimiento', 'demandas'
+            (kg por parada, alineado con puntos_idx; None con un vehículo),
+            y 'time_limit_ms'
+        workers: procesos (None = os.cpu_count(); 1 = en este proceso, igual
+            que con menos de MIN_PUNTOS_POOL paradas)
+
+    Returns:
+        una entrada por escenario, en el mismo orden: {'distancia_km',
+        'litros', 'sin_asignar' (paradas sin capacidad), 'ms'}
+    """
+    tasks = list(enumerate(escenarios))
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    distance_matrix = np.asarray(distance_matrix)
+    puntos_idx = np.asarray(puntos_idx, dtype=np.intp)
+
+    if workers <= 1 or len(puntos_idx) < MIN_PUNTOS_POOL:
+        _init_worker(distance_matrix, puntos_idx, params)
+        try:
+            return [_resolver(task) for task in tasks]
+        finally:
+            _worker.clear()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(distance_matrix, puntos_idx, params),
+    ) as pool:
+        return list(pool.map(_resolver, tasks))
+
+
+def _init_worker(distance_matrix, puntos_idx, params):
+    from django.apps import apps
+
+    if not apps.ready:
+        import django
+        django.setup()
+    _worker.update(d=distance_matrix, puntos_idx=puntos_idx, params=params)
+
+
+def _resolver(task):
+    # Import diferido: en un proceso spawn los modelos (vía el optimizador)
+    # recién se pueden importar después de django.setup()
+    from . import cvrp, optimizer
+
+    _, (origen, destino) = task
+    params = _worker['params']
+    puntos_idx = _worker['puntos_idx']
+    k = len(puntos_idx)
+    orden = np.concatenate(([origen], puntos_idx, [destino]))
+    d = _worker['d'][np.ix_(orden, orden)]
+
+    t0 = time.perf_counter()
+    if params['num_vehiculos'] == 1:
+        _, distancia_km = optimizer.solve_tsp(
+            d, k, start_index=0, end_index=k + 1, time_limit_ms=params['time_limit_ms'],
+        )
+        litros = optimizer.calculate_fuel_cost(distancia_km, params['rendimiento'])
+        sin_asignar = 0
+    else:
+        vehiculos = [
+            {'capacidad_kg': params['capacidad_kg'], 'rendimiento_km_por_litro': params['rendimiento']}
+            for _ in range(params['num_vehiculos'])
+        ]
+        resultado = cvrp.solve_cvrp(
+            d, [0.0] + list(params['demandas']) + [0.0], vehiculos, depot=0, end_index=k + 1,
+        )
+        distancia_km, litros = resultado['distancia_total_km'], resultado['litros_total']
+        sin_asignar = len(resultado['sin_asignar'])
+
+    return {
+        'distancia_km': float(distancia_km),
+        'litros': float(litros),
+        'sin_asignar': sin_asignar,
+        'ms': (time.perf_counter() - t0) * 1000,
+    }
@@ -0,0 +1,159 @@
+# rutas/geocoding.py
+"""
+Geocodificación con caché persistente (en BD) por dirección normalizada.
+
+- normalizar() deja la dirección en minúsculas, sin tildes, sin puntuación y
+  con espacios simples, así "Av. Colón 123, Concepción" y
+  "av colon 123 concepcion" comparten entrada.
+- Cada entrada vence después de un TTL (RUTAS_GEOCODE_CACHE_TTL_DAYS).
+- Solo se guardan resultados OK: un ZERO_RESULTS se vuelve a consultar.
+- hits por entrada en la BD y contadores hit/miss del proceso (estadisticas()).
+"""
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import maps_client
+from .models import GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_DAYS = 90
+
+_contadores = Counter()
+_contadores_lock = threading.Lock()
+
+
+class GeocodingError(Exception):
+    """La API respondió pero sin resultado utilizable; estado = status de Google."""
+
+    def __init__(self, direccion, estado):
+        super().__init__(f"No se pudo geocodificar '{direccion}' (estado: {estado})")
+        self.direccion = direccion
+        self.estado = estado
+
+
+def normalizar(direccion):
+    """Llave de caché: minúsculas, sin tildes ni puntuación, espacios simples."""
+    texto = unicodedata.normalize('NFKD', direccion or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r"[^\w#]+", " ", texto)
+    return " ".join(texto.split())[:255]
+
+
+def _ttl():
+    return timedelta(days=getattr(settings, 'RUTAS_GEOCODE_CACHE_TTL_DAYS', DEFAULT_TTL_DAYS))
+
+
+def _contar(evento, n=1):
+    with _contadores_lock:
+        _contadores[evento] += n
+
+
+def estadisticas():
+    """Hits y misses de caché en este proceso."""
+    with _contadores_lock:
+        return {'hits': _contadores['hits'], 'misses': _contadores['misses']}
+
+
+def lookup(direcciones):
+    """
+    Busca varias direcciones en caché.
+
+    Returns:
+        dict {direccion_normalizada: (lat, lng)} solo con entradas vigentes.
+    """
+    llaves = sorted({normalizar(d) for d in direcciones} - {''})
+    if not llaves:
+        return {}
+
+    vigentes = GeocodeCache.objects.filter(
+        direccion_normalizada__in=llaves,
+        creado_en__gte=timezone.now() - _ttl(),
+    )
+    found = {
+        llave: (lat, lng)
+        for llave, lat, lng in vigentes.values_list('direccion_normalizada', 'latitud', 'longitud')
+    }
+
+    if found:
+        vigentes.update(hits=F('hits') + 1, ultimo_uso=timezone.now())
+    _contar('hits', len(found))
+    _contar('misses', len(llaves) - len(found))
+    return found
+
+
+def store(entries):
+    """
+    Guarda (o refresca) resultados.
+
+    Args:
+        entries: iterable de (direccion, lat, lng)
+    """
+    now = timezone.now()
+    unicos = {normalizar(d): (d, lat, lng) for d, lat, lng in entries}
+    unicos.pop('', None)
+
+    objs = [
+        GeocodeCache(
+            direccion_normalizada=llave,
+            direccion=direccion[:255],
+            latitud=float(lat),
+            longitud=float(lng),
+            creado_en=now,
+            ultimo_uso=now,
+        )
+        for llave, (direccion, lat, lng) in unicos.items()
+    ]
+    if not objs:
+        return 0
+
+    GeocodeCache.objects.bulk_create(
+        objs,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['direccion_normalizada'],
+        update_fields=['direccion', 'latitud', 'longitud', 'creado_en', 'ultimo_uso'],
+    )
+    return len(objs)
+
+
+def request_geocode(direccion, api_key):
+    """
+    Consulta la Geocoding API (sin caché), vía rutas.maps_client.
+
+    Returns:
+        (lat, lng)
+
+    Raises:
+        GeocodingError si la respuesta no trae resultados;
+        requests.exceptions.RequestException si falla la conexión.
+    """
+    data = maps_client.get_json('geocode', {"address": direccion, "key": api_key})
+
+    if data.get('status') == 'OK' and data.get('results'):
+        location = data['results'][0]['geometry']['location']
+        return float(location['lat']), float(location['lng'])
+    raise GeocodingError(direccion, data.get('status'))
+
+
+def geocodificar(direccion, api_key):
+    """
+    (lat, lng) de una dirección, desde la caché si está vigente.
+    Mismas excepciones que request_geocode.
+    """
+    cached = lookup([direccion]).get(normalizar(direccion))
+    if cached is not None:
+        logger.debug(f"Geocodificación en caché: {direccion}")
+        return cached
+
+    lat, lng = request_geocode(direccion, api_key)
+    store([(direccion, lat, lng)])
+    return lat, lng
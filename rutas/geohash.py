@@ -0,0 +1,64 @@
+# rutas/geohash.py
+"""
+Geohash de los puntos de entrega (columna PuntoEntrega.geohash, con índice).
+
+Puntos cercanos comparten prefijo, así un rectángulo del mapa se traduce en
+pocos rangos [prefijo, prefijo~) que la BD resuelve con el índice B-tree
+(ver rutas.spatial.filtrar_bbox).
+"""
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9  # celdas de ~5 m
+MAX_CELDAS = 32  # celdas por rectángulo en cubrir()
+
+
+def encode(lat, lng, precision=PRECISION):
+    lat, lng = float(lat), float(lng)
+    lat_rango, lng_rango = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, valor, par = [], 0, 0, True
+    while len(chars) < precision:
+        rango, coord = (lng_rango, lng) if par else (lat_rango, lat)
+        medio = (rango[0] + rango[1]) / 2
+        if coord >= medio:
+            valor = (valor << 1) | 1
+            rango[0] = medio
+        else:
+            valor <<= 1
+            rango[1] = medio
+        par = not par
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[valor])
+            bits, valor = 0, 0
+    return ''.join(chars)
+
+
+def tamano_celda(precision):
+    """(alto_grados_lat, ancho_grados_lng) de una celda."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def cubrir(sur, oeste, norte, este, max_celdas=MAX_CELDAS):
+    """
+    Prefijos de geohash cuyas celdas cubren el rectángulo, con la mayor
+    precisión que no pase de max_celdas (sin cruzar el antimeridiano).
+
+    Returns:
+        lista ordenada de prefijos ([] = cualquier punto, rectángulo demasiado grande)
+    """
+    mejor = []
+    for precision in range(1, PRECISION + 1):
+        alto, ancho = tamano_celda(precision)
+        filas = range(math.floor(sur / alto), math.floor(norte / alto) + 1)
+        columnas = range(math.floor(oeste / ancho), math.floor(este / ancho) + 1)
+        if len(filas) * len(columnas) > max_celdas:
+            break
+        # El centro de cada celda (la grilla de geohash calza con múltiplos del tamaño)
+        mejor = sorted({
+            encode(min((f + 0.5) * alto, 90.0), min((c + 0.5) * ancho, 180.0), precision)
+            for f in filas
+            for c in columnas
+        })
+    return mejor
@@ -0,0 +1,228 @@
+# rutas/importacion.py
+"""
+Importación masiva de puntos de entrega desde CSV.
+
+Columnas: nombre, direccion y opcionalmente latitud, longitud (encabezados
+sin distinguir mayúsculas; separador "," o ";").
+
+1) Se validan las filas; los errores se informan por número de fila.
+2) Se descartan duplicados (mismo nombre y dirección normalizados) contra la
+   BD y dentro del mismo archivo.
+3) Las filas sin coordenadas se geocodifican: primero la caché de
+   rutas.geocoding y luego, en paralelo, la API bajo un límite de requests
+   por segundo compartido entre hilos.
+4) Se inserta con bulk_create en lotes (con geohash) dentro de una sola
+   transacción, y al confirmarla se agregan los puntos al índice espacial
+   del proceso (rutas.spatial).
+
+Desde el mapa el CSV se importa en segundo plano (rutas.jobs), con tope de
+tamaño (RUTAS_IMPORT_MAX_BYTES) y de filas (RUTAS_IMPORT_MAX_FILAS); el
+comando importar_puntos no tiene tope.
+"""
+import csv
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import transaction
+
+from . import geocoding, geohash, spatial
+from .models import PuntoEntrega
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT = 40  # req/s (Google permite 50 QPS por proyecto)
+DEFAULT_MAX_WORKERS = 8
+BATCH_SIZE = 500
+DEFAULT_MAX_FILAS = 5000
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+MAX_ERRORES_RESUMEN = 50  # la sesión y el job no son lugar para miles de errores
+
+
+class _RateLimiter:
+    """Espacia las llamadas para no superar rate req/s entre todos los hilos."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def leer_csv(contenido):
+    """
+    Args:
+        contenido: texto del CSV
+
+    Returns:
+        lista de (numero_de_fila, dict) con llaves en minúsculas
+    """
+    contenido = contenido.lstrip('\ufeff')  # BOM de Excel
+    try:
+        dialect = csv.Sniffer().sniff(contenido[:4096], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.DictReader(io.StringIO(contenido), dialect=dialect)
+    return [
+        (numero, {(k or '').strip().lower(): (v or '').strip() for k, v in fila.items()})
+        for numero, fila in enumerate(reader, start=2)  # la fila 1 es el encabezado
+    ]
+
+
+def importar_puntos(filas, api_key, rate_limit=None, max_workers=None, batch_size=BATCH_SIZE):
+    """
+    Args:
+        filas: salida de leer_csv
+        api_key: clave de Google para las filas sin coordenadas
+        rate_limit: req/s a la Geocoding API (por defecto RUTAS_GEOCODE_RATE_LIMIT)
+        max_workers: hilos de geocodificación (por defecto RUTAS_GEOCODE_MAX_WORKERS)
+
+    Returns:
+        dict con 'creados', 'duplicados', 'desde_cache', 'geocodificados'
+        y 'errores' (lista de {'fila', 'mensaje'})
+    """
+    if rate_limit is None:
+        rate_limit = getattr(settings, 'RUTAS_GEOCODE_RATE_LIMIT', DEFAULT_RATE_LIMIT)
+    if max_workers is None:
+        max_workers = getattr(settings, 'RUTAS_GEOCODE_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+
+    resumen = {'creados': 0, 'duplicados': 0, 'desde_cache': 0, 'geocodificados': 0, 'errores': []}
+
+    def error(numero, mensaje):
+        resumen['errores'].append({'fila': numero, 'mensaje': mensaje})
+
+    # 1) VALIDAR
+    validas = []
+    for numero, fila in filas:
+        nombre = fila.get('nombre', '')
+        direccion = fila.get('direccion', '') or fila.get('dirección', '')
+        if not nombre or not direccion:
+            error(numero, 'Nombre y dirección son obligatorios.')
+            continue
+
+        lat, lng = fila.get('latitud', ''), fila.get('longitud', '')
+        coords = None
+        if lat or lng:
+            try:
+                coords = (float(lat.replace(',', '.')), float(lng.replace(',', '.')))
+            except ValueError:
+                error(numero, 'Latitud o Longitud con formato incorrecto.')
+                continue
+        validas.append((numero, nombre[:255], direccion[:255], coords))
+
+    # 2) DEDUPLICAR (contra la BD y dentro del archivo)
+    vistos = {
+        _llave(nombre, direccion)
+        for nombre, direccion in PuntoEntrega.objects.values_list('nombre', 'direccion')
+    }
+    nuevas = []
+    for numero, nombre, direccion, coords in validas:
+        llave = _llave(nombre, direccion)
+        if llave in vistos:
+            resumen['duplicados'] += 1
+            continue
+        vistos.add(llave)
+        nuevas.append((numero, nombre, direccion, coords))
+
+    # 3) GEOCODIFICAR LAS QUE NO TRAEN COORDENADAS
+    pendientes = {geocoding.normalizar(d): d for _, _, d, coords in nuevas if coords is None}
+    ubicaciones = geocoding.lookup(pendientes.values())
+    resumen['desde_cache'] = len(ubicaciones)
+
+    faltantes = [d for llave, d in pendientes.items() if llave not in ubicaciones]
+    fallas = {}
+    if faltantes:
+        obtenidas, fallas = _geocodificar_en_paralelo(faltantes, api_key, rate_limit, max_workers)
+        geocoding.store((d, lat, lng) for d, (lat, lng) in obtenidas.items())
+        ubicaciones.update({geocoding.normalizar(d): ll for d, ll in obtenidas.items()})
+        resumen['geocodificados'] = len(obtenidas)
+
+    # 4) INSERTAR EN LOTES
+    objs = []
+    for numero, nombre, direccion, coords in nuevas:
+        if coords is None:
+            llave = geocoding.normalizar(direccion)
+            coords = ubicaciones.get(llave)
+            if coords is None:
+                motivo = fallas.get(pendientes[llave], '')
+                error(numero, f"No se pudo geocodificar la dirección: {direccion}. {motivo}".strip())
+                continue
+        lat, lng = round(coords[0], 6), round(coords[1], 6)
+        objs.append(PuntoEntrega(
+            nombre=nombre,
+            direccion=direccion,
+            latitud=lat,
+            longitud=lng,
+            # bulk_create no pasa por save()
+            geohash=geohash.encode(lat, lng),
+        ))
+
+    # Todo o nada: un lote que falla no deja el archivo importado a medias
+    with transaction.atomic():
+        PuntoEntrega.objects.bulk_create(objs, batch_size=batch_size)
+        transaction.on_commit(lambda: spatial.registrar_puntos(objs))
+    resumen['creados'] = len(objs)
+    resumen['errores'].sort(key=lambda e: e['fila'])
+
+    logger.info(
+        f"Importación de puntos: {resumen['creados']} creados, {resumen['duplicados']} duplicados, "
+        f"{resumen['desde_cache']} desde caché, {resumen['geocodificados']} geocodificados, "
+        f"{len(resumen['errores'])} errores"
+    )
+    return resumen
+
+
+def resumen_para_mostrar(resumen):
+    """El resumen con solo los primeros MAX_ERRORES_RESUMEN errores y cuántos se omitieron."""
+    return {
+        **resumen,
+        'errores': resumen['errores'][:MAX_ERRORES_RESUMEN],
+        'errores_omitidos': max(0, len(resumen['errores']) - MAX_ERRORES_RESUMEN),
+    }
+
+
+def _llave(nombre, direccion):
+    return geocoding.normalizar(nombre), geocoding.normalizar(direccion)
+
+
+def _geocodificar_en_paralelo(direcciones, api_key, rate_limit, max_workers):
+    """
+    Returns:
+        ({direccion: (lat, lng)}, {direccion: motivo de la falla})
+    """
+    limiter = _RateLimiter(rate_limit)
+    obtenidas, fallas = {}, {}
+
+    def geocodificar(direccion):
+        limiter.wait()
+        try:
+            return direccion, geocoding.request_geocode(direccion, api_key), None
+        except geocoding.GeocodingError as e:
+            return direccion, None, f"Estado: {e.estado}"
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error geocodificando '{direccion}': {e}")
+            return direccion, None, f"Error de conexión: {e}"
+
+    # Conexiones: la Session compartida de rutas.maps_client
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for direccion, ubicacion, motivo in pool.map(geocodificar, direcciones):
+            if ubicacion is None:
+                fallas[direccion] = motivo
+            else:
+                obtenidas[direccion] = ubicacion
+
+    return obtenidas, fallas
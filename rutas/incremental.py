@@ -0,0 +1,132 @@
+# rutas/incremental.py
+"""
+Re-optimización incremental de una ruta (un vehículo) ya optimizada.
+
+Agregar o borrar una parada no justifica resolver de cero: el orden actual
+ya es casi óptimo.
+1) Las paradas borradas se sacan de la ruta (sus vecinos quedan unidos).
+2) Cada parada nueva se inserta en la posición más barata
+   (d[a, n] + d[n, b] - d[a, b], evaluado en todos los arcos con numpy).
+3) Búsqueda local corta (rutas.local_search con deadline) partiendo del
+   orden resultante, con los don't-look bits activos solo en los nodos
+   tocados: vecinos de las paradas borradas, la parada nueva, sus vecinos
+   en la ruta y sus paradas más cercanas en el mapa (KD-tree de
+   rutas.spatial).
+
+La matriz la arma quien llama (services.reoptimizar_incremental) sin pedir
+los n x n pares: las filas y columnas de los nodos tocados, los pares del
+vecindario() que revisa la búsqueda local y los arcos de la ruta actual
+(tramos ya guardados, solo en su sentido). El resto, incluido el sentido
+contrario de esos tramos, queda en inf, así ningún movimiento que lo use
+mejora.
+"""
+import time
+
+import numpy as np
+
+from . import local_search, spatial
+
+CANDIDATOS_GEOGRAFICOS = 8
+DEFAULT_TIME_LIMIT_MS = 200
+
+
+def reoptimizar(distance_matrix, route, nuevos=(), activos=(), coords=None, methods=None,
+                time_limit_ms=DEFAULT_TIME_LIMIT_MS):
+    """
+    Args:
+        distance_matrix: matriz completa (incluye las paradas nuevas)
+        route: orden actual con origen y destino, sin las paradas borradas
+            ni las nuevas
+        nuevos: índices de la matriz a insertar
+        activos: nodos a revisar aunque no haya nuevos (vecinos de las
+            paradas borradas)
+        coords: [lat, lng] por índice de la matriz, para sumar a los
+            activos las paradas cercanas a cada nueva
+        methods: movimientos de búsqueda local
+        time_limit_ms: presupuesto de la búsqueda local
+
+    Returns:
+        (ruta, estadisticas) con 'insertados', 'activos' y 'ms'
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + time_limit_ms / 1000.0
+    d = local_search.cost_array(distance_matrix)
+    route = list(route)
+    activos = set(activos)
+
+    tree = _arbol(coords) if coords is not None and nuevos else None
+
+    for nodo in nuevos:
+        route, pos = insertar_mas_barato(d, route, nodo)
+        activos.update((nodo, route[pos - 1], route[pos + 1]))
+        if tree is not None:
+            _, cercanos = tree.query(tree.points[nodo], CANDIDATOS_GEOGRAFICOS + 1)
+            activos.update(int(c) for c in cercanos)
+
+    # Solo paradas de la ruta (no índices de paradas ya borradas)
+    en_ruta = set(route)
+    activos = sorted(a for a in activos if a in en_ruta)
+
+    if len(route) > 3 and activos:
+        methods = methods or local_search.DEFAULT_LOCAL_SEARCH
+        route = local_search.improve(
+            d, route, methods,
+            neighbors=local_search.neighbor_lists(d),
+            deadline=deadline,
+            active=activos,
+        )
+
+    return route, {
+        'insertados': len(nuevos),
+        'activos': len(activos),
+        'ms': (time.perf_counter() - t0) * 1000,
+    }
+
+
+def insertar_mas_barato(d, route, nodo):
+    """
+    Inserta nodo entre el par consecutivo (a, b) que menos alarga la ruta.
+
+    Returns:
+        (ruta_nueva, posición del nodo en ruta_nueva)
+    """
+    r = np.asarray(route, dtype=np.intp)
+    delta = d[r[:-1], nodo] + d[nodo, r[1:]] - d[r[:-1], r[1:]]
+    pos = int(np.argmin(delta)) + 1
+    return route[:pos] + [nodo] + route[pos:], pos
+
+
+def vecindario(coords, route, nodos):
+    """
+    Nodos cuyos pares entre sí puede revisar la búsqueda local alrededor de
+    nodos: ellos, sus CANDIDATOS_GEOGRAFICOS paradas más cercanas y los
+    vecinos en la ruta de todos esos (extremos de los arcos que crearía un
+    2-opt u or-opt).
+
+    Args:
+        coords: [lat, lng] por índice de la matriz
+        route: orden actual (sin los nodos nuevos)
+        nodos: índices tocados (nuevos y vecinos de paradas borradas)
+
+    Returns:
+        lista ordenada de índices de la matriz
+    """
+    if not nodos:
+        return []
+    tree = _arbol(coords)
+    cerca = set(nodos)
+    for nodo in nodos:
+        _, cercanos = tree.query(tree.points[nodo], CANDIDATOS_GEOGRAFICOS + 1)
+        cerca.update(int(c) for c in cercanos)
+
+    anterior = dict(zip(route[1:], route[:-1]))
+    siguiente = dict(zip(route[:-1], route[1:]))
+    resultado = set(cerca)
+    for nodo in cerca:
+        resultado.update(v for v in (anterior.get(nodo), siguiente.get(nodo)) if v is not None)
+    return sorted(resultado)
+
+
+def _arbol(coords):
+    puntos = np.asarray(coords, dtype=np.float64)
+    return spatial.KDTree(spatial.unit_vectors(puntos[:, 0], puntos[:, 1]))
@@ -0,0 +1,313 @@
+# rutas/jobs.py
+"""
+Optimizaciones de ruta en segundo plano.
+
+optimizar_ruta solo crea un OptimizacionJob y lo encola: la geocodificación,
+la matriz, el TSP/CVRP, el guardado del plan y su geometría (Directions)
+corren en un pool local de procesos (ProcessPoolExecutor con contexto spawn,
+así ningún proceso hereda hilos ni conexiones a la BD del servidor web). El navegador consulta el
+estado por JSON (views.optimizacion_estado) o, con el solver anytime, sigue
+las mejoras por SSE (views.optimizar_ruta_stream lee OptimizacionJob.progreso).
+
+La misma cola importa CSV (encolar_importacion) y traza por calles los
+planes que se rehacen al agregar o borrar un punto (encolar_trazado).
+
+Con settings.RUTAS_JOB_WORKERS = 0 el job se ejecuta en el mismo proceso
+al confirmar la transacción (útil en tests y desarrollo).
+
+Mientras corre, un hilo renueva OptimizacionJob.actualizado_en (latido). Un
+job sin latido por más de RUTAS_JOB_STALE_S quedó huérfano (el proceso murió
+o el despacho se perdió con un reinicio): recuperar_huerfanos, que corre al
+encolar y al consultar el estado, marca con error los que estaban en proceso
+y vuelve a despachar los pendientes.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.datastructures import MultiValueDict
+
+from . import importacion, services, tiempos
+from .models import OptimizacionJob, RutaPlan
+
+logger = logging.getLogger(__name__)
+
+PROGRESO_INTERVALO_S = 0.25  # a lo más una escritura de progreso por intervalo
+DEFAULT_STALE_S = 300
+LATIDOS_POR_PLAZO = 4  # latidos dentro de RUTAS_JOB_STALE_S, para tolerar alguno atrasado
+ERROR_HUERFANO = 'La optimización se interrumpió antes de terminar. Vuelve a intentarlo.'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def encolar(usuario, data):
+    """
+    Crea el job con los campos del formulario (QueryDict) y lo manda al pool
+    cuando la transacción se confirma.
+
+    Returns:
+        OptimizacionJob en estado pendiente
+    """
+    recuperar_huerfanos()
+    job = OptimizacionJob.objects.create(
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        parametros={campo: data.getlist(campo) for campo in data if campo != 'csrfmiddlewaretoken'},
+    )
+    transaction.on_commit(lambda: _despachar(job.pk))
+    logger.info(f"Optimización #{job.pk} encolada")
+    return job
+
+
+def encolar_importacion(usuario, archivo, contenido):
+    """
+    Encola la importación de un CSV (rutas.importacion) ya leído como texto.
+
+    Returns:
+        OptimizacionJob de tipo importacion en estado pendiente
+    """
+    recuperar_huerfanos()
+    job = OptimizacionJob.objects.create(
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        tipo=OptimizacionJob.Tipo.IMPORTACION,
+        parametros={'archivo': archivo, 'contenido': contenido},
+    )
+    transaction.on_commit(lambda: _despachar(job.pk))
+    logger.info(f"Importación #{job.pk} ({archivo}) encolada")
+    return job
+
+
+def encolar_trazado(usuario, ruta_plan):
+    """
+    Encola la geometría por calles (services.trazar_ruta) de un plan ya
+    guardado; mientras tanto el mapa une las paradas con líneas rectas.
+
+    Returns:
+        OptimizacionJob de tipo trazado en estado pendiente
+    """
+    recuperar_huerfanos()
+    job = OptimizacionJob.objects.create(
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        tipo=OptimizacionJob.Tipo.TRAZADO,
+        parametros={'plan_id': ruta_plan.pk},
+    )
+    transaction.on_commit(lambda: _despachar(job.pk))
+    logger.info(f"Trazado del plan #{ruta_plan.pk} encolado (job #{job.pk})")
+    return job
+
+
+def ejecutar(job_id):
+    """
+    Ejecuta un job pendiente. Se marca en proceso con un UPDATE condicional,
+    así un job nunca corre dos veces aunque se despache de nuevo.
+    """
+    close_old_connections()
+    ahora = timezone.now()
+    tomado = OptimizacionJob.objects.filter(
+        pk=job_id, estado=OptimizacionJob.Estado.PENDIENTE
+    ).update(estado=OptimizacionJob.Estado.EN_PROCESO, iniciado_en=ahora, actualizado_en=ahora)
+    if not tomado:
+        return
+
+    job = OptimizacionJob.objects.get(pk=job_id)
+    medicion = tiempos.Medicion()
+    with _latido(job.pk):
+        _EJECUTORES[job.tipo](job, medicion)
+
+    # Con error también: muestra en qué etapa se fue el tiempo
+    job.tiempos = medicion.resumen()
+    job.terminado_en = timezone.now()
+    job.save(update_fields=[
+        'estado', 'parametros', 'resultado', 'error', 'tiempos', 'terminado_en', 'actualizado_en',
+    ])
+
+
+def _optimizar(job, medicion):
+    try:
+        plan = services.preparar_optimizacion(
+            MultiValueDict(job.parametros), settings.GOOGLE_MAPS_API_KEY, medicion
+        )
+        solucion = services.resolver(plan, on_improve=_registrar_progreso(job.pk, services.coordenadas_matriz(plan)))
+        ruta_plan = services.guardar_resultado(plan, solucion, job.usuario)
+        services.trazar_ruta(ruta_plan, settings.GOOGLE_MAPS_API_KEY, medicion)
+
+        job.estado = OptimizacionJob.Estado.COMPLETADO
+        job.resultado = {'plan_id': ruta_plan.pk}
+        logger.info(
+            f"Optimización #{job.pk}: {ruta_plan.distancia_total_km:.2f} km, {ruta_plan.litros:.2f} L, "
+            f"${ruta_plan.costo_clp:.0f} CLP ({medicion.resumen()})"
+        )
+    except services.OptimizacionError as e:
+        job.estado = OptimizacionJob.Estado.ERROR
+        job.error = str(e)
+    except Exception as e:
+        logger.error(f"Error inesperado en optimización #{job.pk}: {e}", exc_info=True)
+        job.estado = OptimizacionJob.Estado.ERROR
+        job.error = 'No se pudo optimizar la ruta. Verifica los puntos o el algoritmo.'
+
+
+def _importar(job, medicion):
+    try:
+        with medicion.etapa('importar') as etapa:
+            filas = importacion.leer_csv(job.parametros['contenido'])
+            resumen = importacion.importar_puntos(filas, settings.GOOGLE_MAPS_API_KEY)
+            etapa['filas'] = len(filas)
+
+        job.estado = OptimizacionJob.Estado.COMPLETADO
+        job.resultado = importacion.resumen_para_mostrar(resumen)
+        logger.info(
+            f"Importación #{job.pk} ({job.parametros['archivo']}): {resumen['creados']} puntos creados, "
+            f"{len(resumen['errores'])} errores"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado en importación #{job.pk}: {e}", exc_info=True)
+        job.estado = OptimizacionJob.Estado.ERROR
+        job.error = 'No se pudo importar el archivo.'
+    # El CSV ya no hace falta: no dejarlo ocupando la tabla de jobs
+    job.parametros = {'archivo': job.parametros['archivo']}
+
+
+def _trazar(job, medicion):
+    try:
+        ruta_plan = RutaPlan.objects.get(pk=job.parametros['plan_id'])
+        polilineas = services.trazar_ruta(ruta_plan, settings.GOOGLE_MAPS_API_KEY, medicion)
+
+        job.estado = OptimizacionJob.Estado.COMPLETADO
+        job.resultado = {'plan_id': ruta_plan.pk, 'polilineas': polilineas}
+    except RutaPlan.DoesNotExist:
+        job.estado = OptimizacionJob.Estado.ERROR
+        job.error = 'El plan se borró antes de trazarlo.'
+    except Exception as e:
+        logger.error(f"Error inesperado en el trazado #{job.pk}: {e}", exc_info=True)
+        job.estado = OptimizacionJob.Estado.ERROR
+        job.error = 'No se pudo trazar la ruta.'
+
+
+_EJECUTORES = {
+    OptimizacionJob.Tipo.OPTIMIZACION: _optimizar,
+    OptimizacionJob.Tipo.IMPORTACION: _importar,
+    OptimizacionJob.Tipo.TRAZADO: _trazar,
+}
+
+
+def recuperar_huerfanos():
+    """
+    Jobs sin latido hace más de RUTAS_JOB_STALE_S: los en proceso se marcan
+    con error y los pendientes se despachan de nuevo (ejecutar no corre dos
+    veces el mismo job, así que reencolar de más no hace daño).
+
+    Returns:
+        (marcados con error, reencolados)
+    """
+    ahora = timezone.now()
+    limite = ahora - timedelta(seconds=_stale_s())
+    marcados = OptimizacionJob.objects.filter(
+        estado=OptimizacionJob.Estado.EN_PROCESO, actualizado_en__lt=limite
+    ).update(estado=OptimizacionJob.Estado.ERROR, error=ERROR_HUERFANO, terminado_en=ahora, actualizado_en=ahora)
+
+    reencolados = 0
+    pendientes = OptimizacionJob.objects.filter(estado=OptimizacionJob.Estado.PENDIENTE, actualizado_en__lt=limite)
+    for job_id in pendientes.values_list('pk', flat=True):
+        # Renovar el latido al tomarlo: otro llamador no lo reencola de nuevo
+        if pendientes.filter(pk=job_id).update(actualizado_en=ahora):
+            transaction.on_commit(lambda job_id=job_id: _despachar(job_id))
+            reencolados += 1
+
+    if marcados or reencolados:
+        logger.warning(f"Jobs huérfanos: {marcados} marcados con error, {reencolados} reencolados")
+    return marcados, reencolados
+
+
+def _stale_s():
+    return getattr(settings, 'RUTAS_JOB_STALE_S', DEFAULT_STALE_S)
+
+
+@contextmanager
+def _latido(job_id):
+    """Renueva actualizado_en del job en un hilo aparte mientras dura el bloque."""
+    parar = threading.Event()
+
+    def latir():
+        try:
+            while not parar.wait(_stale_s() / LATIDOS_POR_PLAZO):
+                OptimizacionJob.objects.filter(pk=job_id).update(actualizado_en=timezone.now())
+        finally:
+            connections.close_all()  # solo las conexiones de este hilo
+
+    hilo = threading.Thread(target=latir, name=f"latido-job-{job_id}", daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        parar.set()
+        hilo.join()
+
+
+def _registrar_progreso(job_id, coords):
+    """Callback on_improve que guarda la última mejora en el job (sin saturar la BD)."""
+    ultima = [None]
+
+    def registrar(mejora):
+        ahora = time.monotonic()
+        if ultima[0] is not None and ahora - ultima[0] < PROGRESO_INTERVALO_S:
+            return
+        ultima[0] = ahora
+        OptimizacionJob.objects.filter(pk=job_id).update(actualizado_en=timezone.now(), progreso={
+            'costo': round(mejora['costo'], 3),
+            'ms': round(mejora['ms']),
+            'iteracion': mejora['iteracion'],
+            'ruta': [coords[i] for i in mejora['ruta']],
+        })
+
+    return registrar
+
+
+def _despachar(job_id):
+    workers = getattr(settings, 'RUTAS_JOB_WORKERS', 2)
+    if workers <= 0:
+        ejecutar(job_id)
+        return
+    try:
+        future = _get_pool(workers).submit(ejecutar, job_id)
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. sin memoria): se arma un pool nuevo
+        _reset_pool()
+        future = _get_pool(workers).submit(ejecutar, job_id)
+    future.add_done_callback(_log_falla)
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                # django.setup directo: un initializer de este módulo obligaría a
+                # importar los modelos antes de configurar Django
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _log_falla(future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"El pool de optimización falló: {error}")
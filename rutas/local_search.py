@@ -0,0 +1,563 @@
+# rutas/local_search.py
+"""
+Movimientos de búsqueda local para rutas con origen y fin fijos.
+
+Todas las funciones reciben:
+- d: matriz de costos ndarray (ver cost_array), posiblemente asimétrica
+- route: secuencia de índices; route[0] y route[-1] (depósitos) no se mueven
+
+y devuelven una nueva ruta (lista) que es óptimo local del movimiento.
+
+- two_opt:  inversión de segmentos (delta O(1) con sumas prefijo en ambos sentidos)
+- or_opt:   reubicación de segmentos de 1..3 nodos sin invertirlos
+- or3_opt:  3-opt "segment swap" (A B C D -> A C B D), la reconexión 3-opt
+            que conserva el sentido de todos los tramos (segura en asimétrico)
+- lk:       Lin-Kernighan sobre 2-opt: desde el óptimo de two_opt encadena
+            inversiones con el criterio de ganancia parcial positiva y se
+            queda con el mejor prefijo de la cadena
+
+Para instancias grandes (> CANDIDATE_THRESHOLD nodos) los movimientos reciben
+listas de vecinos candidatos (neighbor_lists): solo se prueban arcos nuevos
+hacia los k nodos más cercanos, y 2-opt / Or-opt / 3-opt usan don't-look
+bits (una cola de nodos activos que se reactivan cuando cambia un arco
+vecino). Los movimientos se aplican en el lugar: posiciones y sumas prefijo
+se actualizan solo sobre el tramo invertido o desplazado.
+
+Todos aceptan deadline (time.perf_counter() límite): al vencer cortan y
+devuelven la mejor ruta hasta ese momento, que siempre es válida. Todos
+aceptan además active: los nodos desde los que parte la búsqueda (por
+defecto todos), útil tras una perturbación local.
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+UNREACHABLE_PENALTY = 1e7  # km ficticios para pares sin ruta dentro de la búsqueda local
+IMPROVEMENT_EPS = 1e-6     # mejoras menores a 1 mm se ignoran (evita ciclos por redondeo)
+OR_OPT_MAX_SEGMENT = 3
+LK_MAX_DEPTH = 6
+CANDIDATE_THRESHOLD = 150  # desde aquí se usan listas de vecinos
+CANDIDATE_K = 10
+
+
+def cost_array(distance_matrix):
+    """ndarray float64 con los pares sin ruta (inf) reemplazados por una penalización finita."""
+    d = np.asarray(distance_matrix, dtype=np.float64)
+    return np.where(np.isfinite(d), d, UNREACHABLE_PENALTY)
+
+
+def route_cost(d, route):
+    """Costo total de la ruta sobre la matriz de costos."""
+    route = np.asarray(route, dtype=np.intp)
+    return float(d[route[:-1], route[1:]].sum())
+
+
+def prefix_costs(d, route):
+    """
+    Sumas prefijo de los arcos de la ruta:
+    fwd[k] = costo de route[0] -> ... -> route[k]
+    bwd[k] = costo del mismo tramo recorrido al revés
+    """
+    fwd = np.zeros(len(route))
+    bwd = np.zeros(len(route))
+    np.cumsum(d[route[:-1], route[1:]], out=fwd[1:])
+    np.cumsum(d[route[1:], route[:-1]], out=bwd[1:])
+    return fwd, bwd
+
+
+def neighbor_lists(d, k=CANDIDATE_K):
+    """
+    Los k nodos más cercanos a cada nodo (sin incluirse a sí mismo),
+    ordenados por cercanía. Se usa min(d, d.T) como proximidad.
+
+    Returns:
+        ndarray (n, k) de índices.
+    """
+    n = d.shape[0]
+    k = max(1, min(k, n - 1))
+    prox = np.minimum(d, d.T)
+    np.fill_diagonal(prox, np.inf)
+
+    idx = np.argpartition(prox, k - 1, axis=1)[:, :k]
+    rows = np.arange(n)[:, None]
+    order = np.argsort(prox[rows, idx], axis=1)
+    return idx[rows, order]
+
+
+def _expired(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def _positions(route, size):
+    """pos[nodo] = posición en la ruta (el origen de un ciclo cerrado queda en 0)."""
+    pos = np.full(size, -1, dtype=np.intp)
+    pos[route[::-1]] = np.arange(len(route) - 1, -1, -1)
+    return pos
+
+
+def _candidates(d, neighbors, active):
+    """
+    Listas de vecinos a usar: las dadas o, si solo viene active, todos los
+    nodos (así los don't-look bits se respetan también sin listas de vecinos).
+    """
+    if neighbors is None and active is not None:
+        return neighbor_lists(d, k=d.shape[0] - 1)
+    return neighbors
+
+
+class _ActiveNodes:
+    """Don't-look bits: cola de nodos cuyo vecindario vale la pena revisar."""
+
+    def __init__(self, nodes, size):
+        self.queue = deque(int(x) for x in nodes)
+        self.active = np.zeros(size, dtype=bool)
+        self.active[list(self.queue)] = True
+
+    def __bool__(self):
+        return bool(self.queue)
+
+    def pop(self):
+        node = self.queue.popleft()
+        self.active[node] = False
+        return node
+
+    def push(self, *nodes):
+        for node in nodes:
+            node = int(node)
+            if not self.active[node]:
+                self.active[node] = True
+                self.queue.append(node)
+
+
+def _reverse(d, route, i, j, fwd, bwd, pos=None):
+    """
+    Invierte route[i:j] en el lugar. Las sumas prefijo se recalculan solo
+    sobre los arcos del tramo (i-1 .. j); después de j solo cambia una
+    constante, que se suma de una vez. pos se actualiza solo en el tramo.
+    """
+    route[i:j] = route[i:j][::-1]
+    if pos is not None:
+        pos[route[i:j]] = np.arange(i, j)
+
+    tramo = route[i - 1:j + 1]
+    for prefix, a, b in ((fwd, tramo[:-1], tramo[1:]), (bwd, tramo[1:], tramo[:-1])):
+        antes = prefix[j]
+        np.cumsum(d[a, b], out=prefix[i:j + 1])
+        prefix[i:j + 1] += prefix[i - 1]
+        if j + 1 < len(prefix):
+            prefix[j + 1:] += prefix[j] - antes
+
+
+def _move_segment(route, i, length, k, pos=None):
+    """
+    Mueve route[i:i+length] (sin invertir) para quedar entre route[k] y
+    route[k+1], en el lugar: solo se desplazan los nodos entre el segmento y
+    el punto de inserción (y solo ahí se actualiza pos).
+    """
+    segment = route[i:i + length].copy()
+    if k > i:
+        route[i:k + 1 - length] = route[i + length:k + 1]
+        route[k + 1 - length:k + 1] = segment
+        lo, hi = i, k + 1
+    else:
+        route[k + 1 + length:i + length] = route[k + 1:i]
+        route[k + 1:k + 1 + length] = segment
+        lo, hi = k + 1, i + length
+    if pos is not None:
+        pos[route[lo:hi]] = np.arange(lo, hi)
+
+
+# --- 2-opt ---
+
+def two_opt(d, route, neighbors=None, deadline=None, active=None):
+    """
+    Invierte segmentos [i:j]. Para cada i se evalúan todos los j de una vez
+    y se aplica el mejor; se repite hasta que ninguna inversión mejore.
+    Con neighbors (o active) usa candidatos + don't-look bits (ver
+    _two_opt_neighbors).
+    """
+    best_route = np.asarray(route, dtype=np.intp).copy()
+    n = len(best_route)
+    if n < 5:
+        return best_route.tolist()
+    neighbors = _candidates(d, neighbors, active)
+    if neighbors is not None:
+        return _two_opt_neighbors(d, best_route, neighbors, deadline, active)
+
+    fwd, bwd = prefix_costs(d, best_route)
+    improved = True
+
+    while improved:
+        improved = False
+        for i in range(1, n - 2):
+            if _expired(deadline):
+                return best_route.tolist()
+            # Invertir segmento [i:j] para j en i+2..n-1
+            js = np.arange(i + 2, n)
+            a, b = best_route[i - 1], best_route[i]
+            c, e = best_route[js - 1], best_route[js]
+
+            delta = (
+                d[a, c] + d[b, e] - d[a, b] - d[c, e]
+                + (bwd[js - 1] - bwd[i]) - (fwd[js - 1] - fwd[i])
+            )
+
+            k = int(np.argmin(delta))
+            if delta[k] < -IMPROVEMENT_EPS:
+                _reverse(d, best_route, i, int(js[k]), fwd, bwd)
+                improved = True
+
+    return best_route.tolist()
+
+
+def _two_opt_neighbors(d, route, neighbors, deadline=None, active=None):
+    """
+    2-opt restringido: para cada nodo activo x solo se prueban inversiones
+    que crean un arco x -> c con c entre los vecinos de x (x como extremo
+    antes o después del segmento invertido).
+    """
+    n = len(route)
+    pos = _positions(route, d.shape[0])
+    fwd, bwd = prefix_costs(d, route)
+    active = _ActiveNodes(route[1:-1] if active is None else active, d.shape[0])
+
+    while active and not _expired(deadline):
+        x = active.pop()
+        px = pos[x]
+        cands = neighbors[x]
+        pc = pos[cands]
+
+        best = None
+
+        # x antes del segmento: arcos nuevos x -> c y b -> e, invierte [px+1 : pos[c]+1]
+        i = px + 1
+        js = pc[(pc >= i + 1) & (pc <= n - 2)] + 1
+        if len(js) and i <= n - 3:
+            b = route[i]
+            c, e = route[js - 1], route[js]
+            delta = (
+                d[x, c] + d[b, e] - d[x, b] - d[c, e]
+                + (bwd[js - 1] - bwd[i]) - (fwd[js - 1] - fwd[i])
+            )
+            k = int(np.argmin(delta))
+            best = (float(delta[k]), i, int(js[k]))
+
+        # x al inicio del segmento: arcos nuevos a -> c y x -> e, invierte [px : pos[e]]
+        i = px
+        js = pc[(pc >= i + 2) & (pc <= n - 1)]
+        if len(js) and i >= 1:
+            a = route[i - 1]
+            c, e = route[js - 1], route[js]
+            delta = (
+                d[a, c] + d[x, e] - d[a, x] - d[c, e]
+                + (bwd[js - 1] - bwd[i]) - (fwd[js - 1] - fwd[i])
+            )
+            k = int(np.argmin(delta))
+            if best is None or delta[k] < best[0]:
+                best = (float(delta[k]), i, int(js[k]))
+
+        if best is None or best[0] >= -IMPROVEMENT_EPS:
+            continue
+
+        _, i, j = best
+        _reverse(d, route, i, j, fwd, bwd, pos)
+        active.push(x, route[i - 1], route[i], route[j - 1], route[j])
+
+    return route.tolist()
+
+
+# --- Or-opt ---
+
+def _best_relocation(d, route, i, length, ks=None):
+    """
+    Mejor reubicación del segmento route[i:i+length] (sin invertir),
+    entre todos los arcos o solo los arcos candidatos ks.
+
+    Returns:
+        (delta, k, removal_gain): insertar entre route[k] y route[k+1];
+        removal_gain es lo que se ahorra al sacar el segmento.
+        (inf, -1, 0) si no hay destino válido.
+    """
+    n = len(route)
+    p, q = route[i - 1], route[i + length]
+    s0, s1 = route[i], route[i + length - 1]
+    removal_gain = d[p, s0] + d[s1, q] - d[p, q]
+
+    # Arcos (k, k+1) fuera del segmento y distintos de los arcos que lo rodean
+    if ks is None:
+        ks = np.arange(n - 1)
+    ks = ks[(ks < i - 1) | (ks > i + length - 1)]
+    if len(ks) == 0:
+        return float('inf'), -1, 0.0
+
+    a, b = route[ks], route[ks + 1]
+    delta = d[a, s0] + d[s1, b] - d[a, b] - removal_gain
+    best = int(np.argmin(delta))
+    return float(delta[best]), int(ks[best]), float(removal_gain)
+
+
+def or_opt(d, route, max_segment=OR_OPT_MAX_SEGMENT, neighbors=None, deadline=None, active=None):
+    """Reubica segmentos de 1..max_segment nodos mientras haya mejora."""
+    route = np.asarray(route, dtype=np.intp).copy()
+    n = len(route)
+    neighbors = _candidates(d, neighbors, active)
+    if neighbors is not None:
+        return _or_opt_neighbors(d, route, neighbors, max_segment, deadline, active)
+    improved = True
+
+    while improved:
+        improved = False
+        for length in range(1, max_segment + 1):
+            i = 1
+            while i + length <= n - 1:
+                if _expired(deadline):
+                    return route.tolist()
+                delta, k, _ = _best_relocation(d, route, i, length)
+                if delta < -IMPROVEMENT_EPS:
+                    _move_segment(route, i, length, k)
+                    improved = True
+                i += 1
+
+    return route.tolist()
+
+
+def _or_opt_neighbors(d, route, neighbors, max_segment, deadline=None, active=None):
+    """
+    Or-opt restringido a arcos candidatos, con don't-look bits por nodo
+    inicial del segmento. Los largos 1..max_segment se evalúan juntos: el
+    segmento route[i:i+L] se inserta en un arco (k, k+1) que crea un arco
+    hacia un vecino (c -> s0 o s1 -> c).
+    """
+    n = len(route)
+    pos = _positions(route, d.shape[0])
+    active = _ActiveNodes(route[1:-1] if active is None else active, d.shape[0])
+
+    while active and not _expired(deadline):
+        x = active.pop()
+        i = pos[x]
+        if i < 1 or i > n - 2:
+            continue
+
+        lengths = np.arange(1, min(max_segment, n - 1 - i) + 1)
+        p, s0 = route[i - 1], x
+        s1, q = route[i + lengths - 1], route[i + lengths]
+        removal_gain = d[p, s0] + d[s1, q] - d[p, q]
+
+        # Arcos candidatos por largo: después de un vecino de s0 o antes de un vecino de s1
+        k_s0 = pos[neighbors[s0]]
+        ks = np.concatenate([
+            np.broadcast_to(k_s0, (len(lengths), len(k_s0))),
+            pos[neighbors[s1]] - 1,
+        ], axis=1)
+        fila = np.broadcast_to(np.arange(len(lengths))[:, None], ks.shape)
+        valido = (ks >= 0) & (ks <= n - 2) & ((ks < i - 1) | (ks > i + lengths[:, None] - 1))
+        ks, fila = ks[valido], fila[valido]
+        if len(ks) == 0:
+            continue
+
+        delta = d[route[ks], s0] + d[s1[fila], route[ks + 1]] - d[route[ks], route[ks + 1]] - removal_gain[fila]
+        best = int(np.argmin(delta))
+        if delta[best] >= -IMPROVEMENT_EPS:
+            continue
+
+        length, k = int(lengths[fila[best]]), int(ks[best])
+        touched = [route[i - 1], route[i + length], route[k], route[k + 1]]
+        _move_segment(route, i, length, k, pos)
+        active.push(x, *touched)
+
+    return route.tolist()
+
+
+# --- 3-opt (segment swap) ---
+
+def or3_opt(d, route, neighbors=None, deadline=None, active=None):
+    """
+    Intercambia segmentos consecutivos B=[i:j] y C=[j:k] (A B C D -> A C B D).
+    Para cada (i, j) se evalúan todos los k de una vez. Con neighbors (o
+    active) ver _or3_opt_neighbors.
+    """
+    route = np.asarray(route, dtype=np.intp).copy()
+    n = len(route)
+    neighbors = _candidates(d, neighbors, active)
+    if neighbors is not None:
+        return _or3_opt_neighbors(d, route, neighbors, deadline, active)
+    improved = True
+
+    while improved:
+        improved = False
+        for i in range(1, n - 2):
+            if _expired(deadline):
+                return route.tolist()
+            for j in range(i + 1, n - 1):
+                ks = np.arange(j + 1, n)
+                a, b = route[i - 1], route[i]
+                c, e = route[j - 1], route[j]
+                f, g = route[ks - 1], route[ks]
+
+                delta = (
+                    d[a, e] + d[f, b] + d[c, g]
+                    - d[a, b] - d[c, e] - d[f, g]
+                )
+                best = int(np.argmin(delta))
+                if delta[best] < -IMPROVEMENT_EPS:
+                    k = int(ks[best])
+                    route[i:k] = np.concatenate([route[j:k], route[i:j]])
+                    improved = True
+
+    return route.tolist()
+
+
+def _or3_opt_neighbors(d, route, neighbors, deadline=None, active=None):
+    """
+    Segment swap restringido, con don't-look bits por el nodo a = route[i-1]:
+    j solo donde e = route[j] es vecino de a (arco nuevo a -> e) y k solo
+    donde f = route[k-1] es vecino de b (arco nuevo f -> b) o g = route[k]
+    es vecino de c (arco nuevo c -> g).
+    """
+    n = len(route)
+    pos = _positions(route, d.shape[0])
+    active = _ActiveNodes(route[:-2] if active is None else active, d.shape[0])
+
+    while active and not _expired(deadline):
+        a = active.pop()
+        i = pos[a] + 1
+        if i < 1 or i > n - 3:
+            continue
+        b = route[i]
+        pj = pos[neighbors[a]]
+        k_b = pos[neighbors[b]] + 1
+
+        best = None
+        for j in pj[(pj >= i + 1) & (pj <= n - 2)]:
+            c, e = route[j - 1], route[j]
+            ks = np.concatenate([k_b, pos[neighbors[c]]])
+            ks = ks[(ks >= j + 1) & (ks <= n - 1)]
+            if len(ks) == 0:
+                continue
+            f, g = route[ks - 1], route[ks]
+            delta = d[a, e] + d[f, b] + d[c, g] - d[a, b] - d[c, e] - d[f, g]
+            m = int(np.argmin(delta))
+            if best is None or delta[m] < best[0]:
+                best = (float(delta[m]), int(j), int(ks[m]))
+
+        if best is None or best[0] >= -IMPROVEMENT_EPS:
+            continue
+
+        _, j, k = best
+        touched = [a, b, route[j - 1], route[j], route[k - 1], route[k]]
+        route[i:k] = np.concatenate([route[j:k], route[i:j]])
+        pos[route[i:k]] = np.arange(i, k)
+        active.push(*touched)
+
+    return route.tolist()
+
+
+# --- Lin-Kernighan (cadenas de 2-opt) ---
+
+def lk(d, route, max_depth=LK_MAX_DEPTH, neighbors=None, deadline=None, active=None):
+    """
+    Lin-Kernighan sobre movimientos 2-opt. Parte del óptimo local de two_opt
+    y, para cada nodo t1 = route[i-1] (fijo), encadena hasta max_depth
+    inversiones de route[i:j]: en cada paso se rompen (t1, t2) y
+    (route[j-1], t3) con t2 = route[i] y t3 = route[j] candidato de t2, se
+    agrega (t2, t3) y el tour se cierra con t1 -> route[j-1], que es el arco
+    que rompe el paso siguiente. Se elige el mejor paso aunque empeore la
+    ruta, siempre que la ganancia parcial (sin el arco de cierre) siga
+    positiva, y sin repetir t3. Al final se deja el mejor prefijo de la
+    cadena y se deshacen los pasos que sobran.
+    """
+    route = np.asarray(two_opt(d, route, neighbors=neighbors, deadline=deadline, active=active), dtype=np.intp)
+    n = len(route)
+    if n < 5:
+        return route.tolist()
+
+    pos = _positions(route, d.shape[0])
+    fwd, bwd = prefix_costs(d, route)
+    active = _ActiveNodes(route[:-3] if active is None else active, d.shape[0])
+
+    while active and not _expired(deadline):
+        t1 = active.pop()
+        i = pos[t1] + 1
+        if i < 1 or i > n - 3:
+            continue
+
+        gain = 0.0
+        best_gain, best_depth = IMPROVEMENT_EPS, 0
+        steps = []
+        tabu = set()
+        for _ in range(max_depth):
+            t2 = route[i]
+            if neighbors is None:
+                js = np.arange(i + 2, n)
+            else:
+                js = pos[neighbors[t2]]
+                js = js[(js >= i + 2) & (js <= n - 1)]
+            if tabu:
+                js = js[~np.isin(route[js], list(tabu))]
+            if len(js) == 0:
+                break
+
+            c, e = route[js - 1], route[js]
+            delta = (
+                d[t1, c] + d[t2, e] - d[t1, t2] - d[c, e]
+                + (bwd[js - 1] - bwd[i]) - (fwd[js - 1] - fwd[i])
+            )
+            k = int(np.argmin(delta))
+            j = int(js[k])
+            # Criterio de ganancia: sin contar el arco de cierre t1 -> route[j-1]
+            if gain - delta[k] + d[t1, c[k]] <= IMPROVEMENT_EPS:
+                break
+
+            gain -= float(delta[k])
+            tabu.add(int(e[k]))
+            _reverse(d, route, i, j, fwd, bwd, pos)
+            steps.append(j)
+            if gain > best_gain:
+                best_gain, best_depth = gain, len(steps)
+
+        # Deshacer los pasos posteriores al mejor prefijo (inversión = su propia inversa)
+        for j in reversed(steps[best_depth:]):
+            _reverse(d, route, i, j, fwd, bwd, pos)
+
+        if best_depth:
+            active.push(t1, route[i])
+            for j in steps[:best_depth]:
+                active.push(route[j - 1], route[j])
+
+    return route.tolist()
+
+
+LOCAL_SEARCH = {
+    '2opt': two_opt,
+    'or_opt': or_opt,
+    '3opt': or3_opt,
+    'lk': lk,
+}
+DEFAULT_LOCAL_SEARCH = ('2opt', 'or_opt')
+
+
+def improve(d, route, methods=DEFAULT_LOCAL_SEARCH, neighbors=None, deadline=None, active=None):
+    """
+    Aplica los movimientos en secuencia (VND) hasta que una vuelta
+    completa no mejore la ruta o venza el deadline. Sobre
+    CANDIDATE_THRESHOLD nodos se calculan listas de vecinos si no vienen dadas.
+    """
+    if isinstance(methods, str):
+        methods = (methods,)
+    unknown = [m for m in methods if m not in LOCAL_SEARCH]
+    if unknown:
+        raise ValueError(f"Búsqueda local desconocida: {', '.join(unknown)}")
+
+    route = list(route)
+    if neighbors is None and len(route) > CANDIDATE_THRESHOLD:
+        neighbors = neighbor_lists(d)
+
+    cost = route_cost(d, route)
+    while True:
+        for method in methods:
+            route = LOCAL_SEARCH[method](d, route, neighbors=neighbors, deadline=deadline, active=active)
+        new_cost = route_cost(d, route)
+        if new_cost >= cost - IMPROVEMENT_EPS or _expired(deadline):
+            return route
+        cost = new_cost
@@ -0,0 +1,92 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rutas import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de los solvers TSP sobre instancias sintéticas fijas "
+        "(tiempo, memoria, distancia y brecha al óptimo)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tipos", nargs="+", choices=benchmark.TIPOS, default=list(benchmark.TIPOS),
+        )
+        parser.add_argument(
+            "--exactos", nargs="*", type=int, default=list(benchmark.TAMANOS_EXACTOS),
+            help="Tamaños (puntos de entrega) donde también corren los solvers exactos",
+        )
+        parser.add_argument(
+            "--heuristicos", nargs="*", type=int, default=list(benchmark.TAMANOS_HEURISTICOS),
+            help="Tamaños solo para heurísticas",
+        )
+        parser.add_argument(
+            "--solvers", nargs="+", choices=list(benchmark.SOLVERS), default=list(benchmark.SOLVERS),
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeticiones", type=int, default=3)
+        parser.add_argument(
+            "--time-limit-ms", type=int, default=100, help="Presupuesto del solver anytime",
+        )
+        parser.add_argument("--json", dest="salida_json", help="Archivo del reporte JSON")
+        parser.add_argument("--csv", dest="salida_csv", help="Archivo del reporte CSV")
+        parser.add_argument(
+            "--comparar", help="Reporte JSON base (p. ej. del commit anterior) contra el cual comparar",
+        )
+        parser.add_argument(
+            "--umbral", type=float, default=10.0,
+            help="Aumento de tiempo (%%) que cuenta como regresión al comparar",
+        )
+
+    def handle(self, *args, **options):
+        base = None
+        if options["comparar"]:
+            try:
+                with open(options["comparar"], encoding="utf-8") as f:
+                    base = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer {options['comparar']}: {e}")
+
+        instancias = benchmark.suite(
+            options["tipos"], options["exactos"], options["heuristicos"], options["seed"],
+        )
+        reporte = benchmark.ejecutar(
+            instancias,
+            solvers=options["solvers"],
+            repeticiones=max(1, options["repeticiones"]),
+            time_limit_ms=options["time_limit_ms"],
+            on_result=lambda fila: self.stdout.write(
+                f"{fila['instancia']:<20} {fila['solver']:<13} {fila['distancia']:>11.3f} km "
+                f"gap {fila['gap_pct']:>7.3f}% {fila['ms_mediana']:>10.2f} ms {fila['memoria_kb']:>10.1f} KB"
+            ),
+        )
+
+        if options["salida_json"]:
+            with open(options["salida_json"], "w", encoding="utf-8") as f:
+                json.dump(reporte, f, indent=2)
+        if options["salida_csv"]:
+            with open(options["salida_csv"], "w", encoding="utf-8", newline="") as f:
+                f.write(benchmark.a_csv(reporte))
+
+        regresiones = []
+        if base is not None:
+            for cambio in benchmark.comparar(base, reporte, options["umbral"]):
+                if cambio["regresion"]:
+                    regresiones.append(cambio)
+                    self.stderr.write(
+                        f"Regresión {cambio['instancia']} {cambio['solver']}: "
+                        f"tiempo {cambio['ms_pct']:+.1f}%, distancia {cambio['distancia_pct']:+.3f}%"
+                    )
+
+        for d in reporte["discrepancias"]:
+            self.stderr.write(f"Discrepancia en {d['instancia']} ({d['solver']}): {d['motivo']}")
+        if reporte["discrepancias"]:
+            raise CommandError(f"{len(reporte['discrepancias'])} instancias con resultados inconsistentes")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(reporte['resultados'])} mediciones en {len(instancias)} instancias"
+            + (f", {len(regresiones)} regresiones contra {options['comparar']}" if base is not None else "")
+        ))
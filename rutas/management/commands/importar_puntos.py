@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rutas import importacion
+
+
+class Command(BaseCommand):
+    help = "Importa puntos de entrega desde un CSV (nombre, direccion[, latitud, longitud])."
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo", help="Ruta del CSV")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument(
+            "--rate-limit", type=float, default=None,
+            help="Requests por segundo a la Geocoding API (por defecto RUTAS_GEOCODE_RATE_LIMIT)",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="Hilos de geocodificación (por defecto RUTAS_GEOCODE_MAX_WORKERS)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["archivo"], encoding=options["encoding"]) as f:
+                filas = importacion.leer_csv(f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f"No se pudo leer {options['archivo']}: {e}")
+
+        resumen = importacion.importar_puntos(
+            filas,
+            settings.GOOGLE_MAPS_API_KEY,
+            rate_limit=options["rate_limit"],
+            max_workers=options["workers"],
+        )
+
+        for e in resumen["errores"]:
+            self.stderr.write(f"Fila {e['fila']}: {e['mensaje']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumen['creados']} puntos creados, {resumen['duplicados']} duplicados omitidos, "
+            f"{resumen['desde_cache']} direcciones desde caché, "
+            f"{resumen['geocodificados']} geocodificadas, {len(resumen['errores'])} filas con error"
+        ))
@@ -0,0 +1,204 @@
+# rutas/maps_client.py
+"""
+Cliente HTTP compartido para las APIs web de Google Maps (Geocoding,
+Distance Matrix y Directions).
+
+- Una sola requests.Session por proceso, con pool de conexiones
+  (RUTAS_MAPS_POOL_SIZE) y keep-alive: los requests siguientes reutilizan
+  la conexión TLS en vez de abrir una nueva.
+- Timeouts de conexión y de lectura en cada request
+  (RUTAS_MAPS_CONNECT_TIMEOUT / RUTAS_MAPS_READ_TIMEOUT): un socket
+  colgado ya no bloquea el worker para siempre.
+- Reintentos con backoff exponencial y jitter completo
+  (RUTAS_MAPS_MAX_RETRIES, base RUTAS_MAPS_BACKOFF_S) ante errores de
+  conexión, timeouts, HTTP 429/5xx y status OVER_QUERY_LIMIT / UNKNOWN_ERROR.
+- Hedging opcional (RUTAS_MAPS_HEDGE_MS > 0): si la respuesta no llega en
+  ese tiempo se lanza un segundo request idéntico y se usa el primero que
+  responda. Baja la latencia de cola a cambio de requests extra (que Google
+  cobra), por eso viene desactivado.
+- Métricas por endpoint en este proceso (metricas()): requests, errores,
+  reintentos, requests cubiertos por hedging y latencia p50/p95.
+
+get_json() devuelve la respuesta decodificada; el status de Google lo
+interpreta cada llamador. Si se agotan los reintentos sale la excepción de
+requests (RequestException), igual que antes con requests.get.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://maps.googleapis.com/maps/api"
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_S = 0.25
+MAX_BACKOFF_S = 8
+LATENCIAS_POR_ENDPOINT = 1000
+
+RETRY_HTTP_STATUS = {429, 500, 502, 503, 504}
+RETRY_API_STATUS = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+_lock = threading.Lock()
+_estado = {'pid': None, 'session': None, 'hedge': None}
+_contadores = {}
+_latencias = {}
+
+
+class _Reintentable(Exception):
+    pass
+
+
+def get_json(endpoint, params):
+    """
+    GET a {BASE_URL}/{endpoint}/json con reintentos (y hedging si está activo).
+
+    Args:
+        endpoint: 'geocode', 'distancematrix' o 'directions'
+        params: query string (incluida la key)
+
+    Returns:
+        dict con la respuesta JSON. Con OVER_QUERY_LIMIT / UNKNOWN_ERROR tras
+        el último intento se devuelve igual, con ese status.
+
+    Raises:
+        requests.exceptions.RequestException si falla la conexión, vence el
+        timeout o la respuesta es HTTP 4xx/5xx después de los reintentos.
+    """
+    url = f"{BASE_URL}/{endpoint}/json"
+    intentos = 1 + max(0, getattr(settings, 'RUTAS_MAPS_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+
+    for intento in range(intentos):
+        ultimo = intento == intentos - 1
+        t0 = time.perf_counter()
+        try:
+            response = _enviar(endpoint, url, params)
+            if response.status_code in RETRY_HTTP_STATUS and not ultimo:
+                raise _Reintentable(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, _Reintentable) as e:
+            _contar(endpoint, 'errores')
+            if ultimo:
+                logger.error(f"Google Maps '{endpoint}' sin respuesta tras {intentos} intentos: {e}")
+                raise
+            _esperar(endpoint, intento, e)
+            continue
+        except requests.exceptions.RequestException:
+            _contar(endpoint, 'errores')
+            raise
+
+        _registrar_latencia(endpoint, time.perf_counter() - t0)
+        if data.get('status') in RETRY_API_STATUS and not ultimo:
+            _esperar(endpoint, intento, data['status'])
+            continue
+        return data
+
+
+def _esperar(endpoint, intento, motivo):
+    # Jitter completo: espera uniforme en [0, base * 2^intento]
+    base = getattr(settings, 'RUTAS_MAPS_BACKOFF_S', DEFAULT_BACKOFF_S)
+    espera = random.uniform(0, min(MAX_BACKOFF_S, base * 2 ** intento))
+    _contar(endpoint, 'reintentos')
+    logger.warning(f"Google Maps '{endpoint}': {motivo}; reintento {intento + 1} en {espera:.2f} s")
+    time.sleep(espera)
+
+
+def _enviar(endpoint, url, params):
+    _contar(endpoint, 'requests')
+    hedge_ms = getattr(settings, 'RUTAS_MAPS_HEDGE_MS', 0)
+    if not hedge_ms:
+        return _get(url, params)
+
+    executor = _clientes()[1]
+    primera = executor.submit(_get, url, params)
+    hechos, _ = wait([primera], timeout=hedge_ms / 1000)
+    if hechos:
+        return primera.result()
+
+    # Sin respuesta en hedge_ms: segundo request idéntico, gana el primero que responda bien
+    _contar(endpoint, 'cubiertas')
+    pendientes = {primera, executor.submit(_get, url, params)}
+    error = None
+    while pendientes:
+        hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            if futuro.exception() is None:
+                return futuro.result()
+            error = futuro.exception()
+    raise error
+
+
+def _get(url, params):
+    timeout = (
+        getattr(settings, 'RUTAS_MAPS_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+        getattr(settings, 'RUTAS_MAPS_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+    )
+    return _clientes()[0].get(url, params=params, timeout=timeout)
+
+
+def _clientes():
+    """(Session, executor de hedging) de este proceso; se rehacen después de un fork."""
+    with _lock:
+        if _estado['pid'] != os.getpid():
+            pool_size = getattr(settings, 'RUTAS_MAPS_POOL_SIZE', DEFAULT_POOL_SIZE)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            _estado.update(
+                pid=os.getpid(),
+                session=session,
+                hedge=ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix='maps-hedge'),
+            )
+        return _estado['session'], _estado['hedge']
+
+
+def _contar(endpoint, evento):
+    with _lock:
+        _contadores.setdefault(endpoint, Counter())[evento] += 1
+
+
+def _registrar_latencia(endpoint, segundos):
+    with _lock:
+        _latencias.setdefault(endpoint, deque(maxlen=LATENCIAS_POR_ENDPOINT)).append(segundos * 1000)
+
+
+def metricas():
+    """
+    Por endpoint, en este proceso: {'requests', 'errores', 'reintentos',
+    'cubiertas', 'p50_ms', 'p95_ms'} (latencias de las últimas
+    LATENCIAS_POR_ENDPOINT respuestas).
+    """
+    with _lock:
+        contadores = {endpoint: dict(c) for endpoint, c in _contadores.items()}
+        latencias = {endpoint: list(l) for endpoint, l in _latencias.items()}
+
+    resultado = {}
+    for endpoint in sorted(set(contadores) | set(latencias)):
+        c = contadores.get(endpoint, {})
+        fila = {evento: c.get(evento, 0) for evento in ('requests', 'errores', 'reintentos', 'cubiertas')}
+        if latencias.get(endpoint):
+            p50, p95 = np.percentile(np.asarray(latencias[endpoint]), [50, 95])
+            fila.update(p50_ms=round(float(p50), 1), p95_ms=round(float(p95), 1))
+        else:
+            fila.update(p50_ms=None, p95_ms=None)
+        resultado[endpoint] = fila
+    return resultado
+
+
+def reiniciar_metricas():
+    with _lock:
+        _contadores.clear()
+        _latencias.clear()
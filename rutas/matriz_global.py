@@ -0,0 +1,274 @@
+# rutas/matriz_global.py
+"""
+Matriz global de distancias entre todos los puntos de entrega, en disco.
+
+Los puntos cambian poco y se optimizan una y otra vez en subconjuntos
+distintos; en vez de armar la matriz de cada selección (consultas a
+DistanciaCache por cada par y requests por los faltantes), se mantiene una
+sola matriz punto x punto:
+- datos: archivo .npy float32 (capacidad x capacidad) abierto como memmap
+  (np.lib.format.open_memmap), NaN = par aún no calculado. Solo se leen
+  las páginas de las filas pedidas.
+- índice punto -> fila en la tabla FilaMatrizGlobal. Un punto nuevo toma
+  una fila libre la primera vez que se optimiza (su fila y columna se
+  vacían); al borrarlo la fila queda libre y al moverlo se vacía.
+- Los pares faltantes de una selección (solo esos, no la matriz k x k) se
+  piden una sola vez al proveedor configurado y quedan escritos en el
+  archivo.
+- Agrandar, vaciar y escribir se hacen con un flock exclusivo sobre
+  <archivo>.lock y reabriendo el archivo: así ningún proceso escribe en
+  la versión anterior después de que otro lo reemplazó al agrandarlo.
+
+La submatriz de una selección es un solo gather (np.ix_) sobre el memmap:
+una copia k x k en memoria, sin BD ni red. Origen y destino son
+direcciones libres, así que sus filas y columnas se piden aparte
+(matrix_blocks del proveedor) y no se guardan aquí.
+
+Hay un archivo por proveedor de distancias (Google vs haversine x factor
+de ruta) y modo. Se activa con settings.RUTAS_MATRIZ_GLOBAL_DIR; crece
+por duplicación hasta RUTAS_MATRIZ_GLOBAL_MAX_PUNTOS filas (5000 filas =
+100 MB). Con más puntos activos, optimizer.get_distance_matrix usa el
+camino normal.
+"""
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import distance_providers
+from .distance_cache import coord_key
+from .models import FilaMatrizGlobal
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el formato del archivo
+VERSION = 1
+CAPACIDAD_INICIAL = 256
+DEFAULT_MAX_PUNTOS = 5000
+DTYPE = distance_providers.MATRIX_DTYPE
+
+
+def habilitada():
+    return bool(getattr(settings, 'RUTAS_MATRIZ_GLOBAL_DIR', ''))
+
+
+def _max_puntos():
+    return getattr(settings, 'RUTAS_MATRIZ_GLOBAL_MAX_PUNTOS', DEFAULT_MAX_PUNTOS)
+
+
+def ruta_archivo(provider, mode="driving"):
+    """Un archivo por origen de los datos: Google (con o sin caché) o haversine x factor."""
+    if provider.name == distance_providers.HaversineDistanceProvider.name:
+        origen = f"haversine-{provider.road_factor}"
+    else:
+        origen = distance_providers.GoogleDistanceProvider.name
+    firma = hashlib.sha1(f"{VERSION}|{origen}|{mode}".encode()).hexdigest()[:12]
+    return Path(settings.RUTAS_MATRIZ_GLOBAL_DIR) / f"matriz-{mode}-{firma}.npy"
+
+
+@contextmanager
+def bloqueo(ruta):
+    """Bloqueo exclusivo entre procesos sobre el archivo de la matriz."""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    with open(ruta.with_suffix('.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def abrir(ruta, capacidad_minima=0):
+    """
+    Memmap de lectura/escritura, creado o agrandado (por duplicación) para
+    al menos capacidad_minima filas. Llamar dentro de bloqueo(ruta).
+    """
+    if ruta.exists():
+        datos = np.lib.format.open_memmap(ruta, mode='r+')
+        if datos.shape[0] >= capacidad_minima:
+            return datos
+        capacidad = datos.shape[0]
+    else:
+        datos, capacidad = None, CAPACIDAD_INICIAL
+
+    while capacidad < capacidad_minima:
+        capacidad *= 2
+    capacidad = min(capacidad, max(_max_puntos(), capacidad_minima))
+
+    # Archivo nuevo al lado y reemplazo atómico: otro proceso que lo tenga
+    # abierto sigue con la versión anterior hasta su próxima llamada
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_name(f"{ruta.stem}.{os.getpid()}.tmp")
+    nuevo = np.lib.format.open_memmap(temporal, mode='w+', dtype=DTYPE, shape=(capacidad, capacidad))
+    nuevo[:] = np.nan
+    np.fill_diagonal(nuevo, 0.0)
+    if datos is not None:
+        anterior = datos.shape[0]
+        nuevo[:anterior, :anterior] = datos
+        del datos
+    nuevo.flush()
+    del nuevo
+    os.replace(temporal, ruta)
+    logger.info(f"Matriz global {ruta.name}: {capacidad} filas")
+    return np.lib.format.open_memmap(ruta, mode='r+')
+
+
+def filas(puntos):
+    """
+    Fila de cada punto (ndarray alineado con puntos); asigna filas libres a
+    los puntos nuevos.
+
+    Returns:
+        (filas, vaciar) con vaciar = filas recién asignadas o de puntos que
+        se movieron; None si no hay lugar o si otro proceso tomó las mismas
+        filas libres al mismo tiempo.
+    """
+    claves = {p.id: coord_key(p.latitud, p.longitud) for p in puntos}
+    actuales = {
+        punto_id: (fila, coordenadas)
+        for punto_id, fila, coordenadas in FilaMatrizGlobal.objects
+        .filter(punto_id__in=list(claves))
+        .values_list('punto_id', 'fila', 'coordenadas')
+    }
+
+    movidos = [pid for pid, (_, coordenadas) in actuales.items() if coordenadas != claves[pid]]
+    for pid in movidos:
+        FilaMatrizGlobal.objects.filter(punto_id=pid).update(coordenadas=claves[pid])
+    vaciar = [actuales[pid][0] for pid in movidos]
+
+    nuevos = [pid for pid in claves if pid not in actuales]
+    if nuevos:
+        usadas = set(FilaMatrizGlobal.objects.values_list('fila', flat=True))
+        libres = (f for f in range(len(usadas) + len(nuevos)) if f not in usadas)
+        asignadas = [next(libres) for _ in nuevos]
+        if asignadas[-1] >= _max_puntos():
+            logger.info(f"Matriz global llena ({len(usadas)} filas usadas); se arma la matriz de la selección")
+            return None
+        try:
+            with transaction.atomic():
+                FilaMatrizGlobal.objects.bulk_create([
+                    FilaMatrizGlobal(punto_id=pid, fila=fila, coordenadas=claves[pid])
+                    for pid, fila in zip(nuevos, asignadas)
+                ])
+        except IntegrityError:
+            return None
+        actuales.update((pid, (fila, claves[pid])) for pid, fila in zip(nuevos, asignadas))
+        vaciar.extend(asignadas)
+
+    return np.array([actuales[p.id][0] for p in puntos], dtype=np.intp), vaciar
+
+
+def submatriz(puntos, provider, mode="driving"):
+    """
+    Matriz k x k de los puntos (copia desde el memmap). Solo los pares que
+    aún no están en el archivo se piden al proveedor y se escriben.
+
+    Returns:
+        ndarray DTYPE, o None si la matriz global no se puede usar.
+    """
+    asignacion = filas(puntos)
+    if asignacion is None:
+        return None
+    idx, vaciar = asignacion
+    ruta = ruta_archivo(provider, mode)
+    capacidad = int(idx.max()) + 1 if len(idx) else 0
+
+    with bloqueo(ruta):
+        datos = abrir(ruta, capacidad)
+        if vaciar:
+            vaciar = np.asarray(vaciar, dtype=np.intp)
+            datos[vaciar, :] = np.nan
+            datos[:, vaciar] = np.nan
+            datos[vaciar, vaciar] = 0.0
+            datos.flush()
+        sub = datos[np.ix_(idx, idx)]
+        del datos
+
+    faltan = np.isnan(sub)
+    if not faltan.any():
+        return sub
+
+    logger.info(f"Matriz global: {int(faltan.sum())} de {sub.size} pares pedidos a '{provider.name}'")
+    coords = [(float(p.latitud), float(p.longitud)) for p in puntos]
+    fetched = provider.matrix_blocks(coords, _bloques_faltantes(faltan), mode)
+    if fetched is None:
+        return None
+
+    sub = _assemble_faltantes(sub, faltan, fetched)
+
+    with bloqueo(ruta):
+        # Reabrir: otro proceso pudo agrandar (reemplazar) el archivo entretanto
+        datos = abrir(ruta, capacidad)
+        fi, fj = np.nonzero(faltan)
+        datos[idx[fi], idx[fj]] = sub[fi, fj]
+        datos.flush()
+        del datos
+    return sub
+
+
+def _bloques_faltantes(faltan):
+    """
+    Bloques (filas, columnas) que cubren exactamente los pares faltantes:
+    las filas con el mismo patrón de columnas faltantes van en un bloque
+    (p. ej. todas las filas antiguas a las que les falta la columna nueva).
+    """
+    grupos = {}
+    for i in np.flatnonzero(faltan.any(axis=1)):
+        grupos.setdefault(faltan[i].tobytes(), []).append(int(i))
+    return [(filas_grupo, np.flatnonzero(faltan[filas_grupo[0]]).tolist()) for filas_grupo in grupos.values()]
+
+
+def _assemble_faltantes(sub, faltan, fetched):
+    """Completa los pares faltantes con lo obtenido (o su simétrico); sin dato queda inf."""
+    sub = sub.copy()
+    for (i, j), (km, _) in fetched.items():
+        if faltan[i, j]:
+            sub[i, j] = km
+    vacias = np.isnan(sub)
+    sub[vacias] = sub.T[vacias]
+    np.fill_diagonal(sub, 0.0)
+    sub[np.isnan(sub)] = np.inf
+    return sub
+
+
+def matriz(puntos, extremos, provider, mode="driving"):
+    """
+    Matriz completa para el optimizador: extremos[0] (origen), los puntos y,
+    si hay, extremos[1] (destino), igual que optimizer.get_distance_matrix.
+
+    Args:
+        puntos: PuntoEntrega
+        extremos: [(lat, lng) origen] o [origen, destino]
+
+    Returns:
+        ndarray DTYPE (inf = sin ruta), o None si hay que usar el camino normal.
+    """
+    sub = submatriz(puntos, provider, mode)
+    if sub is None:
+        return None
+
+    k = len(puntos)
+    n = k + len(extremos)
+    coords = [extremos[0]] + [(float(p.latitud), float(p.longitud)) for p in puntos] + list(extremos[1:])
+    bordes = [0] + list(range(k + 1, n))
+
+    # Filas y columnas de origen y destino: 2 x n pares en vez de n x n
+    fetched = provider.matrix_blocks(coords, [(bordes, list(range(n))), (list(range(n)), bordes)], mode)
+    if fetched is None:
+        return None
+
+    distance_matrix = np.full((n, n), np.nan, dtype=DTYPE)
+    distance_matrix[1:k + 1, 1:k + 1] = sub
+    return distance_providers._assemble(n, fetched, distance_matrix)
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.27 on 2026-10-16 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0002_alter_puntoentrega_options_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DistanciaCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("origen", models.CharField(max_length=32)),
+                ("destino", models.CharField(max_length=32)),
+                ("modo", models.CharField(default="driving", max_length=20)),
+                ("distancia_km", models.FloatField()),
+                ("duracion_seg", models.FloatField(blank=True, null=True)),
+                ("creado_en", models.DateTimeField()),
+                ("ultimo_uso", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Distancia en caché",
+                "verbose_name_plural": "Distancias en caché",
+                "indexes": [
+                    models.Index(
+                        fields=["ultimo_uso"], name="rutas_dista_ultimo__1c0ca9_idx"
+                    ),
+                    models.Index(
+                        fields=["creado_en"], name="rutas_dista_creado__d3ec10_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="distanciacache",
+            constraint=models.UniqueConstraint(
+                fields=("origen", "destino", "modo"),
+                name="uniq_distancia_cache_par_modo",
+            ),
+        ),
+    ]
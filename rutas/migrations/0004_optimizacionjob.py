@@ -0,0 +1,73 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("rutas", "0003_distanciacache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OptimizacionJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "estado",
+                    models.CharField(
+                        choices=[
+                            ("pendiente", "Pendiente"),
+                            ("en_proceso", "En proceso"),
+                            ("completado", "Completado"),
+                            ("error", "Error"),
+                        ],
+                        default="pendiente",
+                        max_length=20,
+                    ),
+                ),
+                ("parametros", models.JSONField(default=dict)),
+                ("resultado", models.JSONField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("tiempos", models.JSONField(blank=True, default=dict)),
+                ("creado_en", models.DateTimeField(auto_now_add=True)),
+                ("iniciado_en", models.DateTimeField(blank=True, null=True)),
+                ("terminado_en", models.DateTimeField(blank=True, null=True)),
+                (
+                    "usuario",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="optimizaciones",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Optimización de ruta",
+                "verbose_name_plural": "Optimizaciones de ruta",
+                "ordering": ["-creado_en"],
+                "indexes": [
+                    models.Index(
+                        fields=["estado"], name="rutas_optim_estado_d5f025_idx"
+                    ),
+                    models.Index(
+                        fields=["creado_en"], name="rutas_optim_creado__8656cd_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0004_optimizacionjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GeocodeCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "direccion_normalizada",
+                    models.CharField(max_length=255, unique=True),
+                ),
+                ("direccion", models.CharField(max_length=255)),
+                ("latitud", models.FloatField()),
+                ("longitud", models.FloatField()),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("creado_en", models.DateTimeField()),
+                ("ultimo_uso", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Geocodificación en caché",
+                "verbose_name_plural": "Geocodificaciones en caché",
+                "indexes": [
+                    models.Index(
+                        fields=["creado_en"], name="rutas_geoco_creado__9e5d45_idx"
+                    )
+                ],
+            },
+        ),
+    ]
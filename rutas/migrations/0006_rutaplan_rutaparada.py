@@ -0,0 +1,126 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("rutas", "0005_geocodecache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RutaParada",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("orden", models.PositiveIntegerField()),
+                ("vehiculo", models.PositiveSmallIntegerField(default=1)),
+                ("nombre", models.CharField(max_length=255)),
+                ("latitud", models.FloatField()),
+                ("longitud", models.FloatField()),
+                ("distancia_tramo_km", models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "Parada de ruta",
+                "verbose_name_plural": "Paradas de ruta",
+                "ordering": ["plan", "orden"],
+            },
+        ),
+        migrations.CreateModel(
+            name="RutaPlan",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("creado_en", models.DateTimeField(auto_now_add=True)),
+                ("direccion_origen", models.CharField(max_length=255)),
+                ("direccion_destino", models.CharField(max_length=255)),
+                ("origen_lat", models.FloatField()),
+                ("origen_lng", models.FloatField()),
+                ("destino_lat", models.FloatField()),
+                ("destino_lng", models.FloatField()),
+                ("distancia_total_km", models.FloatField()),
+                ("litros", models.FloatField()),
+                ("costo_clp", models.FloatField()),
+                ("precio_bencina", models.FloatField()),
+                ("rendimiento_km_por_litro", models.FloatField()),
+                ("num_vehiculos", models.PositiveSmallIntegerField(default=1)),
+                ("vehiculos", models.JSONField(blank=True, default=list)),
+                ("sin_asignar", models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                "verbose_name": "Plan de ruta",
+                "verbose_name_plural": "Planes de ruta",
+                "ordering": ["-creado_en", "-id"],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name="puntoentrega",
+            name="rutas_punto_orden_o_f311f5_idx",
+        ),
+        migrations.RemoveField(
+            model_name="puntoentrega",
+            name="orden_optimo",
+        ),
+        migrations.AddField(
+            model_name="rutaplan",
+            name="usuario",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="planes_ruta",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="rutaparada",
+            name="plan",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="paradas",
+                to="rutas.rutaplan",
+            ),
+        ),
+        migrations.AddField(
+            model_name="rutaparada",
+            name="punto",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="paradas",
+                to="rutas.puntoentrega",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rutaplan",
+            index=models.Index(
+                fields=["usuario", "creado_en"], name="rutas_rutap_usuario_05e9cc_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="rutaparada",
+            constraint=models.UniqueConstraint(
+                fields=("plan", "orden"), name="uniq_ruta_parada_plan_orden"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0006_rutaplan_rutaparada"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResultadoCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("llave", models.CharField(max_length=64, unique=True)),
+                ("puntos_ids", models.TextField()),
+                ("solucion", models.JSONField()),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("creado_en", models.DateTimeField()),
+                ("ultimo_uso", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Resultado en caché",
+                "verbose_name_plural": "Resultados en caché",
+                "indexes": [
+                    models.Index(
+                        fields=["ultimo_uso"], name="rutas_resul_ultimo__7c2334_idx"
+                    ),
+                    models.Index(
+                        fields=["creado_en"], name="rutas_resul_creado__c4e77b_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
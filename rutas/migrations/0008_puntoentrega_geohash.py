@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:22
+
+from django.db import migrations, models
+
+from rutas import geohash
+
+
+def calcular_geohash(apps, schema_editor):
+    PuntoEntrega = apps.get_model("rutas", "PuntoEntrega")
+    puntos = list(PuntoEntrega.objects.only("latitud", "longitud"))
+    for punto in puntos:
+        punto.geohash = geohash.encode(punto.latitud, punto.longitud)
+    PuntoEntrega.objects.bulk_update(puntos, ["geohash"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0007_resultadocache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="puntoentrega",
+            name="geohash",
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name="puntoentrega",
+            index=models.Index(
+                fields=["geohash"], name="rutas_punto_geohash_ec0e38_idx"
+            ),
+        ),
+        migrations.RunPython(calcular_geohash, migrations.RunPython.noop),
+    ]
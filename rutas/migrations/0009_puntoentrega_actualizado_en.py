@@ -0,0 +1,24 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0008_puntoentrega_geohash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="puntoentrega",
+            name="actualizado_en",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name="puntoentrega",
+            index=models.Index(
+                fields=["actualizado_en"], name="rutas_punto_actuali_5d0092_idx"
+            ),
+        ),
+    ]
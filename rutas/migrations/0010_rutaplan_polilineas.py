@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0009_puntoentrega_actualizado_en"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rutaplan",
+            name="polilineas",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
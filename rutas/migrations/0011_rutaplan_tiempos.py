@@ -0,0 +1,24 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0010_rutaplan_polilineas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rutaplan",
+            name="tiempos",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddIndex(
+            model_name="rutaplan",
+            index=models.Index(
+                fields=["creado_en"], name="rutas_rutap_creado__a8999a_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0011_rutaplan_tiempos"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FilaMatrizGlobal",
+            fields=[
+                (
+                    "punto",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="fila_matriz",
+                        serialize=False,
+                        to="rutas.puntoentrega",
+                    ),
+                ),
+                ("fila", models.PositiveIntegerField(unique=True)),
+                ("coordenadas", models.CharField(max_length=40)),
+            ],
+            options={
+                "verbose_name": "Fila de la matriz global",
+                "verbose_name_plural": "Filas de la matriz global",
+            },
+        ),
+    ]
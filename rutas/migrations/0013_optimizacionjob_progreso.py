@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-16 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0012_filamatrizglobal"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="optimizacionjob",
+            name="progreso",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
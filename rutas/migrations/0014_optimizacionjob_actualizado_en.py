@@ -0,0 +1,20 @@
+# Generated by Django 4.2.27 on 2026-10-16 21:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0013_optimizacionjob_progreso"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="optimizacionjob",
+            name="actualizado_en",
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
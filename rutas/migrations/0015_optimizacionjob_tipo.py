@@ -0,0 +1,25 @@
+# Generated by Django 4.2.27 on 2026-10-17 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0014_optimizacionjob_actualizado_en"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="optimizacionjob",
+            name="tipo",
+            field=models.CharField(
+                choices=[
+                    ("optimizacion", "Optimización"),
+                    ("importacion", "Importación de puntos"),
+                ],
+                default="optimizacion",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.27 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rutas", "0015_optimizacionjob_tipo"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="optimizacionjob",
+            name="tipo",
+            field=models.CharField(
+                choices=[
+                    ("optimizacion", "Optimización"),
+                    ("importacion", "Importación de puntos"),
+                    ("trazado", "Trazado de ruta"),
+                ],
+                default="optimizacion",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,22 +1,278 @@
 # rutas/models.py
+from django.conf import settings
 from django.db import models
 
+from . import geohash
+
 
 class PuntoEntrega(models.Model):
     nombre = models.CharField(max_length=255)
     direccion = models.CharField(max_length=255)
     latitud = models.DecimalField(max_digits=9, decimal_places=6)
     longitud = models.DecimalField(max_digits=9, decimal_places=6)
-    orden_optimo = models.IntegerField(null=True, blank=True)
+    # Se calcula en save(); bulk_create debe asignarlo (ver rutas.spatial)
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    # Junto con la cantidad y el id máximo forma la versión de los puntos (ver rutas.spatial)
+    actualizado_en = models.DateTimeField(auto_now=True)
 
     # ✅ NUEVO: Meta con índices
     class Meta:
         verbose_name = "Punto de Entrega"
         verbose_name_plural = "Puntos de Entrega"
         indexes = [
-            models.Index(fields=['orden_optimo']),
             models.Index(fields=['nombre']),
+            models.Index(fields=['geohash']),
+            models.Index(fields=['actualizado_en']),
+        ]
+
+    def __str__(self):
+        return self.nombre
+
+    def save(self, *args, **kwargs):
+        self.geohash = geohash.encode(self.latitud, self.longitud)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitud', 'longitud'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash', 'actualizado_en'}
+        super().save(*args, **kwargs)
+
+class DistanciaCache(models.Model):
+    """
+    Caché persistente de distancias/tiempos entre pares de coordenadas.
+    Las coordenadas se guardan redondeadas (ver rutas.distance_cache).
+    """
+    origen = models.CharField(max_length=32)
+    destino = models.CharField(max_length=32)
+    modo = models.CharField(max_length=20, default="driving")
+    distancia_km = models.FloatField()
+    duracion_seg = models.FloatField(null=True, blank=True)
+    creado_en = models.DateTimeField()
+    ultimo_uso = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Distancia en caché"
+        verbose_name_plural = "Distancias en caché"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["origen", "destino", "modo"],
+                name="uniq_distancia_cache_par_modo",
+            )
+        ]
+        indexes = [
+            models.Index(fields=['ultimo_uso']),
+            models.Index(fields=['creado_en']),
+        ]
+
+    def __str__(self):
+        return f"{self.origen} → {self.destino} ({self.modo}): {self.distancia_km} km"
+
+
+class OptimizacionJob(models.Model):
+    """
+    Optimización de ruta ejecutada fuera del request (ver rutas.jobs).
+    parametros guarda el formulario tal cual ({campo: [valores]}) y
+    resultado el id del RutaPlan generado ({'plan_id': ...}).
+
+    Las importaciones de CSV (tipo importacion) usan la misma cola:
+    parametros trae el archivo ({'archivo', 'contenido'}) y resultado el
+    resumen de rutas.importacion. El trazado por calles de un plan ya
+    guardado (tipo trazado) trae {'plan_id': ...} en parametros.
+    """
+    class Estado(models.TextChoices):
+        PENDIENTE = "pendiente", "Pendiente"
+        EN_PROCESO = "en_proceso", "En proceso"
+        COMPLETADO = "completado", "Completado"
+        ERROR = "error", "Error"
+
+    class Tipo(models.TextChoices):
+        OPTIMIZACION = "optimizacion", "Optimización"
+        IMPORTACION = "importacion", "Importación de puntos"
+        TRAZADO = "trazado", "Trazado de ruta"
+
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="optimizaciones",
+    )
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE)
+    tipo = models.CharField(max_length=20, choices=Tipo.choices, default=Tipo.OPTIMIZACION)
+    parametros = models.JSONField(default=dict)
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Duración por etapa en ms ({etapa_ms: ms} de rutas.tiempos, más total_ms); también si falló
+    tiempos = models.JSONField(default=dict, blank=True)
+    # Última mejora del solver anytime ({'costo', 'ms', 'iteracion', 'ruta': [[lat, lng], ...]}),
+    # la lee el stream SSE del mapa (views.optimizar_ruta_stream)
+    progreso = models.JSONField(null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+    # Latido: lo renueva el proceso que ejecuta el job; si se queda atrás el job
+    # quedó huérfano (ver jobs.recuperar_huerfanos)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Optimización de ruta"
+        verbose_name_plural = "Optimizaciones de ruta"
+        ordering = ["-creado_en"]
+        indexes = [
+            models.Index(fields=['estado']),
+            models.Index(fields=['creado_en']),
+        ]
+
+    def __str__(self):
+        return f"Optimización #{self.pk} ({self.estado})"
+
+
+class GeocodeCache(models.Model):
+    """
+    Caché persistente de geocodificación por dirección normalizada
+    (ver rutas.geocoding.normalizar).
+    """
+    direccion_normalizada = models.CharField(max_length=255, unique=True)
+    direccion = models.CharField(max_length=255)
+    latitud = models.FloatField()
+    longitud = models.FloatField()
+    hits = models.PositiveIntegerField(default=0)
+    creado_en = models.DateTimeField()
+    ultimo_uso = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Geocodificación en caché"
+        verbose_name_plural = "Geocodificaciones en caché"
+        indexes = [
+            models.Index(fields=['creado_en']),
         ]
 
     def __str__(self):
-        return self.nombre
\ No newline at end of file
+        return f"{self.direccion} → ({self.latitud}, {self.longitud})"
+
+
+class RutaPlan(models.Model):
+    """
+    Resultado de una optimización: métricas y, en RutaParada, el orden de
+    las paradas. Cada optimización crea su propio plan, así dos usuarios
+    optimizando subconjuntos distintos no se pisan.
+    """
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="planes_ruta",
+    )
+    creado_en = models.DateTimeField(auto_now_add=True)
+    direccion_origen = models.CharField(max_length=255)
+    direccion_destino = models.CharField(max_length=255)
+    origen_lat = models.FloatField()
+    origen_lng = models.FloatField()
+    destino_lat = models.FloatField()
+    destino_lng = models.FloatField()
+    distancia_total_km = models.FloatField()
+    litros = models.FloatField()
+    costo_clp = models.FloatField()
+    precio_bencina = models.FloatField()
+    rendimiento_km_por_litro = models.FloatField()
+    num_vehiculos = models.PositiveSmallIntegerField(default=1)
+    # Resumen por vehículo (CVRP) y nombres de puntos que no cupieron
+    vehiculos = models.JSONField(default=list, blank=True)
+    sin_asignar = models.JSONField(default=list, blank=True)
+    # Geometría por calles (rutas.directions): [{'vehiculo', 'puntos' (encoded polyline)}]
+    polilineas = models.JSONField(default=list, blank=True)
+    # Etapas de la corrida que generó el plan (rutas.tiempos): [{'etapa', 'inicio_ms', 'ms', ...}]
+    tiempos = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        verbose_name = "Plan de ruta"
+        verbose_name_plural = "Planes de ruta"
+        ordering = ["-creado_en", "-id"]
+        indexes = [
+            models.Index(fields=['usuario', 'creado_en']),
+            models.Index(fields=['creado_en']),
+        ]
+
+    def __str__(self):
+        return f"Plan #{self.pk}: {self.distancia_total_km:.2f} km"
+
+
+class RutaParada(models.Model):
+    """
+    Parada de un plan. Guarda nombre y coordenadas del punto al momento de
+    optimizar, así el plan se puede mostrar aunque el punto cambie o se borre.
+    """
+    plan = models.ForeignKey(RutaPlan, on_delete=models.CASCADE, related_name="paradas")
+    punto = models.ForeignKey(
+        PuntoEntrega,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="paradas",
+    )
+    orden = models.PositiveIntegerField()
+    vehiculo = models.PositiveSmallIntegerField(default=1)
+    nombre = models.CharField(max_length=255)
+    latitud = models.FloatField()
+    longitud = models.FloatField()
+    # Tramo desde la parada anterior (o el origen) del mismo vehículo
+    distancia_tramo_km = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Parada de ruta"
+        verbose_name_plural = "Paradas de ruta"
+        ordering = ["plan", "orden"]
+        constraints = [
+            models.UniqueConstraint(fields=["plan", "orden"], name="uniq_ruta_parada_plan_orden"),
+        ]
+
+    def __str__(self):
+        return f"{self.orden}. {self.nombre}"
+
+
+class ResultadoCache(models.Model):
+    """
+    Solución memorizada de una optimización (ver rutas.result_cache).
+    llave es el hash de puntos, coordenadas, extremos y parámetros del
+    solver; puntos_ids (",3,7,12,") permite invalidar por punto.
+    """
+    llave = models.CharField(max_length=64, unique=True)
+    puntos_ids = models.TextField()
+    solucion = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    creado_en = models.DateTimeField()
+    ultimo_uso = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Resultado en caché"
+        verbose_name_plural = "Resultados en caché"
+        indexes = [
+            models.Index(fields=['ultimo_uso']),
+            models.Index(fields=['creado_en']),
+        ]
+
+    def __str__(self):
+        return f"{self.llave[:12]}… ({self.hits} hits)"
+
+
+class FilaMatrizGlobal(models.Model):
+    """
+    Fila (y columna) de un punto en la matriz global de distancias
+    (ver rutas.matriz_global). coordenadas es la llave de
+    rutas.distance_cache con que se llenó la fila: si el punto se mueve, la
+    fila se vacía y se vuelve a llenar. Al borrar el punto la fila queda libre.
+    """
+    punto = models.OneToOneField(
+        PuntoEntrega,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="fila_matriz",
+    )
+    fila = models.PositiveIntegerField(unique=True)
+    coordenadas = models.CharField(max_length=40)
+
+    class Meta:
+        verbose_name = "Fila de la matriz global"
+        verbose_name_plural = "Filas de la matriz global"
+
+    def __str__(self):
+        return f"Punto #{self.punto_id} -> fila {self.fila}"
@@ -0,0 +1,155 @@
+# rutas/multistart.py
+"""
+Multi-arranque en paralelo para el TSP heurístico.
+
+Cada arranque construye una ruta con vecino más cercano aleatorizado (elige
+al azar entre los RCL_SIZE no visitados más cercanos, estilo GRASP) y la
+mejora con rutas.local_search. El arranque 0 usa vecino más cercano puro,
+así el resultado nunca es peor que el de una sola corrida.
+
+Los arranques se reparten en un ProcessPoolExecutor con contexto spawn
+(igual que rutas.jobs y rutas.escenarios): se llama desde workers de jobs
+con el hilo de latido corriendo y desde procesos de Django con conexiones
+abiertas, que un fork copiaría a medio usar. La matriz de costos (solo
+lectura) se entrega en el initializer: se serializa una sola vez por
+proceso, no por tarea.
+
+Cada arranque tiene su propia semilla derivada de la semilla maestra
+(np.random.SeedSequence), así el resultado no depende de qué proceso
+ejecute cada arranque ni en qué orden terminen.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import local_search
+
+RCL_SIZE = 3
+DEFAULT_SEED = 0
+
+# Estado de cada proceso del pool (se llena en _init_worker)
+_worker = {}
+
+
+def solve(d, delivery_indices, start_index, end_index, methods,
+          starts=None, workers=None, seed=DEFAULT_SEED):
+    """
+    Args:
+        d: matriz de costos (local_search.cost_array)
+        delivery_indices: índices de los puntos de entrega
+        start_index, end_index: origen y destino (None = volver al origen)
+        methods: movimientos de búsqueda local
+        starts: cantidad de arranques (por defecto = workers)
+        workers: procesos del pool (por defecto os.cpu_count(); 1 = sin pool)
+        seed: semilla maestra
+
+    Returns:
+        (mejor_ruta, estadisticas) donde estadisticas es un dict con
+        'arranques' (uno por arranque) y 'workers' (resumen por proceso).
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    starts = max(1, starts or workers)
+    end = start_index if end_index is None else end_index
+
+    seeds = np.random.SeedSequence(seed).spawn(starts)
+    tasks = [
+        (k, int(s.generate_state(1)[0]), list(delivery_indices), start_index, end, tuple(methods))
+        for k, s in enumerate(seeds)
+    ]
+
+    if workers == 1 or starts == 1:
+        _init_worker(d)
+        try:
+            results = [_run_start(task) for task in tasks]
+        finally:
+            _worker.clear()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, starts),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(d,),
+        ) as pool:
+            results = list(pool.map(_run_start, tasks))
+
+    # Empates por número de arranque: mismo resultado para la misma semilla
+    best = min(results, key=lambda r: (r['costo'], r['arranque']))
+    stats = {
+        'semilla': seed,
+        'mejor_arranque': best['arranque'],
+        'arranques': [{k: v for k, v in r.items() if k != 'ruta'} for r in results],
+        'workers': _per_worker(results),
+    }
+    return best['ruta'], stats
+
+
+def _init_worker(d):
+    _worker['d'] = d
+    _worker['neighbors'] = None
+    if d.shape[0] > local_search.CANDIDATE_THRESHOLD:
+        _worker['neighbors'] = local_search.neighbor_lists(d)
+
+
+def _run_start(task):
+    k, seed, delivery_indices, start_index, end, methods = task
+    d = _worker['d']
+    t0 = time.perf_counter()
+
+    rng = None if k == 0 else np.random.default_rng(seed)
+    route = randomized_nearest_neighbor(d, delivery_indices, start_index, rng) + [end]
+    initial = local_search.route_cost(d, route)
+    route = local_search.improve(d, route, methods, neighbors=_worker['neighbors'])
+
+    return {
+        'arranque': k,
+        'semilla': seed,
+        'pid': os.getpid(),
+        'costo_inicial': initial,
+        'costo': local_search.route_cost(d, route),
+        'ms': (time.perf_counter() - t0) * 1000,
+        'ruta': route,
+    }
+
+
+def randomized_nearest_neighbor(d, delivery_indices, start_index, rng=None, rcl_size=RCL_SIZE):
+    """
+    Ruta abierta desde el origen eligiendo al azar entre los rcl_size no
+    visitados más cercanos. Con rng=None es el vecino más cercano clásico.
+    """
+    visited = np.ones(d.shape[0], dtype=bool)
+    visited[delivery_indices] = False
+
+    route = [start_index]
+    current = start_index
+    for remaining in range(len(delivery_indices), 0, -1):
+        row = np.where(visited, np.inf, d[current])
+        if rng is None or remaining == 1:
+            nxt = int(np.argmin(row))
+        else:
+            size = min(rcl_size, remaining)
+            candidates = np.argpartition(row, size - 1)[:size]
+            nxt = int(candidates[rng.integers(size)])
+        route.append(nxt)
+        visited[nxt] = True
+        current = nxt
+    return route
+
+
+def _per_worker(results):
+    """Resumen por proceso: arranques, mejor costo, costo medio y tiempo total."""
+    by_pid = {}
+    for r in results:
+        by_pid.setdefault(r['pid'], []).append(r)
+    return [
+        {
+            'pid': pid,
+            'arranques': len(rs),
+            'mejor_costo': min(r['costo'] for r in rs),
+            'costo_medio': float(np.mean([r['costo'] for r in rs])),
+            'ms_total': sum(r['ms'] for r in rs),
+        }
+        for pid, rs in sorted(by_pid.items())
+    ]
@@ -1,98 +1,192 @@
 # rutas/optimizer.py
-import requests
-import json
+import logging
 from django.conf import settings
 import itertools
 
+import numpy as np
 
-# --- PARTE 1: Obtener Distancias/Tiempos de Google Maps ---
-def get_distance_matrix(points, origin_coords, api_key, dest_coords=None):
+from . import anytime, distance_providers, local_search, matriz_global, multistart
+
+logger = logging.getLogger(__name__)
+
+
+# --- PARTE 1: Obtener Distancias/Tiempos (Google Maps u otro proveedor) ---
+
+def get_distance_matrix(points, origin_coords, api_key, dest_coords=None, mode="driving",
+                        use_cache=True, symmetric=False, provider=None, extra_coords=()):
     """
     Obtiene la matriz de distancias entre:
     - origen
     - todos los puntos de entrega
     - (opcional) destino
+    - (opcional) extra_coords después del destino: otros orígenes o destinos
+      candidatos (rutas.escenarios)
+
+    El proveedor se elige en settings.RUTAS_DISTANCE_PROVIDER (ver
+    rutas.distance_providers). Con la matriz global activa (rutas.matriz_global)
+    los pares entre puntos salen del archivo y solo se piden origen y destino.
+    Si Google falla y RUTAS_DISTANCE_FALLBACK está activo, se usa el
+    estimador local (haversine x factor de ruta) para no abortar la optimización.
     """
-    all_points_coords = [f"{origin_coords['latitud']},{origin_coords['longitud']}"]
+    coords = [(float(origin_coords['latitud']), float(origin_coords['longitud']))]
 
     for p in points:
-        all_points_coords.append(f"{p.latitud},{p.longitud}")
+        coords.append((float(p.latitud), float(p.longitud)))
 
     if dest_coords is not None:
-        all_points_coords.append(f"{dest_coords['latitud']},{dest_coords['longitud']}")
-
-    origins_str = "|".join(all_points_coords)
-    destinations_str = origins_str
-
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    params = {
-        "origins": origins_str,
-        "destinations": destinations_str,
-        "mode": "driving",
-        "key": api_key
-    }
-
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        if data['status'] == 'OK':
-            distance_matrix = []
-            for row_data in data['rows']:
-                row_distances = []
-                for element in row_data['elements']:
-                    if element['status'] == 'OK':
-                        row_distances.append(element['distance']['value'] / 1000)  # a km
-                    else:
-                        row_distances.append(float('inf'))
-                distance_matrix.append(row_distances)
-            return distance_matrix
-        else:
-            print(f"Error en Distance Matrix API: {data['status']} - {data.get('error_message', '')}")
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error de conexión con la API de Google Maps: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error al decodificar la respuesta JSON de la API: {e}")
-        return None
+        coords.append((float(dest_coords['latitud']), float(dest_coords['longitud'])))
+    for extra in extra_coords:
+        coords.append((float(extra['latitud']), float(extra['longitud'])))
+
+    if provider is None:
+        provider = distance_providers.get_provider(api_key, use_cache=use_cache, symmetric=symmetric)
+
+    distance_matrix = None
+    if matriz_global.habilitada() and points:
+        extremos = [coords[0]] + coords[len(points) + 1:]
+        distance_matrix = matriz_global.matriz(points, extremos, provider, mode)
+    if distance_matrix is None:
+        distance_matrix = provider.matrix(coords, mode)
+
+    if distance_matrix is None and provider.name != distance_providers.HaversineDistanceProvider.name \
+            and getattr(settings, 'RUTAS_DISTANCE_FALLBACK', True):
+        logger.warning(
+            f"Proveedor '{provider.name}' sin respuesta; usando estimación local para {len(coords)} puntos"
+        )
+        distance_matrix = distance_providers.HaversineDistanceProvider().matrix(coords, mode)
+
+    return distance_matrix
 
 
 # --- PARTE 2: TSP Solver con Nearest Neighbor + 2-opt ---
+HELD_KARP_MAX_POINTS = 16  # 2^16 x 16 estados (~8 MB): bien bajo un segundo
+
 
-def solve_tsp(distance_matrix, num_points_entrega, start_index=0, end_index=None):
+def solve_tsp(distance_matrix, num_points_entrega, start_index=0, end_index=None, local_search_methods=None,
+              time_limit_ms=None, on_improve=None, stats=None):
     """
     Resuelve el TSP con algoritmo híbrido:
-    - Fuerza bruta para <= 9 puntos (rápido y óptimo)
-    - Nearest Neighbor + 2-opt para >= 10 puntos (rápido pero aproximado)
+    - Held-Karp para <= HELD_KARP_MAX_POINTS puntos (óptimo garantizado)
+    - Nearest Neighbor + búsqueda local para más puntos (rápido pero aproximado)
+    - Con time_limit_ms: solver anytime (rutas.anytime) que mejora la ruta
+      hasta el deadline y avisa cada mejora a on_improve
     
     Args:
-        distance_matrix: matriz de distancias
+        distance_matrix: matriz de distancias (ndarray o lista de listas; inf = sin ruta)
         num_points_entrega: cantidad de puntos de entrega
         start_index: índice del origen
         end_index: índice del destino (None = ciclo cerrado)
+        local_search_methods: movimiento(s) de rutas.local_search ('2opt', 'or_opt',
+            '3opt', 'lk' o una tupla de ellos); por defecto
+            settings.RUTAS_LOCAL_SEARCH
+        time_limit_ms: presupuesto de tiempo (None = sin límite). Held-Karp
+            no se interrumpe, pero a 16 puntos toma ~150 ms.
+        on_improve: callback(progreso) por cada mejora (ver rutas.anytime)
+        stats: dict opcional que se completa con 'algoritmo' y, si aplica,
+            'iteraciones' y 'base_completa' (rutas.tiempos)
     
     Returns:
         (ruta_optima, distancia_total)
     """
-    if not distance_matrix or num_points_entrega == 0:
+    if distance_matrix is None or num_points_entrega == 0:
+        return [], 0.0
+
+    distance_matrix = np.asarray(distance_matrix)
+    if distance_matrix.size == 0:
         return [], 0.0
 
     delivery_indices = list(range(1, num_points_entrega + 1))
+    if stats is None:
+        stats = {}
 
-    # ✅ Fuerza bruta para <= 9 puntos (óptimo garantizado)
-    if num_points_entrega <= 9:
-        return _solve_tsp_bruteforce(
+    # ✅ Held-Karp para pocos puntos (óptimo garantizado)
+    if num_points_entrega <= HELD_KARP_MAX_POINTS:
+        route, total = _solve_tsp_held_karp(
             distance_matrix, delivery_indices, start_index, end_index
         )
+        stats['algoritmo'] = 'held_karp'
+        if on_improve is not None:
+            on_improve({'costo': total, 'ms': 0.0, 'iteracion': 0, 'ruta': route})
+        return route, total
+
+    # ✅ Presupuesto de tiempo: búsqueda local iterada hasta el deadline
+    if time_limit_ms:
+        methods = local_search_methods or getattr(
+            settings, 'RUTAS_LOCAL_SEARCH', local_search.DEFAULT_LOCAL_SEARCH
+        )
+        route, anytime_stats = anytime.solve(
+            _cost_array(distance_matrix), delivery_indices, start_index, end_index,
+            methods, time_limit_ms, on_improve=on_improve,
+        )
+        logger.info(
+            f"TSP anytime: {anytime_stats['iteraciones']} iteraciones, {anytime_stats['mejoras']} mejoras "
+            f"en {anytime_stats['ms']:.0f} ms (límite {time_limit_ms} ms"
+            f"{'' if anytime_stats['base_completa'] else ', ruta base sin terminar'})"
+        )
+        stats.update(
+            algoritmo='anytime', iteraciones=anytime_stats['iteraciones'],
+            base_completa=anytime_stats['base_completa'],
+        )
+        return route, _route_distance(distance_matrix, route)
     
-    # ✅ Nearest Neighbor + 2-opt para >= 10 puntos (heurística)
+    # ✅ Nearest Neighbor + búsqueda local para muchos puntos (heurística)
     return _solve_tsp_heuristic(
-        distance_matrix, delivery_indices, start_index, end_index
+        distance_matrix, delivery_indices, start_index, end_index, local_search_methods, stats=stats
     )
 
 
+def _solve_tsp_held_karp(distance_matrix, delivery_indices, start_index, end_index):
+    """
+    Held-Karp (programación dinámica sobre subconjuntos) - O(2^n · n²) pero óptimo garantizado.
+
+    dp[mask, j] = costo mínimo de salir del origen, visitar los puntos de
+    `mask` y terminar en j. Las tablas son arrays NumPy y cada capa (mismo
+    número de puntos visitados) se calcula vectorizada por punto final.
+    """
+    d = _cost_array(distance_matrix)
+    nodes = np.asarray(delivery_indices, dtype=np.intp)
+    n = len(nodes)
+    final_index = start_index if end_index is None else end_index
+
+    full = 1 << n
+    inner = d[np.ix_(nodes, nodes)]  # inner[k, j] = d(nodes[k] -> nodes[j])
+
+    dp = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int8)
+    dp[1 << np.arange(n), np.arange(n)] = d[start_index, nodes]
+
+    masks = np.arange(full)
+    popcount = np.zeros(full, dtype=np.int8)
+    for b in range(n):
+        popcount += ((masks >> b) & 1).astype(np.int8)
+
+    for size in range(2, n + 1):
+        layer = masks[popcount == size]
+        for j in range(n):
+            bit = 1 << j
+            sel = layer[(layer & bit) != 0]
+            # dp[prev, k] es inf si k no está en prev, así que no hace falta filtrar
+            cand = dp[sel ^ bit] + inner[:, j]
+            best_k = np.argmin(cand, axis=1)
+            dp[sel, j] = cand[np.arange(len(sel)), best_k]
+            parent[sel, j] = best_k
+
+    closing = dp[full - 1] + d[nodes, final_index]
+    j = int(np.argmin(closing))
+
+    # Reconstruir desde el final
+    mask = full - 1
+    path = []
+    while j != -1:
+        path.append(int(nodes[j]))
+        prev_j = int(parent[mask, j])
+        mask ^= 1 << j
+        j = prev_j
+
+    route = [start_index] + path[::-1] + [final_index]
+    return route, _route_distance(distance_matrix, route)
+
+
 def _solve_tsp_bruteforce(distance_matrix, delivery_indices, start_index, end_index):
     """Fuerza bruta - O(n!) pero óptimo garantizado"""
     min_distance = float('inf')
@@ -122,23 +216,43 @@ def _solve_tsp_bruteforce(distance_matrix, delivery_indices, start_index, end_in
     return best_route, min_distance
 
 
-def _solve_tsp_heuristic(distance_matrix, delivery_indices, start_index, end_index):
+def _solve_tsp_heuristic(distance_matrix, delivery_indices, start_index, end_index, methods=None,
+                         starts=None, workers=None, seed=None, stats=None):
     """
-    Nearest Neighbor + 2-opt - O(n²) mucho más rápido para n grande
+    Nearest Neighbor + búsqueda local - O(n²) mucho más rápido para n grande.
+    Con starts > 1 se hacen varios arranques aleatorizados en paralelo
+    (rutas.multistart) y se queda el mejor.
     """
-    # 1) Construir ruta inicial con Nearest Neighbor
-    unvisited = set(delivery_indices)
-    route = [start_index]
-    current = start_index
-
-    while unvisited:
-        nearest = min(
-            unvisited,
-            key=lambda x: distance_matrix[current][x]
+    d = _cost_array(distance_matrix)
+
+    if methods is None:
+        methods = getattr(settings, 'RUTAS_LOCAL_SEARCH', local_search.DEFAULT_LOCAL_SEARCH)
+    if isinstance(methods, str):
+        methods = (methods,)
+    if starts is None:
+        starts = getattr(settings, 'RUTAS_MULTISTART_STARTS', 1)
+
+    if starts > 1:
+        if workers is None:
+            workers = getattr(settings, 'RUTAS_MULTISTART_WORKERS', 0) or None
+        if seed is None:
+            seed = getattr(settings, 'RUTAS_MULTISTART_SEED', multistart.DEFAULT_SEED)
+
+        route, multistart_stats = multistart.solve(
+            d, delivery_indices, start_index, end_index, methods,
+            starts=starts, workers=workers, seed=seed,
         )
-        route.append(nearest)
-        unvisited.remove(nearest)
-        current = nearest
+        if stats is not None:
+            stats.update(algoritmo='multistart', iteraciones=starts)
+        for w in multistart_stats['workers']:
+            logger.info(
+                f"Multi-arranque pid {w['pid']}: {w['arranques']} arranques, "
+                f"mejor {w['mejor_costo']:.2f}, medio {w['costo_medio']:.2f}, {w['ms_total']:.0f} ms"
+            )
+        return route, _route_distance(distance_matrix, route)
+
+    # 1) Construir ruta inicial con Nearest Neighbor (argmin enmascarado)
+    route = _nearest_neighbor(d, delivery_indices, start_index)
 
     # Agregar punto final
     if end_index is None:
@@ -146,62 +260,46 @@ def _solve_tsp_heuristic(distance_matrix, delivery_indices, start_index, end_ind
     else:
         route.append(end_index)
 
-    # 2) Mejorar con 2-opt
-    route = _two_opt(distance_matrix, route)
+    # 2) Mejorar con búsqueda local (2-opt, Or-opt, 3-opt, LK)
+    route = local_search.improve(d, route, methods)
+    if stats is not None:
+        stats['algoritmo'] = 'nn+' + '+'.join(methods)
 
     # 3) Calcular distancia total
-    total_distance = 0.0
-    for i in range(len(route) - 1):
-        segment = distance_matrix[route[i]][route[i + 1]]
-        if segment == float('inf'):
-            return route, float('inf')
-        total_distance += segment
+    return route, _route_distance(distance_matrix, route)
 
-    return route, total_distance
+
+def _nearest_neighbor(d, delivery_indices, start_index):
+    """Ruta abierta origen -> vecino más cercano no visitado -> ... (sin punto final)."""
+    return multistart.randomized_nearest_neighbor(d, delivery_indices, start_index)
 
 
 def _two_opt(distance_matrix, route):
     """
     Optimización local 2-opt: invierte segmentos de la ruta
     para reducir cruces y mejorar la distancia total.
+    (Ver rutas.local_search.two_opt: delta O(1), barrido vectorizado por i.)
     """
-    improved = True
-    best_route = route[:]
-
-    while improved:
-        improved = False
-        for i in range(1, len(best_route) - 2):
-            for j in range(i + 1, len(best_route)):
-                if j - i == 1:
-                    continue
-
-                new_route = best_route[:]
-                # Invertir segmento [i:j]
-                new_route[i:j] = reversed(best_route[i:j])
-
-                # Calcular distancia
-                old_dist = _route_distance(distance_matrix, best_route)
-                new_dist = _route_distance(distance_matrix, new_route)
-
-                if new_dist < old_dist:
-                    best_route = new_route
-                    improved = True
-                    break
-            if improved:
-                break
+    return local_search.two_opt(_cost_array(distance_matrix), route)
+
 
-    return best_route
+_cost_array = local_search.cost_array
 
 
 def _route_distance(distance_matrix, route):
-    """Calcula distancia total de una ruta"""
-    total = 0.0
-    for i in range(len(route) - 1):
-        d = distance_matrix[route[i]][route[i + 1]]
-        if d == float('inf'):
-            return float('inf')
-        total += d
-    return total
+    """Calcula distancia total de una ruta (inf si algún tramo no tiene ruta)"""
+    legs = route_legs(distance_matrix, route)
+    if not np.all(np.isfinite(legs)):
+        return float('inf')
+    return float(legs.sum(dtype=np.float64))
+
+
+def route_legs(distance_matrix, route):
+    """Distancia de cada tramo de la ruta (ndarray), por indexado vectorizado."""
+    route = np.asarray(route, dtype=np.intp)
+    if len(route) < 2:
+        return np.zeros(0)
+    return np.asarray(distance_matrix)[route[:-1], route[1:]]
 
 
 # --- PARTE 3: Cálculos de Consumo ---
@@ -211,12 +309,16 @@ AUTO_RENDIMIENTO_KM_POR_LITRO = 12  # valor por defecto
 def calculate_fuel_cost(total_distance_km, rendimiento_km_por_litro=AUTO_RENDIMIENTO_KM_POR_LITRO):
     """
     Calcula los litros de combustible consumidos.
+    Acepta escalares o arrays (p. ej. km por tramo o por vehículo).
     """
-    if total_distance_km == float('inf'):
-        return float('inf')
-    if rendimiento_km_por_litro <= 0:
-        return float('inf')
-    return total_distance_km / rendimiento_km_por_litro
+    distancia = np.asarray(total_distance_km, dtype=np.float64)
+    rendimiento = np.asarray(rendimiento_km_por_litro, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        litros = np.where(rendimiento > 0, distancia / rendimiento, np.inf)
+    litros = np.where(np.isfinite(distancia), litros, np.inf)
+
+    return float(litros) if litros.ndim == 0 else litros
 
 
 def calculate_fuel_consumption(total_distance_km, rendimiento_km_por_litro=AUTO_RENDIMIENTO_KM_POR_LITRO):
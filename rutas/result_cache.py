@@ -0,0 +1,160 @@
+# rutas/result_cache.py
+"""
+Caché persistente (en BD) de soluciones de optimización.
+
+Volver a optimizar la misma selección con el mismo origen y destino repite
+matriz y solver; con esta caché la segunda vez solo cuesta una consulta.
+
+- La llave es un sha256 de un JSON canónico con: ids y coordenadas
+  (redondeadas como en rutas.distance_cache) de los puntos, origen, destino,
+  parámetros del solver (vehículos, capacidad, demandas, rendimiento,
+  time_limit_ms, búsqueda local, multi-arranque) y la versión de los datos
+  de distancia (proveedor, factor de ruta y VERSION).
+- Cada entrada vence después de un TTL y se desalojan las menos usadas
+  recientemente (LRU) cuando la tabla supera el máximo configurado.
+- rutas.signals borra las entradas de un punto al editarlo o eliminarlo.
+"""
+import hashlib
+import json
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .distance_cache import coord_key
+from .models import ResultadoCache
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el formato de la solución o el comportamiento de los solvers
+VERSION = 1
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ENTRIES = 500
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, 'RUTAS_RESULT_CACHE_TTL_HOURS', DEFAULT_TTL_HOURS))
+
+
+def _max_entries():
+    return getattr(settings, 'RUTAS_RESULT_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def habilitada():
+    return _max_entries() > 0
+
+
+def llave(plan):
+    """sha256 del JSON canónico de todo lo que determina la solución del plan."""
+    multi = plan['num_vehiculos'] > 1
+    datos = {
+        'version': VERSION,
+        'distancias': [
+            getattr(settings, 'RUTAS_DISTANCE_PROVIDER', 'cached'),
+            getattr(settings, 'RUTAS_ROAD_FACTOR', None),
+        ],
+        'puntos': [[p.id, coord_key(p.latitud, p.longitud)] for p in plan['puntos']],
+        'origen': coord_key(*plan['origen']),
+        'destino': coord_key(*plan['destino']),
+        'solver': {
+            'num_vehiculos': plan['num_vehiculos'],
+            'capacidad_kg': plan['capacidad_kg'] if multi else None,
+            'rendimiento': plan['rendimiento'] if multi else None,
+            'demandas': [str(plan['demandas'][p.id]) for p in plan['puntos']] if multi else None,
+            'time_limit_ms': plan['time_limit_ms'],
+            'local_search': list(getattr(settings, 'RUTAS_LOCAL_SEARCH', ())),
+            'multistart': [
+                getattr(settings, 'RUTAS_MULTISTART_STARTS', 1),
+                getattr(settings, 'RUTAS_MULTISTART_SEED', 0),
+            ],
+        },
+    }
+    canonico = json.dumps(datos, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonico.encode()).hexdigest()
+
+
+def lookup(clave):
+    """
+    Returns:
+        la solución guardada (dict de services.resolver) o None si no hay
+        una entrada vigente.
+    """
+    vigente = ResultadoCache.objects.filter(llave=clave, creado_en__gte=timezone.now() - _ttl())
+    solucion = vigente.values_list('solucion', flat=True).first()
+    if solucion is not None:
+        vigente.update(hits=F('hits') + 1, ultimo_uso=timezone.now())
+    return solucion
+
+
+def store(clave, puntos, solucion):
+    """
+    Guarda (o refresca) la solución. Las que no tienen ruta completa
+    (distancia infinita) no se guardan.
+
+    Args:
+        clave: salida de llave()
+        puntos: PuntoEntrega del plan
+        solucion: dict de services.resolver
+    """
+    if not math.isfinite(solucion['distancia_km']):
+        return False
+
+    now = timezone.now()
+    ResultadoCache.objects.bulk_create(
+        [ResultadoCache(
+            llave=clave,
+            puntos_ids=_ids_texto(p.id for p in puntos),
+            solucion=json.loads(json.dumps(solucion, default=_a_python)),
+            creado_en=now,
+            ultimo_uso=now,
+        )],
+        update_conflicts=True,
+        unique_fields=['llave'],
+        update_fields=['puntos_ids', 'solucion', 'creado_en', 'ultimo_uso'],
+    )
+    evict()
+    return True
+
+
+def invalidar_punto(punto_id):
+    """Borra las soluciones que incluyen el punto."""
+    deleted, _ = ResultadoCache.objects.filter(puntos_ids__contains=_ids_texto([punto_id])).delete()
+    if deleted:
+        logger.info(f"Caché de resultados: {deleted} entradas invalidadas por el punto #{punto_id}")
+    return deleted
+
+
+def evict():
+    """
+    Elimina entradas vencidas y, si aún se supera el máximo,
+    las menos usadas recientemente.
+    """
+    deleted, _ = ResultadoCache.objects.filter(creado_en__lt=timezone.now() - _ttl()).delete()
+
+    max_entries = _max_entries()
+    total = ResultadoCache.objects.count()
+    if total > max_entries:
+        # Exactamente los sobrantes, no todos los que empatan con el corte:
+        # las entradas de un mismo lote comparten ultimo_uso
+        sobrantes = ResultadoCache.objects.order_by('ultimo_uso', 'id').values('id')[:total - max_entries]
+        extra, _ = ResultadoCache.objects.filter(id__in=sobrantes).delete()
+        deleted += extra
+
+    if deleted:
+        logger.info(f"Caché de resultados: {deleted} entradas desalojadas")
+    return deleted
+
+
+def _ids_texto(ids):
+    # Comas en los extremos: ",12," no calza dentro de ",112,"
+    return ',' + ','.join(str(i) for i in ids) + ','
+
+
+def _a_python(valor):
+    """Escalares de numpy (rutas con np.int64, distancias np.float32) a tipos de Python."""
+    if hasattr(valor, 'item'):
+        return valor.item()
+    raise TypeError(f"{type(valor).__name__} no es serializable")
@@ -0,0 +1,723 @@
+# rutas/services.py
+import logging
+import math
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from . import (
+    cvrp, directions, distance_providers, escenarios, geocoding, incremental, matriz_global, optimizer,
+    result_cache, tiempos,
+)
+from .models import PuntoEntrega, RutaParada, RutaPlan
+
+logger = logging.getLogger(__name__)
+
+
+def demandas_por_punto(puntos):
+    """
+    Kilos pendientes de despacho por punto de entrega: suma de kilos_total
+    de las ventas (crm.Venta) ligadas al punto y aún no entregadas.
+
+    Args:
+        puntos: iterable de PuntoEntrega
+
+    Returns:
+        dict {punto_id: Decimal kilos} (0 si el punto no tiene ventas pendientes)
+    """
+    from crm.models import Venta
+
+    ids = [p.id for p in puntos]
+    kilos = {
+        row["punto_entrega"]: row["kilos"] or Decimal("0")
+        for row in (
+            Venta.objects
+            .filter(punto_entrega_id__in=ids, entregada=False)
+            .values("punto_entrega")
+            .annotate(kilos=Sum("kilos_total"))
+        )
+    }
+    return {pid: kilos.get(pid, Decimal("0")) for pid in ids}
+
+
+# --- Pipeline de optimización (compartido por optimizar_ruta y su versión SSE) ---
+
+DEFAULT_FUEL_PRICE = 1250
+DEFAULT_RENDIMIENTO = getattr(optimizer, 'AUTO_RENDIMIENTO_KM_POR_LITRO', 12)
+# Pares (origen, destino) por comparación en evaluar_escenarios
+MAX_ESCENARIOS = 12
+
+
+class OptimizacionError(Exception):
+    """Datos del formulario inválidos o falla de un servicio externo; el mensaje es para el usuario."""
+
+
+def preparar_optimizacion(data, api_key, medicion=None):
+    """
+    Valida el formulario (QueryDict de POST o GET), geocodifica origen y
+    destino, calcula la demanda por punto y construye la matriz de distancias.
+    Si la misma optimización ya está en rutas.result_cache, no arma la matriz
+    (distance_matrix = None) y deja la solución en 'solucion_cache'.
+    Los tiempos de cada etapa quedan en plan['medicion'] (rutas.tiempos).
+
+    Returns:
+        dict "plan" con todo lo necesario para resolver() y guardar_resultado().
+
+    Raises:
+        OptimizacionError con el mensaje a mostrar en el mapa.
+    """
+    medicion = medicion or tiempos.Medicion()
+
+    # 0) PUNTOS SELECCIONADOS
+    selected_ids, puntos = _puntos_seleccionados(data)
+
+    # 1) ORIGEN
+    origen_predef = data.get('origen_predefinido', '').strip()
+    origen_custom = data.get('origen_custom', '').strip()
+
+    if origen_predef == 'custom':
+        direccion_origen = origen_custom
+    elif origen_predef:
+        direccion_origen = origen_predef
+    else:
+        raise OptimizacionError('Debes seleccionar o escribir una dirección de origen.')
+
+    if not direccion_origen:
+        raise OptimizacionError('La dirección de origen no puede estar vacía.')
+
+    # 2) DESTINO
+    destino_predef = data.get('destino_predefinido', '').strip()
+    destino_custom = data.get('destino_custom', '').strip()
+
+    if destino_predef == 'custom':
+        direccion_destino = destino_custom
+    elif destino_predef == 'same_origin' or not destino_predef:
+        direccion_destino = direccion_origen
+    else:
+        direccion_destino = destino_predef
+
+    if not direccion_destino:
+        raise OptimizacionError('La dirección de destino no puede estar vacía.')
+
+    # 3) PARÁMETROS NUMÉRICOS
+    parametros = _parametros(data)
+
+    # 4) GEOCODIFICAR ORIGEN Y DESTINO
+    with medicion.etapa('geocodificar_origen'):
+        origen = _geocodificar(direccion_origen, api_key, 'de origen')
+    if direccion_destino == direccion_origen:
+        destino = origen
+    else:
+        with medicion.etapa('geocodificar_destino'):
+            destino = _geocodificar(direccion_destino, api_key, 'destino')
+
+    plan = {
+        'selected_ids': selected_ids,
+        'puntos': puntos,
+        'direccion_origen': direccion_origen,
+        'direccion_destino': direccion_destino,
+        'origen': origen,
+        'destino': destino,
+        'distance_matrix': None,
+        # El destino siempre es un índice propio de la matriz
+        'end_index': len(puntos) + 1,
+        'demandas': demandas_por_punto(puntos) if parametros['num_vehiculos'] > 1 else None,
+        **parametros,
+        'llave_cache': None,
+        'solucion_cache': None,
+        'medicion': medicion,
+    }
+
+    # 5) SOLUCIÓN EN CACHÉ
+    if result_cache.habilitada():
+        with medicion.etapa('cache_resultados') as etapa:
+            plan['llave_cache'] = result_cache.llave(plan)
+            plan['solucion_cache'] = result_cache.lookup(plan['llave_cache'])
+            etapa['acierto'] = plan['solucion_cache'] is not None
+        if plan['solucion_cache'] is not None:
+            logger.info(f"Optimización en caché ({len(puntos)} puntos), sin matriz ni solver")
+            return plan
+
+    # 6) MATRIZ DE DISTANCIAS
+    plan['distance_matrix'] = _matriz(puntos, origen, destino, api_key, medicion)
+    if plan['distance_matrix'] is None:
+        raise OptimizacionError(
+            'No se pudo obtener la matriz de distancias. '
+            'Revisa la clave API o la conexión.'
+        )
+    return plan
+
+
+def evaluar_escenarios(data, api_key):
+    """
+    Compara orígenes (y destinos) candidatos para la misma selección de
+    puntos y parámetros: cuál bodega conviene como salida y llegada.
+
+    Candidatos: 'origenes_escenario' (lista; 'custom' = origen_custom) y,
+    si viene, 'destinos_escenario' ('custom' = destino_custom). Sin destinos
+    candidatos se usa el destino del formulario; con 'mismo origen' cada
+    escenario vuelve a su propio origen. Se evalúa cada par (origen,
+    destino), hasta MAX_ESCENARIOS.
+
+    Todas las direcciones van en una sola matriz de distancias y los
+    escenarios se resuelven en paralelo (rutas.escenarios). No se guarda
+    ningún plan.
+
+    Returns:
+        lista de dicts {'origen', 'destino', 'distancia_km', 'litros',
+        'costo', 'sin_asignar', 'ms'} ordenada de mejor a peor (primero los
+        que asignan todas las paradas, luego por costo).
+
+    Raises:
+        OptimizacionError con el mensaje a mostrar en el mapa.
+    """
+    _, puntos = _puntos_seleccionados(data)
+
+    origenes = _candidatos(data, 'origenes_escenario', 'origen_custom')
+    if not origenes:
+        raise OptimizacionError('Selecciona al menos un origen candidato para comparar.')
+
+    destinos = _candidatos(data, 'destinos_escenario', 'destino_custom')
+    if not destinos:
+        destino_predef = data.get('destino_predefinido', '').strip()
+        if destino_predef == 'custom':
+            destinos = [data.get('destino_custom', '').strip()]
+        elif destino_predef and destino_predef != 'same_origin':
+            destinos = [destino_predef]
+    if destinos and not all(destinos):
+        raise OptimizacionError('La dirección de destino no puede estar vacía.')
+
+    pares = [(o, d) for o in origenes for d in (destinos or [o])]
+    if len(pares) > MAX_ESCENARIOS:
+        raise OptimizacionError(
+            f'Demasiados escenarios ({len(pares)}); el máximo es {MAX_ESCENARIOS}.'
+        )
+
+    parametros = _parametros(data)
+
+    # Una sola matriz: [dirección 0] + puntos + [dirección 1, 2, ...]
+    direcciones = list(dict.fromkeys(origenes + destinos))
+    coords = []
+    for direccion in direcciones:
+        lat, lng = _geocodificar(direccion, api_key, 'candidata')
+        coords.append({'latitud': lat, 'longitud': lng})
+    k = len(puntos)
+    distance_matrix = optimizer.get_distance_matrix(
+        puntos, coords[0], api_key,
+        dest_coords=coords[1] if len(coords) > 1 else None,
+        extra_coords=coords[2:],
+    )
+    if distance_matrix is None:
+        raise OptimizacionError(
+            'No se pudo obtener la matriz de distancias. '
+            'Revisa la clave API o la conexión.'
+        )
+    indice = {direccion: 0 if j == 0 else k + j for j, direccion in enumerate(direcciones)}
+
+    if parametros['num_vehiculos'] > 1:
+        kilos = demandas_por_punto(puntos)
+        demandas = [float(kilos[p.id]) for p in puntos]
+    else:
+        demandas = None
+
+    resultados = escenarios.evaluar(
+        distance_matrix,
+        range(1, k + 1),
+        [(indice[o], indice[d]) for o, d in pares],
+        dict(parametros, demandas=demandas),
+        workers=getattr(settings, 'RUTAS_ESCENARIOS_WORKERS', 0) or None,
+    )
+
+    filas = []
+    for (origen, destino), r in zip(pares, resultados):
+        factible = math.isfinite(r['distancia_km'])
+        filas.append({
+            'origen': origen,
+            'destino': destino,
+            'distancia_km': round(r['distancia_km'], 2) if factible else None,
+            'litros': round(r['litros'], 2) if factible else None,
+            'costo': round(r['litros'] * parametros['precio_bencina']) if factible else None,
+            'sin_asignar': r['sin_asignar'],
+            'ms': round(r['ms'], 1),
+        })
+    filas.sort(key=lambda f: (f['costo'] is None, f['sin_asignar'], f['costo'] or 0))
+    logger.info(f"Escenarios: {len(filas)} pares origen-destino para {k} puntos")
+    return filas
+
+
+def _candidatos(data, campo, campo_custom):
+    """Direcciones candidatas del formulario, sin repetir; 'custom' se reemplaza por campo_custom."""
+    direcciones = []
+    for valor in data.getlist(campo):
+        valor = valor.strip()
+        if valor == 'custom':
+            valor = data.get(campo_custom, '').strip()
+        if valor and valor not in direcciones:
+            direcciones.append(valor)
+    return direcciones
+
+
+def _puntos_seleccionados(data):
+    """(ids del formulario, PuntoEntrega) con "todos_los_puntos" cuando el formulario no lista cada punto."""
+    if data.get('todos_los_puntos'):
+        puntos = list(PuntoEntrega.objects.order_by('id'))
+        selected_ids = [str(p.id) for p in puntos]
+    else:
+        selected_ids = data.getlist('puntos_seleccionados')
+        if not selected_ids:
+            raise OptimizacionError(
+                'Debes seleccionar al menos un punto de entrega para optimizar la ruta.'
+            )
+        puntos = list(PuntoEntrega.objects.filter(id__in=selected_ids).order_by('id'))
+    if not puntos:
+        raise OptimizacionError('Los puntos seleccionados no existen o fueron eliminados.')
+    return selected_ids, puntos
+
+
+def _parametros(data):
+    """Rendimiento, precio, vehículos, capacidad y tiempo límite del formulario."""
+    capacidad_kg = _float_param(data, 'capacidad_kg', None)
+
+    try:
+        num_vehiculos = max(1, int(data.get('num_vehiculos', '').strip() or 1))
+    except ValueError:
+        num_vehiculos = 1
+
+    try:
+        time_limit_ms = int(data.get('time_limit_ms', '').strip() or 0)
+    except ValueError:
+        time_limit_ms = 0
+    if time_limit_ms <= 0:
+        time_limit_ms = getattr(settings, 'RUTAS_TIME_LIMIT_MS', 0) or None
+
+    if num_vehiculos > 1 and (not capacidad_kg or capacidad_kg <= 0):
+        raise OptimizacionError(
+            'Para repartir entre varios vehículos debes indicar la capacidad (kg).'
+        )
+
+    return {
+        'rendimiento': _float_param(data, 'rendimiento_vehiculo', DEFAULT_RENDIMIENTO),
+        'precio_bencina': _float_param(data, 'precio_bencina', DEFAULT_FUEL_PRICE),
+        'num_vehiculos': num_vehiculos,
+        'capacidad_kg': capacidad_kg,
+        'time_limit_ms': time_limit_ms,
+    }
+
+
+def _matriz(puntos, origen, destino, api_key, medicion):
+    n = len(puntos) + 2
+    with medicion.etapa(
+        'matriz', elementos=n * n, proveedor=getattr(settings, 'RUTAS_DISTANCE_PROVIDER', 'cached'),
+    ):
+        return optimizer.get_distance_matrix(
+            puntos,
+            {'latitud': origen[0], 'longitud': origen[1]},
+            api_key,
+            dest_coords={'latitud': destino[0], 'longitud': destino[1]},
+        )
+
+
+def coordenadas_matriz(plan):
+    """[lat, lng] por índice de la matriz: origen, puntos y destino."""
+    return (
+        [list(plan['origen'])]
+        + [[float(p.latitud), float(p.longitud)] for p in plan['puntos']]
+        + [list(plan['destino'])]
+    )
+
+
+def resolver(plan, on_improve=None):
+    """
+    Resuelve el plan: TSP con un vehículo, CVRP con varios. No toca la BD;
+    on_improve recibe cada mejora del solver anytime (rutas.jobs la guarda
+    en el job para el stream SSE).
+
+    Returns:
+        dict con 'ruta' (índices de la matriz), 'distancia_km',
+        'rutas_vehiculos' (None o lista de cvrp.solve_cvrp), 'sin_asignar'
+        y 'tramos' (km desde la parada anterior, por parada de 'ruta').
+    """
+    if plan['solucion_cache'] is not None:
+        solucion = plan['solucion_cache']
+        if on_improve is not None:
+            on_improve({'costo': solucion['distancia_km'], 'ms': 0.0, 'iteracion': 0, 'ruta': solucion['ruta']})
+        return solucion
+
+    with plan['medicion'].etapa('resolver') as etapa:
+        return _resolver(plan, etapa, on_improve)
+
+
+def _resolver(plan, stats, on_improve=None):
+    distance_matrix = plan['distance_matrix']
+    puntos = plan['puntos']
+    end_index = plan['end_index']
+
+    if plan['num_vehiculos'] == 1:
+        ruta, distancia_km = optimizer.solve_tsp(
+            distance_matrix,
+            len(puntos),
+            start_index=0,
+            end_index=end_index,
+            time_limit_ms=plan['time_limit_ms'],
+            on_improve=on_improve,
+            stats=stats,
+        )
+        if not ruta:
+            raise OptimizacionError('No se pudo optimizar la ruta. Verifica los puntos o el algoritmo.')
+        return {
+            'ruta': ruta,
+            'distancia_km': distancia_km,
+            'rutas_vehiculos': None,
+            'sin_asignar': [],
+            'tramos': _tramos(distance_matrix, [ruta]),
+        }
+
+    demands = [0.0] + [float(plan['demandas'][p.id]) for p in puntos] + [0.0]
+    vehiculos = [
+        {
+            'nombre': f"Vehículo {k + 1}",
+            'capacidad_kg': plan['capacidad_kg'],
+            'rendimiento_km_por_litro': plan['rendimiento'],
+        }
+        for k in range(plan['num_vehiculos'])
+    ]
+    resultado = cvrp.solve_cvrp(distance_matrix, demands, vehiculos, depot=0, end_index=end_index)
+    stats['algoritmo'] = 'cvrp'
+
+    # Orden correlativo: primero las paradas del vehículo 1, luego las del 2, ...
+    ruta = [0]
+    for r in resultado['rutas']:
+        ruta.extend(r['ruta'][1:-1])
+    ruta.append(end_index)
+
+    return {
+        'ruta': ruta,
+        'distancia_km': resultado['distancia_total_km'],
+        'rutas_vehiculos': [
+            dict(r, numero=k + 1) for k, r in enumerate(resultado['rutas']) if len(r['ruta']) > 2
+        ],
+        'sin_asignar': resultado['sin_asignar'],
+        'tramos': _tramos(distance_matrix, [r['ruta'] for r in resultado['rutas']]),
+    }
+
+
+def _tramos(distance_matrix, recorridos):
+    """Km de cada tramo que llega a una parada (None si no hay ruta), en orden de recorrido."""
+    return [
+        float(tramo) if math.isfinite(tramo) else None
+        for ruta in recorridos
+        for tramo in optimizer.route_legs(distance_matrix, ruta)[:len(ruta) - 2]
+    ]
+
+
+def guardar_resultado(plan, solucion, usuario=None):
+    """
+    Guarda la solución como un RutaPlan con sus RutaParada (orden, vehículo
+    y tramo) en una sola transacción: un INSERT del plan y un bulk_create de
+    las paradas, sin tocar los puntos. Si la solución no vino de la caché,
+    la memoriza en rutas.result_cache. Los tiempos de la corrida
+    (plan['medicion']) quedan en RutaPlan.tiempos.
+
+    Returns:
+        RutaPlan
+    """
+    puntos = plan['puntos']
+
+    distancia_km = solucion['distancia_km']
+    precio_bencina = plan['precio_bencina']
+    litros = optimizer.calculate_fuel_cost(distancia_km, plan['rendimiento'])
+
+    if solucion['rutas_vehiculos'] is None:
+        recorridos = [(1, solucion['ruta'])]
+        vehiculos = []
+    else:
+        recorridos = [(r['numero'], r['ruta']) for r in solucion['rutas_vehiculos']]
+        vehiculos = [
+            {
+                'nombre': r['vehiculo']['nombre'],
+                'paradas': [puntos[i - 1].nombre for i in r['ruta'][1:-1]],
+                'carga_kg': round(r['carga_kg'], 2),
+                'distancia_km': round(r['distancia_km'], 2),
+                'litros': round(r['litros'], 2),
+                'costo_clp': round(r['litros'] * precio_bencina, 0),
+            }
+            for r in solucion['rutas_vehiculos']
+        ]
+
+    medicion = plan['medicion']
+    with medicion.etapa('guardar') as etapa:
+        with transaction.atomic():
+            ruta_plan = RutaPlan.objects.create(
+                usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+                direccion_origen=plan['direccion_origen'][:255],
+                direccion_destino=plan['direccion_destino'][:255],
+                origen_lat=plan['origen'][0],
+                origen_lng=plan['origen'][1],
+                destino_lat=plan['destino'][0],
+                destino_lng=plan['destino'][1],
+                distancia_total_km=round(distancia_km, 2),
+                litros=round(litros, 2),
+                costo_clp=round(litros * precio_bencina, 0),
+                precio_bencina=precio_bencina,
+                rendimiento_km_por_litro=plan['rendimiento'],
+                num_vehiculos=plan['num_vehiculos'],
+                vehiculos=vehiculos,
+                sin_asignar=[puntos[i - 1].nombre for i in solucion['sin_asignar']],
+            )
+
+            paradas = []
+            tramos = iter(solucion['tramos'])
+            for vehiculo, ruta in recorridos:
+                for matrix_idx, tramo in zip(ruta[1:-1], tramos):
+                    punto = puntos[matrix_idx - 1]
+                    paradas.append(RutaParada(
+                        plan=ruta_plan,
+                        punto=punto,
+                        orden=len(paradas) + 1,
+                        vehiculo=vehiculo,
+                        nombre=punto.nombre,
+                        latitud=float(punto.latitud),
+                        longitud=float(punto.longitud),
+                        distancia_tramo_km=round(tramo, 3) if tramo is not None else None,
+                    ))
+            RutaParada.objects.bulk_create(paradas)
+        etapa['paradas'] = len(paradas)
+
+        if plan['llave_cache'] and plan['solucion_cache'] is None:
+            result_cache.store(plan['llave_cache'], puntos, solucion)
+
+    ruta_plan.tiempos = list(medicion.etapas)
+    ruta_plan.save(update_fields=['tiempos'])
+    return ruta_plan
+
+
+def trazar_ruta(ruta_plan, api_key, medicion=None):
+    """
+    Pide la geometría por calles del plan (rutas.directions) y la guarda en
+    ruta_plan.polilineas, así el mapa no llama a Directions en cada carga.
+    Sin clave o con el proveedor haversine (sin red) no se traza y el mapa
+    une las paradas con líneas rectas; una falla de la API tampoco anula el plan.
+
+    Returns:
+        cantidad de polilíneas guardadas
+    """
+    if not puede_trazar(api_key):
+        return 0
+
+    origen = (ruta_plan.origen_lat, ruta_plan.origen_lng)
+    destino = (ruta_plan.destino_lat, ruta_plan.destino_lng)
+    por_vehiculo = {}
+    for parada in ruta_plan.paradas.all():
+        por_vehiculo.setdefault(parada.vehiculo, []).append((parada.latitud, parada.longitud))
+    vehiculos = sorted(por_vehiculo)
+
+    medicion = medicion or tiempos.Medicion()
+    with medicion.etapa('trazar') as etapa:
+        trazados = directions.trazar([[origen] + por_vehiculo[v] + [destino] for v in vehiculos], api_key)
+        etapa['tramos'] = sum(len(t) for t in trazados) if trazados is not None else 0
+    ruta_plan.tiempos = list(ruta_plan.tiempos) + medicion.etapas[-1:]
+
+    if trazados is None:
+        logger.warning(f"Plan #{ruta_plan.pk} sin geometría: falló la Directions API")
+        ruta_plan.save(update_fields=['tiempos'])
+        return 0
+
+    ruta_plan.polilineas = [
+        {'vehiculo': vehiculo, 'puntos': puntos}
+        for vehiculo, polilineas in zip(vehiculos, trazados)
+        for puntos in polilineas
+    ]
+    ruta_plan.save(update_fields=['polilineas', 'tiempos'])
+    return len(ruta_plan.polilineas)
+
+
+def puede_trazar(api_key):
+    """Sin clave o con el proveedor haversine (sin red) no se pide geometría."""
+    return bool(api_key) and getattr(settings, 'RUTAS_DISTANCE_PROVIDER', 'cached') != 'haversine'
+
+
+def reoptimizar_incremental(ruta_plan, api_key, nuevos=(), usuario=None):
+    """
+    Rehace un plan de un vehículo tras agregar o borrar puntos sin resolver
+    de cero (ver rutas.incremental): saca las paradas cuyo punto ya no
+    existe, inserta los puntos nuevos y corre una búsqueda local corta.
+    De la matriz solo se piden los pares que usa (_matriz_incremental). La
+    geometría no se traza aquí: quien llama la encola (jobs.encolar_trazado).
+
+    Args:
+        ruta_plan: RutaPlan de partida (no se modifica)
+        nuevos: PuntoEntrega a insertar
+
+    Returns:
+        RutaPlan nuevo, o None si el plan es de varios vehículos o no cambió.
+
+    Raises:
+        OptimizacionError si no se pudo obtener la matriz.
+    """
+    if ruta_plan.num_vehiculos != 1:
+        return None
+
+    paradas = list(ruta_plan.paradas.select_related('punto'))
+    actuales = [p.punto for p in paradas if p.punto_id is not None]
+    ya_en_ruta = {p.id for p in actuales}
+    nuevos = [p for p in nuevos if p.id not in ya_en_ruta]
+    if not nuevos and len(actuales) == len(paradas):
+        return None
+
+    puntos = actuales + nuevos
+    if not puntos:
+        return None
+
+    # En índices de la matriz nueva: vecinos de cada parada borrada y
+    # paradas cuyo punto se movió (activos), y arcos de la ruta que siguen
+    # igual, con su tramo ya guardado
+    activos = set()
+    arcos = {}
+    anterior = 0
+    borrado_pendiente = False
+    for parada in paradas:
+        if parada.punto_id is None:
+            activos.add(anterior)
+            borrado_pendiente = True
+            continue
+        actual = anterior + 1
+        if (parada.latitud, parada.longitud) != (float(parada.punto.latitud), float(parada.punto.longitud)):
+            activos.add(actual)
+        if borrado_pendiente:
+            activos.add(actual)
+            borrado_pendiente = False
+        elif parada.distancia_tramo_km is not None:
+            arcos[(anterior, actual)] = parada.distancia_tramo_km
+        anterior = actual
+    end_index = len(puntos) + 1
+    if borrado_pendiente:
+        activos.add(end_index)
+    arcos = {arco: km for arco, km in arcos.items() if not activos.intersection(arco)}
+
+    medicion = tiempos.Medicion()
+    origen = (ruta_plan.origen_lat, ruta_plan.origen_lng)
+    destino = (ruta_plan.destino_lat, ruta_plan.destino_lng)
+    indices_nuevos = list(range(len(actuales) + 1, end_index))
+    distance_matrix = _matriz_incremental(
+        puntos, origen, destino, list(range(len(actuales) + 1)) + [end_index],
+        indices_nuevos, activos, arcos, api_key, medicion,
+    )
+    if distance_matrix is None:
+        raise OptimizacionError(
+            'No se pudo obtener la matriz de distancias. '
+            'Revisa la clave API o la conexión.'
+        )
+
+    plan = {
+        'selected_ids': [str(p.id) for p in puntos],
+        'puntos': puntos,
+        'direccion_origen': ruta_plan.direccion_origen,
+        'direccion_destino': ruta_plan.direccion_destino,
+        'origen': origen,
+        'destino': destino,
+        'distance_matrix': distance_matrix,
+        'end_index': end_index,
+        'demandas': None,
+        'rendimiento': ruta_plan.rendimiento_km_por_litro,
+        'precio_bencina': ruta_plan.precio_bencina,
+        'num_vehiculos': 1,
+        'capacidad_kg': None,
+        'time_limit_ms': None,
+        # No se memoriza: el resultado depende del orden de partida
+        'llave_cache': None,
+        'solucion_cache': None,
+        'medicion': medicion,
+    }
+
+    with medicion.etapa('resolver', algoritmo='incremental'):
+        ruta, stats = incremental.reoptimizar(
+            distance_matrix,
+            list(range(len(actuales) + 1)) + [end_index],
+            nuevos=indices_nuevos,
+            activos=activos,
+            coords=coordenadas_matriz(plan),
+            methods=getattr(settings, 'RUTAS_LOCAL_SEARCH', None),
+            time_limit_ms=getattr(settings, 'RUTAS_INCREMENTAL_TIME_LIMIT_MS', incremental.DEFAULT_TIME_LIMIT_MS),
+        )
+    solucion = {
+        'ruta': ruta,
+        'distancia_km': optimizer._route_distance(distance_matrix, ruta),
+        'rutas_vehiculos': None,
+        'sin_asignar': [],
+        'tramos': _tramos(distance_matrix, [ruta]),
+    }
+    logger.info(
+        f"Re-optimización incremental del plan #{ruta_plan.pk}: {len(nuevos)} agregados, "
+        f"{len(paradas) - len(actuales)} borrados, {stats['activos']} nodos activos, "
+        f"{stats['ms']:.0f} ms"
+    )
+    return guardar_resultado(plan, solucion, usuario)
+
+
+def _matriz_incremental(puntos, origen, destino, route, nuevos, activos, arcos, api_key, medicion):
+    """
+    Matriz de la re-optimización incremental sin pedir los n x n pares.
+    Con la matriz global (rutas.matriz_global) los pares entre puntos ya
+    están en el archivo y solo se piden los faltantes: la fila y columna de
+    los puntos nuevos. Sin ella se piden las filas y columnas de los nuevos,
+    el origen y el destino, y los pares del vecindario de la búsqueda local
+    (incremental.vecindario); los arcos de la ruta que no cambiaron salen
+    de sus tramos guardados, solo en su sentido. El resto queda en inf,
+    también el sentido contrario de un tramo guardado (con datos
+    asimétricos no se inventa su costo).
+
+    Args:
+        route: orden actual en índices de la matriz, sin los nuevos
+        nuevos, activos: índices de los puntos nuevos y de los tocados
+        arcos: {(i, j): km} de la ruta actual que siguen valiendo
+    """
+    if matriz_global.habilitada():
+        return _matriz(puntos, origen, destino, api_key, medicion)
+
+    coords = [tuple(origen)] + [(float(p.latitud), float(p.longitud)) for p in puntos] + [tuple(destino)]
+    n = len(coords)
+    todos = list(range(n))
+    filas = [0] + list(nuevos) + [n - 1]
+    vecindario = incremental.vecindario(coords, route, sorted(set(nuevos) | activos))
+    blocks = [(filas, todos), (todos, filas)] + ([(vecindario, vecindario)] if vecindario else [])
+
+    proveedor = getattr(settings, 'RUTAS_DISTANCE_PROVIDER', 'cached')
+    with medicion.etapa('matriz', elementos=2 * len(filas) * n + len(vecindario) ** 2, proveedor=proveedor):
+        provider = distance_providers.get_provider(api_key)
+        fetched = provider.matrix_blocks(coords, blocks)
+        if fetched is None and provider.name != distance_providers.HaversineDistanceProvider.name \
+                and getattr(settings, 'RUTAS_DISTANCE_FALLBACK', True):
+            logger.warning(f"Proveedor '{provider.name}' sin respuesta; usando estimación local")
+            fetched = distance_providers.HaversineDistanceProvider().matrix_blocks(coords, blocks)
+        if fetched is None:
+            return None
+
+        distance_matrix = np.full((n, n), np.nan, dtype=distance_providers.MATRIX_DTYPE)
+        for (i, j), km in arcos.items():
+            distance_matrix[i, j] = km
+        return distance_providers._assemble(n, fetched, distance_matrix, fill_transpose=False)
+
+
+def _float_param(data, name, default):
+    value = data.get(name, '').strip()
+    try:
+        return float(value) if value else default
+    except ValueError:
+        return default
+
+
+def _geocodificar(direccion, api_key, etiqueta):
+    """(lat, lng) de una dirección, vía la caché de rutas.geocoding."""
+    try:
+        return geocoding.geocodificar(direccion, api_key)
+    except geocoding.GeocodingError as e:
+        raise OptimizacionError(
+            f"No se pudo geocodificar la dirección {etiqueta}: {direccion} "
+            f"(estado: {e.estado})."
+        )
+    except Exception as e:
+        logger.error(f"Error geocodificando la dirección {etiqueta}: {e}", exc_info=True)
+        raise OptimizacionError(f"Error al geocodificar la dirección {etiqueta}: {e}")
@@ -0,0 +1,59 @@
+# rutas/signals.py
+"""
+Señales de PuntoEntrega:
+- rutas.result_cache: al mover o borrar un punto se descartan las
+  soluciones memorizadas que lo incluyen.
+- rutas.spatial: el índice en memoria se actualiza punto a punto.
+
+Editar solo nombre o dirección no cambia ninguna solución ni el índice:
+pre_save guarda las coordenadas anteriores en la instancia y post_save solo
+invalida si se movió.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import result_cache, spatial
+from .models import PuntoEntrega
+
+
+@receiver(pre_save, sender=PuntoEntrega)
+def recordar_coordenadas(sender, instance, update_fields=None, **kwargs):
+    instance._coordenadas_previas = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'latitud', 'longitud'} & set(update_fields):
+        instance._coordenadas_previas = _coordenadas(instance.latitud, instance.longitud)
+        return
+    previas = PuntoEntrega.objects.filter(pk=instance.pk).values_list('latitud', 'longitud').first()
+    if previas is not None:
+        instance._coordenadas_previas = _coordenadas(*previas)
+
+
+def _coordenadas(lat, lng):
+    # Con la precisión de la columna (6 decimales): float y Decimal comparan igual
+    return round(float(lat), 6), round(float(lng), 6)
+
+
+def _se_movio(instance):
+    return getattr(instance, '_coordenadas_previas', None) != _coordenadas(instance.latitud, instance.longitud)
+
+
+@receiver(post_save, sender=PuntoEntrega)
+def invalidar_al_editar(sender, instance, created, **kwargs):
+    # Un punto nuevo no está en ninguna solución guardada
+    if not created and _se_movio(instance):
+        result_cache.invalidar_punto(instance.pk)
+
+
+@receiver(post_save, sender=PuntoEntrega)
+def indexar_al_guardar(sender, instance, created, **kwargs):
+    if created or _se_movio(instance):
+        spatial.registrar_puntos([instance])
+    else:
+        spatial.adoptar_version(instance.pk)
+
+
+@receiver(post_delete, sender=PuntoEntrega)
+def invalidar_al_borrar(sender, instance, **kwargs):
+    result_cache.invalidar_punto(instance.pk)
+    spatial.quitar_punto(instance.pk)
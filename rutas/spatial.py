@@ -0,0 +1,513 @@
+# rutas/spatial.py
+"""
+Índice espacial de los puntos de entrega.
+
+- En BD: columna PuntoEntrega.geohash con índice; filtrar_bbox() traduce un
+  rectángulo a unos pocos rangos de geohash más el filtro exacto por
+  latitud/longitud, sin cargar la tabla.
+- En memoria: KDTree sobre vectores unitarios 3D (la distancia euclidiana
+  entre ellos, la cuerda, crece con la distancia sobre la esfera, así
+  k vecinos y radio son exactos). Las hojas se resuelven con numpy.
+
+El índice en memoria del proceso (indice()) se arma desde la BD y después
+se actualiza en forma incremental con las señales de PuntoEntrega
+(rutas.signals): los puntos nuevos o movidos van a un búfer que se recorre
+por fuerza bruta y los viejos quedan marcados como borrados; cuando el búfer
+crece se reconstruye el árbol. Otros procesos (varios workers web, pool de
+jobs) no reciben las señales: cada consulta compara version_datos() (cantidad,
+id máximo y última modificación, una consulta agregada) con la del índice y
+lo rearma si cambió. Tras aplicar un cambio propio (al confirmar la
+transacción) el proceso relee version_datos() y la registra como la del
+índice, así no rearma por sus propios cambios pero sí por los de otro
+proceso posteriores.
+
+El endpoint del viewport (views.puntos_mapa) pide el rectángulo con
+en_bbox(): en memoria si el índice del proceso está al día, si no con
+filtrar_bbox() en la BD, sin rearmar el índice. agrupar_en_grilla() agrupa
+los puntos por celdas de la proyección del mapa (Web Mercator).
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from . import geohash
+from .models import PuntoEntrega
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+LEAF_SIZE = 32
+REBUILD_MIN = 256      # cambios pendientes antes de reconstruir el árbol...
+REBUILD_FRACTION = 0.05  # ...o esta fracción de los puntos, lo que sea mayor
+TILE_SIZE = 256  # px del mundo a zoom 0 (Google Maps)
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def unit_vectors(lats, lngs):
+    """(n, 3) vectores unitarios de coordenadas en grados."""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)])
+
+
+def km_a_cuerda(km):
+    return 2.0 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def cuerda_a_km(cuerda):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(cuerda) / 2.0, 1.0))
+
+
+class KDTree:
+    """
+    KD-tree estático (nodos en arrays) sobre puntos de cualquier dimensión.
+    Cada nodo guarda su caja envolvente para podar por distancia mínima.
+    """
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.points = np.asarray(points, dtype=np.float64)
+        n = self.points.shape[0]
+        self.perm = np.arange(n)
+
+        lo, hi, start, end, left, right = [], [], [], [], [], []
+
+        def nuevo(s, e):
+            pts = self.points[self.perm[s:e]]
+            lo.append(pts.min(axis=0) if e > s else np.zeros(self.points.shape[1]))
+            hi.append(pts.max(axis=0) if e > s else np.zeros(self.points.shape[1]))
+            start.append(s)
+            end.append(e)
+            left.append(-1)
+            right.append(-1)
+            return len(start) - 1
+
+        pila = [nuevo(0, n)]
+        while pila:
+            nodo = pila.pop()
+            s, e = start[nodo], end[nodo]
+            if e - s <= leaf_size:
+                continue
+            axis = int(np.argmax(hi[nodo] - lo[nodo]))
+            mid = (s + e) // 2
+            segmento = self.perm[s:e]
+            self.perm[s:e] = segmento[np.argpartition(self.points[segmento, axis], mid - s)]
+            left[nodo], right[nodo] = nuevo(s, mid), nuevo(mid, e)
+            pila.extend((left[nodo], right[nodo]))
+
+        self.lo, self.hi = np.array(lo), np.array(hi)
+        self.start, self.end = start, end
+        self.left, self.right = left, right
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def _min_dist(self, nodo, q):
+        gap = np.maximum(np.maximum(self.lo[nodo] - q, q - self.hi[nodo]), 0.0)
+        return math.sqrt(float(gap @ gap))
+
+    def _max_dist(self, nodo, q):
+        far = np.maximum(np.abs(q - self.lo[nodo]), np.abs(q - self.hi[nodo]))
+        return math.sqrt(float(far @ far))
+
+    def query(self, q, k):
+        """
+        Los k puntos más cercanos a q (búsqueda best-first).
+
+        Returns:
+            (distancias, índices) ordenados por distancia
+        """
+        q = np.asarray(q, dtype=np.float64)
+        k = min(k, len(self))
+        best_d, best_i = np.empty(0), np.empty(0, dtype=np.intp)
+        if k <= 0:
+            return best_d, best_i
+
+        cola = [(0.0, 0)]
+        while cola:
+            dist, nodo = heapq.heappop(cola)
+            if len(best_d) == k and dist > best_d[-1]:
+                break
+            if self.left[nodo] < 0:
+                idx = self.perm[self.start[nodo]:self.end[nodo]]
+                diff = self.points[idx] - q
+                best_d = np.concatenate([best_d, np.sqrt(np.einsum('ij,ij->i', diff, diff))])
+                best_i = np.concatenate([best_i, idx])
+                orden = np.argsort(best_d, kind='stable')[:k]
+                best_d, best_i = best_d[orden], best_i[orden]
+                continue
+            for hijo in (self.left[nodo], self.right[nodo]):
+                heapq.heappush(cola, (self._min_dist(hijo, q), hijo))
+        return best_d, best_i
+
+    def query_radius(self, q, r):
+        """Índices (sin orden) de los puntos a distancia <= r de q."""
+        q = np.asarray(q, dtype=np.float64)
+        partes = []
+        pila = [0] if len(self) else []
+        while pila:
+            nodo = pila.pop()
+            if self._min_dist(nodo, q) > r:
+                continue
+            idx = self.perm[self.start[nodo]:self.end[nodo]]
+            if self._max_dist(nodo, q) <= r:
+                partes.append(idx)  # la caja completa cae dentro
+            elif self.left[nodo] < 0:
+                diff = self.points[idx] - q
+                partes.append(idx[np.einsum('ij,ij->i', diff, diff) <= r * r])
+            else:
+                pila.extend((self.left[nodo], self.right[nodo]))
+        return np.concatenate(partes) if partes else np.empty(0, dtype=np.intp)
+
+
+class IndiceEspacial:
+    """
+    Puntos (id, lat, lng) con consultas por k vecinos, radio y rectángulo.
+    Las distancias devueltas son en km sobre la esfera (sin factor de ruta).
+    """
+
+    def __init__(self, ids, lats, lngs):
+        self._lock = threading.RLock()
+        self.version = None
+        self._construir(
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(lats, dtype=np.float64),
+            np.asarray(lngs, dtype=np.float64),
+        )
+
+    def _construir(self, ids, lats, lngs):
+        self._ids, self._lats, self._lngs = ids, lats, lngs
+        self._tree = KDTree(unit_vectors(lats, lngs))
+        self._posicion = {int(pid): k for k, pid in enumerate(ids)}
+        self._vivo = np.ones(len(ids), dtype=bool)
+        self._buffer = {}  # id -> (lat, lng) agregados o movidos desde la última construcción
+
+    def __len__(self):
+        with self._lock:
+            return int(self._vivo.sum()) + len(self._buffer)
+
+    def max_id(self):
+        with self._lock:
+            vivos = self._ids[self._vivo]
+            return max(int(vivos.max()) if len(vivos) else 0, max(self._buffer, default=0))
+
+    def actualizar(self, pid, lat, lng):
+        with self._lock:
+            self._marcar_borrado(pid)
+            self._buffer[int(pid)] = (float(lat), float(lng))
+            self._quizas_reconstruir()
+
+    def quitar(self, pid):
+        with self._lock:
+            self._marcar_borrado(pid)
+            self._buffer.pop(int(pid), None)
+            self._quizas_reconstruir()
+
+    def _marcar_borrado(self, pid):
+        k = self._posicion.get(int(pid))
+        if k is not None:
+            self._vivo[k] = False
+
+    def _quizas_reconstruir(self):
+        pendientes = len(self._buffer) + int((~self._vivo).sum())
+        if pendientes <= max(REBUILD_MIN, REBUILD_FRACTION * len(self._ids)):
+            return
+        extra = list(self._buffer.items())
+        self._construir(
+            np.concatenate([self._ids[self._vivo], np.array([pid for pid, _ in extra], dtype=np.int64)]),
+            np.concatenate([self._lats[self._vivo], np.array([ll[0] for _, ll in extra], dtype=np.float64)]),
+            np.concatenate([self._lngs[self._vivo], np.array([ll[1] for _, ll in extra], dtype=np.float64)]),
+        )
+
+    def _buffer_arrays(self):
+        pids = np.fromiter(self._buffer.keys(), dtype=np.int64, count=len(self._buffer))
+        coords = np.array(list(self._buffer.values()), dtype=np.float64).reshape(-1, 2)
+        return pids, coords[:, 0], coords[:, 1]
+
+    def cercanos(self, lat, lng, k):
+        """
+        Returns:
+            lista de (id, distancia_km) de los k puntos más cercanos, ordenada
+        """
+        q = unit_vectors([lat], [lng])[0]
+        with self._lock:
+            # Se piden k + borrados para que los marcados no dejen la lista corta
+            borrados = len(self._ids) - int(self._vivo.sum())
+            dist, idx = self._tree.query(q, k + borrados)
+            vivos = self._vivo[idx]
+            ids, dist = self._ids[idx][vivos], dist[vivos]
+
+            if self._buffer:
+                b_ids, b_lats, b_lngs = self._buffer_arrays()
+                diff = unit_vectors(b_lats, b_lngs) - q
+                ids = np.concatenate([ids, b_ids])
+                dist = np.concatenate([dist, np.sqrt(np.einsum('ij,ij->i', diff, diff))])
+
+        orden = np.argsort(dist, kind='stable')[:k]
+        return [(int(pid), float(km)) for pid, km in zip(ids[orden], cuerda_a_km(dist[orden]))]
+
+    def en_radio(self, lat, lng, radio_km):
+        """
+        Returns:
+            lista de (id, distancia_km) a no más de radio_km, ordenada
+        """
+        q = unit_vectors([lat], [lng])[0]
+        r = km_a_cuerda(radio_km)
+        with self._lock:
+            idx = self._tree.query_radius(q, r)
+            idx = idx[self._vivo[idx]]
+            ids = self._ids[idx]
+            diff = self._tree.points[idx] - q
+
+            if self._buffer:
+                b_ids, b_lats, b_lngs = self._buffer_arrays()
+                ids = np.concatenate([ids, b_ids])
+                diff = np.concatenate([diff, unit_vectors(b_lats, b_lngs) - q])
+
+        dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        dentro = dist <= r
+        ids, dist = ids[dentro], dist[dentro]
+        orden = np.argsort(dist, kind='stable')
+        return [(int(pid), float(km)) for pid, km in zip(ids[orden], cuerda_a_km(dist[orden]))]
+
+    def coordenadas_en_bbox(self, sur, oeste, norte, este):
+        """
+        (ids, lats, lngs) de los puntos dentro del rectángulo. Se consulta el
+        árbol con el círculo que circunscribe el rectángulo (su distancia
+        máxima desde el centro está en una esquina) y se filtra por
+        latitud/longitud.
+        """
+        if oeste > este:  # cruza el antimeridiano
+            partes = zip(
+                self.coordenadas_en_bbox(sur, oeste, norte, 180.0),
+                self.coordenadas_en_bbox(sur, -180.0, norte, este),
+            )
+            return tuple(np.concatenate(par) for par in partes)
+
+        centro = unit_vectors([(sur + norte) / 2], [(oeste + este) / 2])[0]
+        esquinas = unit_vectors([sur, sur, norte, norte], [oeste, este, oeste, este])
+        r = float(np.sqrt(((esquinas - centro) ** 2).sum(axis=1)).max())
+
+        with self._lock:
+            idx = self._tree.query_radius(centro, r)
+            idx = idx[self._vivo[idx]]
+            ids, lats, lngs = self._ids[idx], self._lats[idx], self._lngs[idx]
+            if self._buffer:
+                b_ids, b_lats, b_lngs = self._buffer_arrays()
+                ids = np.concatenate([ids, b_ids])
+                lats = np.concatenate([lats, b_lats])
+                lngs = np.concatenate([lngs, b_lngs])
+
+        dentro = (lats >= sur) & (lats <= norte) & (lngs >= oeste) & (lngs <= este)
+        return ids[dentro], lats[dentro], lngs[dentro]
+
+
+# --- Índice del proceso ---
+
+def version_datos():
+    """Cambia con cada alta, baja o movimiento de un PuntoEntrega."""
+    v = PuntoEntrega.objects.aggregate(n=Count('id'), max_id=Max('id'), ultimo=Max('actualizado_en'))
+    ultimo = v['ultimo'].isoformat() if v['ultimo'] else ''
+    return f"{v['n']}-{v['max_id'] or 0}-{ultimo}"
+
+
+def _solo_cambios_propios(arbol, version, ids):
+    """
+    La BD pasó de arbol.version a version solo por los cambios propios (ids)
+    ya aplicados: cantidad e id máximo cuadran con el índice y ningún otro
+    punto se modificó entre medio (la versión sola no lo muestra: el
+    actualizado_en máximo pasa a ser el del cambio propio).
+    """
+    n, max_id, ultimo = version.split('-', 2)
+    if int(n) != len(arbol) or int(max_id) != arbol.max_id():
+        return False
+    ajenos = PuntoEntrega.objects.exclude(pk__in=ids)
+    anterior = arbol.version.split('-', 2)[2] if arbol.version else ''
+    if anterior:
+        ajenos = ajenos.filter(actualizado_en__gt=datetime.fromisoformat(anterior))
+    if ultimo:
+        ajenos = ajenos.filter(actualizado_en__lte=datetime.fromisoformat(ultimo))
+    return not ajenos.exists()
+
+
+def indice(version=None):
+    """
+    IndiceEspacial de todos los PuntoEntrega, al día con la BD.
+
+    Args:
+        version: version_datos() si quien llama ya la consultó
+    """
+    global _indice
+    version = version or version_datos()
+    with _indice_lock:
+        if _indice is None or _indice.version != version:
+            t0 = time.perf_counter()
+            filas = list(PuntoEntrega.objects.values_list('id', 'latitud', 'longitud'))
+            _indice = IndiceEspacial(
+                [f[0] for f in filas],
+                [float(f[1]) for f in filas],
+                [float(f[2]) for f in filas],
+            )
+            _indice.version = version
+            logger.info(
+                f"Índice espacial: {len(filas)} puntos en {(time.perf_counter() - t0) * 1000:.0f} ms"
+            )
+        return _indice
+
+
+def invalidar():
+    """Descarta el índice del proceso; se rearma en la próxima consulta."""
+    global _indice
+    with _indice_lock:
+        _indice = None
+
+
+def registrar_puntos(puntos):
+    """Agrega o mueve puntos en el índice del proceso al confirmar la transacción."""
+    cambios = [(p.pk, float(p.latitud), float(p.longitud)) for p in puntos]
+
+    def aplicar(arbol):
+        for pid, lat, lng in cambios:
+            arbol.actualizar(pid, lat, lng)
+
+    transaction.on_commit(lambda: _aplicar_propio(aplicar, [pid for pid, _, _ in cambios]))
+
+
+def adoptar_version(pid):
+    """
+    Un punto se guardó sin moverse: el árbol sigue valiendo y solo registra
+    la versión nueva (actualizado_en cambió), sin rearmarlo.
+    """
+    transaction.on_commit(lambda: _aplicar_propio(lambda arbol: None, [pid]))
+
+
+def quitar_punto(pid):
+    transaction.on_commit(lambda: _aplicar_propio(lambda arbol: arbol.quitar(pid), [pid]))
+
+
+def _aplicar_propio(aplicar, ids):
+    """
+    Aplica al índice un cambio propio ya confirmado y registra la versión
+    que dejó en la BD, releída aquí, si se llegó a ella solo por este
+    cambio. Si otro proceso cambió puntos entre medio el índice se descarta
+    (se rearma en la próxima consulta); si los cambia después, su versión
+    ya no es la registrada e indice() rearma.
+    """
+    global _indice
+    with _indice_lock:
+        arbol = _indice
+        if arbol is None:
+            return
+        aplicar(arbol)
+    version = version_datos()
+    al_dia = _solo_cambios_propios(arbol, version, ids)
+    with _indice_lock:
+        if _indice is not arbol:
+            return
+        if al_dia:
+            arbol.version = version
+        else:
+            _indice = None
+
+
+def cercanos(lat, lng, k):
+    return indice().cercanos(lat, lng, k)
+
+
+def en_radio(lat, lng, radio_km):
+    return indice().en_radio(lat, lng, radio_km)
+
+
+def en_bbox(sur, oeste, norte, este, version=None):
+    """
+    (ids, lats, lngs) de los puntos dentro del rectángulo. Con el índice del
+    proceso al día se consulta en memoria; si no (otro proceso cambió
+    puntos o aún no se arma), en vez de rearmarlo con toda la tabla se
+    filtra en la BD por geohash (filtrar_bbox), que solo lee el rectángulo.
+
+    Args:
+        version: version_datos() si quien llama ya la consultó
+    """
+    version = version or version_datos()
+    with _indice_lock:
+        al_dia = _indice is not None and _indice.version == version
+    if al_dia:
+        return indice(version).coordenadas_en_bbox(sur, oeste, norte, este)
+
+    filas = list(
+        filtrar_bbox(PuntoEntrega.objects.all(), sur, oeste, norte, este)
+        .values_list('id', 'latitud', 'longitud')
+    )
+    return (
+        np.array([f[0] for f in filas], dtype=np.int64),
+        np.array([float(f[1]) for f in filas], dtype=np.float64),
+        np.array([float(f[2]) for f in filas], dtype=np.float64),
+    )
+
+
+def agrupar_en_grilla(lats, lngs, zoom, celda_px):
+    """
+    Agrupa puntos por celdas de celda_px x celda_px píxeles del mapa al zoom dado.
+
+    Returns:
+        (grupo, cantidad, lat_media, lng_media): grupo[i] es el índice de la
+        celda del punto i en los otros tres arrays
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    celdas_por_mundo = TILE_SIZE * 2 ** zoom / celda_px
+
+    x = np.floor((lngs + 180.0) / 360.0 * celdas_por_mundo)
+    sin_lat = np.clip(np.sin(np.radians(lats)), -0.9999, 0.9999)
+    y = np.floor((0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * celdas_por_mundo)
+
+    _, grupo, cantidad = np.unique(
+        np.column_stack([x, y]), axis=0, return_inverse=True, return_counts=True
+    )
+    grupo = grupo.ravel()
+    lat_media = np.bincount(grupo, weights=lats) / cantidad
+    lng_media = np.bincount(grupo, weights=lngs) / cantidad
+    return grupo, cantidad, lat_media, lng_media
+
+
+def filtrar_bbox(queryset, sur, oeste, norte, este):
+    """
+    Filtra un queryset de PuntoEntrega por rectángulo en la BD: rangos de
+    geohash (usan el índice) y luego latitud/longitud exactas.
+    """
+    if oeste > este:  # cruza el antimeridiano
+        return filtrar_bbox(queryset, sur, oeste, norte, 180.0) | filtrar_bbox(queryset, sur, -180.0, norte, este)
+
+    rangos = Q()
+    for desde, hasta in _rangos(geohash.cubrir(sur, oeste, norte, este)):
+        rangos |= Q(geohash__gte=desde, geohash__lt=hasta + '~')
+    return queryset.filter(
+        rangos,
+        latitud__gte=sur, latitud__lte=norte,
+        longitud__gte=oeste, longitud__lte=este,
+    )
+
+
+def _rangos(prefijos):
+    """Une prefijos consecutivos (mismo largo) en rangos (primero, último)."""
+    rangos = []
+    anterior = None
+    for prefijo in prefijos:
+        valor = 0
+        for c in prefijo:
+            valor = valor * 32 + geohash.BASE32.index(c)
+        if rangos and valor == anterior + 1:
+            rangos[-1][1] = prefijo
+        else:
+            rangos.append([prefijo, prefijo])
+        anterior = valor
+    return rangos
@@ -2,8 +2,8 @@
 
 let map;
 let markers = [];
-let directionsService = null;
-let directionsRenderer = null;
+let routePolylines = [];
+const ROUTE_COLORS = ["#1a73e8", "#d93025", "#188038", "#f9ab00", "#9334e6", "#e37400"];
 
 function initMap() {
     console.log("initMap llamado");
@@ -17,6 +17,11 @@ function initMap() {
             lat: puntos_entrega_data[0].latitud,
             lng: puntos_entrega_data[0].longitud
         };
+    } else if (typeof limites_puntos !== "undefined" && limites_puntos) {
+        center = {
+            lat: (limites_puntos.sur + limites_puntos.norte) / 2,
+            lng: (limites_puntos.oeste + limites_puntos.este) / 2
+        };
     }
 
     map = new google.maps.Map(document.getElementById("map"), {
@@ -24,11 +29,8 @@ function initMap() {
         zoom: 12
     });
 
-    directionsService = new google.maps.DirectionsService();
-    directionsRenderer = new google.maps.DirectionsRenderer({
-        suppressMarkers: true
-    });
-    directionsRenderer.setMap(map);
+    // El resto de los puntos se pide por viewport cada vez que el mapa se detiene
+    map.addListener("idle", programarCargaViewport);
 
     renderPuntosEntrega();
 }
@@ -58,24 +60,24 @@ function renderPuntosEntrega() {
     // PUNTOS DE ENTREGA
     if (Array.isArray(puntos_entrega_data) && puntos_entrega_data.length > 0) {
         const anyOrden = puntos_entrega_data.some(
-            (p) => p.orden_optimo !== null && p.orden_optimo !== undefined
+            (p) => p.orden !== null && p.orden !== undefined
         );
 
         const puntos = [...puntos_entrega_data];
 
         if (anyOrden) {
             puntos.sort((a, b) => {
-                if (a.orden_optimo == null) return 1;
-                if (b.orden_optimo == null) return -1;
-                return a.orden_optimo - b.orden_optimo;
+                if (a.orden == null) return 1;
+                if (b.orden == null) return -1;
+                return a.orden - b.orden;
             });
         }
 
         puntos.forEach((p, index) => {
             const position = { lat: p.latitud, lng: p.longitud };
 
-            const labelText = (anyOrden && p.orden_optimo)
-                ? String(p.orden_optimo)
+            const labelText = (anyOrden && p.orden)
+                ? String(p.orden)
                 : String(index + 1);
 
             const marker = new google.maps.Marker({
@@ -109,41 +111,45 @@ function renderPuntosEntrega() {
 
     if (!bounds.isEmpty()) {
         map.fitBounds(bounds);
+    } else if (typeof limites_puntos !== "undefined" && limites_puntos) {
+        map.fitBounds({
+            south: limites_puntos.sur,
+            west: limites_puntos.oeste,
+            north: limites_puntos.norte,
+            east: limites_puntos.este
+        });
     }
 
-    if (path.length > 1) {
-        drawRouteWithDirectionsAPI(path);
-    }
+    drawRoute(path);
 }
 
-function drawRouteWithDirectionsAPI(path) {
-    if (!directionsService || !directionsRenderer) return;
-    if (!Array.isArray(path) || path.length < 2) return;
-
-    const origin = path[0];
-    const destination = path[path.length - 1];
+// La geometría por calles viene guardada con el plan (polilíneas codificadas);
+// sin ella (proveedor haversine, sin clave o falla de la API) se unen las paradas en línea recta.
+function drawRoute(path) {
+    const tramos = (typeof polilineas_ruta !== "undefined" && Array.isArray(polilineas_ruta))
+        ? polilineas_ruta
+        : [];
+
+    if (tramos.length > 0 && google.maps.geometry && google.maps.geometry.encoding) {
+        tramos.forEach((tramo) => {
+            addRoutePolyline(
+                google.maps.geometry.encoding.decodePath(tramo.puntos),
+                ROUTE_COLORS[tramo.vehiculo % ROUTE_COLORS.length]
+            );
+        });
+    } else if (Array.isArray(path) && path.length > 1) {
+        addRoutePolyline(path, ROUTE_COLORS[0]);
+    }
+}
 
-    const waypoints = path.slice(1, -1).map((pos) => ({
-        location: pos,
-        stopover: true
+function addRoutePolyline(path, color) {
+    routePolylines.push(new google.maps.Polyline({
+        path: path,
+        map: map,
+        strokeColor: color,
+        strokeOpacity: 0.8,
+        strokeWeight: 4
     }));
-
-    const request = {
-        origin: origin,
-        destination: destination,
-        waypoints: waypoints,
-        travelMode: google.maps.TravelMode.DRIVING,
-        optimizeWaypoints: false
-    };
-
-    directionsService.route(request, (result, status) => {
-        console.log("Directions status:", status);
-        if (status === "OK" || status === google.maps.DirectionsStatus.OK) {
-            directionsRenderer.setDirections(result);
-        } else {
-            console.error("Error en Directions API:", status);
-        }
-    });
 }
 
 function clearMap() {
@@ -152,9 +158,98 @@ function clearMap() {
         markers = [];
     }
 
-    if (directionsRenderer) {
-        directionsRenderer.set("directions", null);
-    }
+    routePolylines.forEach((l) => l.setMap(null));
+    routePolylines = [];
+}
+
+// ===================== PUNTOS POR VIEWPORT (CLUSTERS DEL SERVIDOR) =====================
+let viewportMarkers = [];
+let viewportTimer = null;
+let viewportRequest = null;
+
+function programarCargaViewport() {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(cargarPuntosViewport, 250);
+}
+
+function cargarPuntosViewport() {
+    if (!map || typeof puntos_mapa_url === "undefined") return;
+    const bounds = map.getBounds();
+    if (!bounds) return;
+
+    const ne = bounds.getNorthEast();
+    const sw = bounds.getSouthWest();
+    // Coordenadas redondeadas: el mismo encuadre da la misma URL y el ETag evita rehacer la respuesta
+    const params = new URLSearchParams({
+        sur: sw.lat().toFixed(4),
+        oeste: sw.lng().toFixed(4),
+        norte: ne.lat().toFixed(4),
+        este: ne.lng().toFixed(4),
+        zoom: map.getZoom()
+    });
+
+    // Solo importa la respuesta del último movimiento
+    if (viewportRequest) viewportRequest.abort();
+    viewportRequest = new AbortController();
+
+    fetch(puntos_mapa_url + "?" + params.toString(), {
+        credentials: "same-origin",
+        signal: viewportRequest.signal
+    })
+        .then((response) => {
+            if (!response.ok) throw new Error("HTTP " + response.status);
+            return response.json();
+        })
+        .then(renderViewport)
+        .catch((err) => {
+            if (err.name !== "AbortError") console.error("Error cargando puntos del mapa:", err);
+        });
+}
+
+function renderViewport(data) {
+    viewportMarkers.forEach((m) => m.setMap(null));
+    viewportMarkers = [];
+
+    data.clusters.forEach((c) => {
+        const marker = new google.maps.Marker({
+            position: { lat: c.lat, lng: c.lng },
+            map: map,
+            label: { text: String(c.cantidad), color: "#ffffff", fontSize: "11px" },
+            icon: {
+                path: google.maps.SymbolPath.CIRCLE,
+                scale: 12 + Math.min(Math.log10(c.cantidad) * 6, 18),
+                fillColor: "#1a73e8",
+                fillOpacity: 0.85,
+                strokeColor: "#ffffff",
+                strokeWeight: 2
+            },
+            title: `${c.cantidad} puntos`
+        });
+        marker.addListener("click", () => {
+            map.setCenter(marker.getPosition());
+            map.setZoom(map.getZoom() + 2);
+        });
+        viewportMarkers.push(marker);
+    });
+
+    // Las paradas del plan ya tienen su marcador numerado
+    const enRuta = new Set((puntos_entrega_data || []).map((p) => p.id));
+    data.puntos.forEach((p) => {
+        if (enRuta.has(p.id)) return;
+        viewportMarkers.push(new google.maps.Marker({
+            position: { lat: p.lat, lng: p.lng },
+            map: map,
+            icon: {
+                path: google.maps.SymbolPath.CIRCLE,
+                scale: 5,
+                fillColor: "#5f6368",
+                fillOpacity: 0.9,
+                strokeColor: "#ffffff",
+                strokeWeight: 1
+            },
+            title: `${p.nombre} - ${p.direccion}`
+        }));
+    });
 }
 
 function toggleOrigenCustom() {
@@ -355,6 +450,235 @@ function borrarTodosPuntos(url) {
     });
 }
 
+// ===================== OPTIMIZACIÓN CON PROGRESO EN VIVO (SSE) =====================
+let progresoPolyline = null;
+
+function optimizarConProgreso(form) {
+    const status = document.getElementById("progreso_optimizacion");
+    if (status) status.textContent = "Calculando ruta...";
+
+    // El job se crea por POST (con CSRF); el stream solo muestra su progreso
+    fetch(form.action, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {
+            "X-CSRFToken": getCSRFToken(),
+            "X-Requested-With": "XMLHttpRequest",
+        },
+        body: new FormData(form),
+    })
+    .then((response) => response.json().then((data) => {
+        if (!response.ok) throw new Error(data.error || "HTTP " + response.status);
+        return data;
+    }))
+    .then((job) => seguirProgreso(job, status))
+    .catch((err) => {
+        console.error(err);
+        if (status) status.textContent = err.message || "No se pudo iniciar la optimización.";
+    });
+}
+
+function seguirProgreso(job, status) {
+    const source = new EventSource(job.stream_url);
+
+    source.addEventListener("progreso", (e) => {
+        const data = JSON.parse(e.data);
+        if (status) {
+            status.textContent =
+                `Costo: ${data.costo.toFixed(2)} km · ${data.ms} ms · iteración ${data.iteracion}`;
+        }
+        if (!map) return;
+
+        const path = data.ruta.map(([lat, lng]) => ({ lat: lat, lng: lng }));
+        if (progresoPolyline) {
+            progresoPolyline.setPath(path);
+        } else {
+            progresoPolyline = new google.maps.Polyline({
+                path: path,
+                map: map,
+                strokeColor: "#1a73e8",
+                strokeOpacity: 0.8,
+                strokeWeight: 3
+            });
+        }
+    });
+
+    source.addEventListener("fin", (e) => {
+        source.close();
+        const url = JSON.parse(e.data).url;
+        // Consultar el estado cierra el job en la sesión (si no, el mapa vuelve a esperarlo)
+        fetch(job.estado_url, { credentials: "same-origin" })
+            .finally(() => { window.location.href = url; });
+    });
+
+    // El stream se corta a los pocos segundos para no ocupar un worker del
+    // servidor: el resto se sigue consultando el estado
+    source.addEventListener("pausa", () => {
+        source.close();
+        if (status) status.textContent = "La optimización sigue en curso...";
+        esperarOptimizacion(job.estado_url);
+    });
+
+    source.addEventListener("error", (e) => {
+        source.close();
+        // Evento "error" del servidor (con datos) o caída de la conexión (sin datos)
+        const mensaje = e.data
+            ? JSON.parse(e.data).mensaje
+            : "Se perdió la conexión mientras se optimizaba la ruta.";
+        if (status) status.textContent = mensaje;
+        fetch(job.estado_url, { credentials: "same-origin" }).catch(() => {});
+    });
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    const form = document.getElementById("form_optimizar");
+    const verProgreso = document.getElementById("ver_progreso");
+    if (!form || !verProgreso || typeof EventSource === "undefined") return;
+
+    form.addEventListener("submit", (e) => {
+        if (!verProgreso.checked) return;
+        e.preventDefault();
+        optimizarConProgreso(form);
+    });
+});
+
+// ===================== OPTIMIZACIÓN EN SEGUNDO PLANO (POLLING) =====================
+const MAX_ESPERA_OPTIMIZACION_MS = 15 * 60 * 1000;
+// Respuestas que pueden pasar solas (proxy caído, servidor reiniciando): se reintenta
+const HTTP_REINTENTABLES = [502, 503, 504];
+
+function esperarOptimizacion(url, intervalo = 1000, inicio = Date.now()) {
+    const reintentar = (espera) => {
+        if (Date.now() - inicio + espera > MAX_ESPERA_OPTIMIZACION_MS) {
+            mostrarErrorOptimizacion("La optimización está tardando demasiado. Recarga la página más tarde.");
+            return;
+        }
+        setTimeout(() => esperarOptimizacion(url, Math.min(espera * 1.5, 3000), inicio), espera);
+    };
+
+    fetch(url, { credentials: "same-origin" })
+        .then((response) => {
+            if (response.ok) return response.json();
+            if (HTTP_REINTENTABLES.includes(response.status)) return null;
+            // 404 (job de otro usuario o borrado), 500, etc.: no tiene sentido seguir
+            throw new Error("No se pudo consultar la optimización (HTTP " + response.status + ").");
+        })
+        .then((data) => {
+            if (data && data.terminado) {
+                location.reload();
+                return;
+            }
+            // Espaciar las consultas hasta 3 s mientras el job sigue en curso
+            reintentar(data ? intervalo : 3000);
+        })
+        .catch((err) => {
+            console.error("Error consultando la optimización:", err);
+            if (err instanceof TypeError) {
+                reintentar(3000);  // fetch sin respuesta (red caída)
+            } else {
+                mostrarErrorOptimizacion(err.message);
+            }
+        });
+}
+
+function mostrarErrorOptimizacion(mensaje) {
+    const enCurso = document.getElementById("optimizacion_en_curso");
+    if (!enCurso) return;
+    enCurso.className = "alert-error";
+    enCurso.textContent = "";
+    const p = document.createElement("p");
+    p.textContent = mensaje;
+    enCurso.appendChild(p);
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    const enCurso = document.getElementById("optimizacion_en_curso");
+    if (enCurso) esperarOptimizacion(enCurso.dataset.estadoUrl);
+});
+
+// ===================== COMPARAR ORÍGENES (ESCENARIOS) =====================
+function compararEscenarios(form) {
+    const boton = document.getElementById("btn_comparar_escenarios");
+    const contenedor = document.getElementById("tabla_escenarios");
+    if (!boton || !contenedor) return;
+
+    contenedor.textContent = "Comparando escenarios...";
+    boton.disabled = true;
+
+    fetch(boton.dataset.url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {
+            "X-CSRFToken": getCSRFToken(),
+            "X-Requested-With": "XMLHttpRequest",
+        },
+        body: new FormData(form),
+    })
+    .then((response) => response.json())
+    .then((data) => {
+        if (data.error) {
+            contenedor.textContent = data.error;
+            return;
+        }
+        renderEscenarios(contenedor, data.escenarios);
+    })
+    .catch((err) => {
+        console.error(err);
+        contenedor.textContent = "No se pudieron comparar los escenarios.";
+    })
+    .finally(() => { boton.disabled = false; });
+}
+
+function renderEscenarios(contenedor, escenarios) {
+    const tabla = document.createElement("table");
+    const encabezado = tabla.insertRow();
+    ["#", "Origen", "Destino", "Km", "Litros", "Costo (CLP)", "Sin asignar", ""].forEach((texto) => {
+        const th = document.createElement("th");
+        th.textContent = texto;
+        encabezado.appendChild(th);
+    });
+
+    escenarios.forEach((e, i) => {
+        const fila = tabla.insertRow();
+        const valores = [
+            i + 1,
+            e.origen,
+            e.destino === e.origen ? "(vuelve al origen)" : e.destino,
+            e.distancia_km === null ? "sin ruta" : e.distancia_km.toFixed(2),
+            e.litros === null ? "-" : e.litros.toFixed(2),
+            e.costo === null ? "-" : "$" + e.costo.toLocaleString("es-CL"),
+            e.sin_asignar,
+        ];
+        valores.forEach((valor) => { fila.insertCell().textContent = valor; });
+
+        const usar = document.createElement("button");
+        usar.type = "button";
+        usar.textContent = "Usar este origen";
+        usar.addEventListener("click", () => usarEscenario(e));
+        fila.insertCell().appendChild(usar);
+    });
+
+    contenedor.replaceChildren(tabla);
+}
+
+// Deja origen y destino del escenario en el formulario para optimizar con ellos
+function usarEscenario(escenario) {
+    elegirDireccion("origen_predefinido", "origen_custom", escenario.origen);
+    if (escenario.destino === escenario.origen) {
+        document.getElementById("destino_predefinido").value = "same_origin";
+    } else {
+        elegirDireccion("destino_predefinido", "destino_custom", escenario.destino);
+    }
+    toggleOrigenCustom();
+    toggleDestinoCustom();
+}
+
+function elegirDireccion(selectId, customId, direccion) {
+    const select = document.getElementById(selectId);
+    const predefinida = Array.from(select.options).some((o) => o.value === direccion);
+    select.value = predefinida ? direccion : "custom";
+    if (!predefinida) document.getElementById(customId).value = direccion;
+}
 
 // Exponer funciones globales
 window.initMap = initMap;
@@ -363,3 +687,4 @@ window.toggleOrigenCustom = toggleOrigenCustom;
 window.toggleDestinoCustom = toggleDestinoCustom;
 window.eliminarPunto = eliminarPunto;
 window.borrarTodosPuntos = borrarTodosPuntos;
+window.compararEscenarios = compararEscenarios;
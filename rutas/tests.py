@@ -1,3 +1,1442 @@
-from django.test import TestCase
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from crm.models import Cliente, Venta
+
+from . import (
+    anytime, benchmark, cvrp, directions, distance_cache, distance_providers, geocoding, geohash, importacion,
+    incremental, jobs, local_search, maps_client, matriz_global, multistart, optimizer, services, spatial, tiempos,
+)
+from .models import (
+    DistanciaCache, FilaMatrizGlobal, GeocodeCache, OptimizacionJob, PuntoEntrega, ResultadoCache, RutaPlan,
+)
+
+
+def _fake_matrix_response(params):
+    """Respuesta falsa de Distance Matrix: distancia = 1 km por cada par."""
+    origins = params['origins'].split('|')
+    destinations = params['destinations'].split('|')
+    response = mock.Mock()
+    response.raise_for_status.return_value = None
+    response.json.return_value = {
+        'status': 'OK',
+        'rows': [
+            {'elements': [
+                {'status': 'OK', 'distance': {'value': 1000}, 'duration': {'value': 60}}
+                for _ in destinations
+            ]}
+            for _ in origins
+        ],
+    }
+    return response
+
+
+class DistanceCacheTestCase(TestCase):
+    def setUp(self):
+        self.origen = {'latitud': -36.82, 'longitud': -73.05}
+        self.puntos = [
+            PuntoEntrega.objects.create(nombre="A", direccion="a", latitud=-36.80, longitud=-73.04),
+            PuntoEntrega.objects.create(nombre="B", direccion="b", latitud=-36.81, longitud=-73.06),
+        ]
+
+    @mock.patch('rutas.distance_providers.requests.Session.get')
+    def test_segunda_llamada_usa_cache(self, mock_get):
+        mock_get.side_effect = lambda url, params, **kwargs: _fake_matrix_response(params)
+
+        matrix = optimizer.get_distance_matrix(self.puntos, self.origen, "key")
+        self.assertEqual(len(matrix), 3)
+        self.assertEqual(matrix[0][0], 0.0)
+        self.assertEqual(matrix[0][1], 1.0)
+        self.assertEqual(DistanciaCache.objects.count(), 6)
+
+        mock_get.reset_mock()
+        again = optimizer.get_distance_matrix(self.puntos, self.origen, "key")
+        np.testing.assert_array_equal(again, matrix)
+        mock_get.assert_not_called()
+
+    @mock.patch('rutas.distance_providers.requests.Session.get')
+    def test_solo_pide_pares_faltantes(self, mock_get):
+        mock_get.side_effect = lambda url, params, **kwargs: _fake_matrix_response(params)
+        optimizer.get_distance_matrix(self.puntos, self.origen, "key")
+
+        nuevo = PuntoEntrega.objects.create(nombre="C", direccion="c", latitud=-36.83, longitud=-73.07)
+        mock_get.reset_mock()
+        matrix = optimizer.get_distance_matrix(self.puntos + [nuevo], self.origen, "key")
+
+        self.assertEqual(len(matrix), 4)
+        # Una fila nueva (C x todos) + una columna nueva (resto x C)
+        requested = sum(
+            len(c.kwargs['params']['origins'].split('|')) * len(c.kwargs['params']['destinations'].split('|'))
+            for c in mock_get.call_args_list
+        )
+        self.assertEqual(requested, 4 + 3)
+        self.assertEqual(DistanciaCache.objects.count(), 12)
+
+    @override_settings(RUTAS_DISTANCE_CACHE_MAX_ENTRIES=100)
+    def test_desaloja_lru_con_empates(self):
+        # Cada lote comparte ultimo_uso: solo se borran los sobrantes del lote más antiguo
+        distance_cache.store([(f"a{i}", "b", 1.0, None) for i in range(90)])
+        with mock.patch('rutas.distance_cache.timezone.now', return_value=timezone.now() + timedelta(seconds=1)):
+            distance_cache.store([(f"c{i}", "b", 1.0, None) for i in range(20)])
+
+        self.assertEqual(DistanciaCache.objects.count(), 100)
+        self.assertEqual(DistanciaCache.objects.filter(origen__startswith='c').count(), 20)
+
+    @mock.patch('rutas.distance_providers.requests.Session.get')
+    def test_bloques_con_cache(self, mock_get):
+        mock_get.side_effect = lambda url, params, **kwargs: _fake_matrix_response(params)
+        provider = distance_providers.get_provider("key")
+        coords = [(-36.82, -73.05), (-36.80, -73.04), (-36.81, -73.06), (-36.83, -73.07)]
+        provider.matrix(coords[:3])
+
+        mock_get.reset_mock()
+        fetched = provider.matrix_blocks(coords, [([0], [0, 1, 2, 3])])
+        self.assertEqual(set(fetched), {(0, 0), (0, 1), (0, 2), (0, 3)})
+        # Solo el par (0, 3) no estaba en caché
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_get.call_args.kwargs['params']['destinations'], "-36.83000,-73.07000")
+
+    @mock.patch('rutas.distance_providers.requests.Session.get')
+    def test_matriz_grande_en_bloques(self, mock_get):
+        mock_get.side_effect = lambda url, params, **kwargs: _fake_matrix_response(params)
+        puntos = [
+            PuntoEntrega(nombre=f"P{i}", direccion="x", latitud=-36.8 - i / 1000, longitud=-73.0)
+            for i in range(30)
+        ]
+
+        matrix = optimizer.get_distance_matrix(puntos, self.origen, "key", use_cache=False)
+
+        self.assertEqual(len(matrix), 31)
+        self.assertEqual(matrix.shape, (31, 31))
+        self.assertTrue(np.isfinite(matrix).all())
+        for c in mock_get.call_args_list:
+            params = c.kwargs['params']
+            n_orig = len(params['origins'].split('|'))
+            n_dest = len(params['destinations'].split('|'))
+            self.assertLessEqual(n_orig * n_dest, distance_providers.MAX_ELEMENTS_PER_REQUEST)
+
+        full_calls = mock_get.call_count
+        mock_get.reset_mock()
+        optimizer.get_distance_matrix(puntos, self.origen, "key", use_cache=False, symmetric=True)
+        self.assertLess(mock_get.call_count, full_calls)
+
+    @override_settings(RUTAS_MAPS_BACKOFF_S=0)
+    @mock.patch('rutas.distance_providers.requests.Session.get')
+    def test_sin_red_usa_estimador_local(self, mock_get):
+        mock_get.side_effect = distance_providers.requests.exceptions.ConnectionError("sin red")
+
+        matrix = optimizer.get_distance_matrix(self.puntos, self.origen, "key")
+
+        self.assertEqual(len(matrix), 3)
+        self.assertEqual(matrix[0][0], 0.0)
+        self.assertGreater(matrix[0][1], 0.0)
+
+
+class HaversineProviderTestCase(TestCase):
+    def test_un_grado_de_latitud(self):
+        provider = distance_providers.HaversineDistanceProvider(road_factor=1.0)
+        matrix = provider.matrix([(-36.0, -73.0), (-37.0, -73.0)])
+        self.assertAlmostEqual(matrix[0][1], 111.19, places=1)
+        self.assertEqual(matrix[0][1], matrix[1][0])
+
+    def test_factor_de_ruta(self):
+        coords = [(-36.82, -73.05), (-36.80, -73.04)]
+        base = distance_providers.HaversineDistanceProvider(road_factor=1.0).matrix(coords)
+        ajustada = distance_providers.HaversineDistanceProvider(road_factor=1.4).matrix(coords)
+        self.assertAlmostEqual(ajustada[0][1], base[0][1] * 1.4, places=4)
+        self.assertEqual(ajustada.dtype, distance_providers.MATRIX_DTYPE)
+
+
+def _random_matrix(n, seed=0, asymmetric=True):
+    """Matriz aleatoria (km) para probar los solvers sin red."""
+    rng = random.Random(seed)
+    coords = [(rng.uniform(0, 10), rng.uniform(0, 10)) for _ in range(n)]
+    matrix = []
+    for i, (xi, yi) in enumerate(coords):
+        row = []
+        for j, (xj, yj) in enumerate(coords):
+            base = ((xi - xj) ** 2 + (yi - yj) ** 2) ** 0.5
+            row.append(0.0 if i == j else base * (rng.uniform(1.0, 1.3) if asymmetric else 1.0))
+        matrix.append(row)
+    return matrix
+
+
+class TwoOptTestCase(TestCase):
+    def test_resultado_es_optimo_local(self):
+        matrix = _random_matrix(25, seed=3)
+        route = [0] + list(range(1, 25)) + [0]
+
+        best = optimizer._two_opt(matrix, route)
+        best_dist = optimizer._route_distance(matrix, best)
+
+        self.assertEqual(best[0], 0)
+        self.assertEqual(best[-1], 0)
+        self.assertEqual(sorted(best[1:-1]), list(range(1, 25)))
+        self.assertLess(best_dist, optimizer._route_distance(matrix, route))
+
+        # Ninguna inversión de segmento mejora la ruta (asimétrica)
+        for i in range(1, len(best) - 2):
+            for j in range(i + 2, len(best)):
+                candidate = best[:i] + best[i:j][::-1] + best[j:]
+                self.assertGreaterEqual(
+                    optimizer._route_distance(matrix, candidate), best_dist - 1e-6
+                )
+
+    def test_acepta_ndarray_con_pares_sin_ruta(self):
+        matrix = np.asarray(_random_matrix(30, seed=11), dtype=distance_providers.MATRIX_DTYPE)
+        matrix[0, 5] = np.inf
+
+        route, total = optimizer.solve_tsp(matrix, 29)
+
+        self.assertIsInstance(total, float)
+        self.assertTrue(np.isfinite(total))
+        self.assertNotEqual(route[1], 5)
+        self.assertAlmostEqual(total, float(optimizer.route_legs(matrix, route).sum()), places=3)
+
+    def test_respeta_destino_fijo(self):
+        matrix = _random_matrix(15, seed=4)
+        route, _ = optimizer.solve_tsp(matrix, 13, start_index=0, end_index=14)
+        self.assertEqual(route[0], 0)
+        self.assertEqual(route[-1], 14)
+        self.assertEqual(sorted(route[1:-1]), list(range(1, 14)))
+
+
+class HeldKarpTestCase(TestCase):
+    def test_igual_a_fuerza_bruta(self):
+        matrix = _random_matrix(9, seed=5)
+        delivery = list(range(1, 8))
+
+        for end_index in (None, 8):
+            exact_route, exact_dist = optimizer._solve_tsp_held_karp(matrix, delivery, 0, end_index)
+            _, brute_dist = optimizer._solve_tsp_bruteforce(matrix, delivery, 0, end_index)
+
+            self.assertAlmostEqual(exact_dist, brute_dist)
+            self.assertEqual(exact_route[-1], 0 if end_index is None else end_index)
+            self.assertAlmostEqual(optimizer._route_distance(matrix, exact_route), exact_dist)
+
+    def test_solve_tsp_usa_held_karp_hasta_el_limite(self):
+        matrix = _random_matrix(optimizer.HELD_KARP_MAX_POINTS + 1, seed=6)
+        with mock.patch.object(optimizer, '_solve_tsp_heuristic') as heuristic:
+            route, _ = optimizer.solve_tsp(matrix, optimizer.HELD_KARP_MAX_POINTS)
+        heuristic.assert_not_called()
+        self.assertEqual(len(route), optimizer.HELD_KARP_MAX_POINTS + 2)
+
+
+class LocalSearchTestCase(TestCase):
+    def test_todos_los_movimientos_mejoran_y_conservan_puntos(self):
+        d = local_search.cost_array(_random_matrix(30, seed=7))
+        route = [0] + list(range(1, 29)) + [29]
+        base = local_search.route_cost(d, route)
+
+        for name in local_search.LOCAL_SEARCH:
+            with self.subTest(movimiento=name):
+                best = local_search.improve(d, route, name)
+                self.assertEqual(best[0], 0)
+                self.assertEqual(best[-1], 29)
+                self.assertEqual(sorted(best[1:-1]), list(range(1, 29)))
+                self.assertLess(local_search.route_cost(d, best), base)
+
+    def test_or_opt_es_optimo_local(self):
+        d = local_search.cost_array(_random_matrix(20, seed=8))
+        best = local_search.or_opt(d, [0] + list(range(1, 20)) + [0])
+        cost = local_search.route_cost(d, best)
+
+        for length in (1, 2, 3):
+            for i in range(1, len(best) - length):
+                delta, _, _ = local_search._best_relocation(d, np.asarray(best), i, length)
+                self.assertGreaterEqual(delta, -1e-6)
+        self.assertAlmostEqual(cost, local_search.route_cost(d, best))
+
+    def test_listas_de_vecinos(self):
+        d = local_search.cost_array(_random_matrix(12, seed=9, asymmetric=False))
+        neighbors = local_search.neighbor_lists(d, k=3)
+
+        self.assertEqual(neighbors.shape, (12, 3))
+        for i in range(12):
+            self.assertNotIn(i, neighbors[i])
+            others = sorted((d[i, j], j) for j in range(12) if j != i)
+            self.assertEqual(list(neighbors[i]), [j for _, j in others[:3]])
+
+    def test_movimientos_con_candidatos(self):
+        d = local_search.cost_array(_random_matrix(60, seed=10))
+        neighbors = local_search.neighbor_lists(d, k=8)
+        route = [0] + list(range(1, 60)) + [0]
+        base = local_search.route_cost(d, route)
+
+        for name in local_search.LOCAL_SEARCH:
+            with self.subTest(movimiento=name):
+                best = local_search.improve(d, route, name, neighbors=neighbors)
+                self.assertEqual(sorted(best[1:-1]), list(range(1, 60)))
+                self.assertEqual((best[0], best[-1]), (0, 0))
+                self.assertLess(local_search.route_cost(d, best), base * 0.6)
+
+    def test_lk_no_empeora_el_2opt_de_partida(self):
+        for seed, asymmetric in ((12, True), (13, False), (14, True)):
+            d = local_search.cost_array(_random_matrix(80, seed=seed, asymmetric=asymmetric))
+            route = [0] + list(range(1, 80)) + [0]
+            neighbors = local_search.neighbor_lists(d, k=8)
+
+            for cands in (None, neighbors):
+                with self.subTest(seed=seed, candidatos=cands is not None):
+                    base = local_search.two_opt(d, route, neighbors=cands)
+                    best = local_search.lk(d, base, neighbors=cands)
+                    self.assertEqual(sorted(best[1:-1]), list(range(1, 80)))
+                    self.assertLessEqual(local_search.route_cost(d, best), local_search.route_cost(d, base) + 1e-9)
+
+    def test_movimientos_respetan_active(self):
+        d = local_search.cost_array(_random_matrix(40, seed=11))
+        route = [0] + list(range(1, 40)) + [0]
+
+        for name, move in local_search.LOCAL_SEARCH.items():
+            with self.subTest(movimiento=name):
+                # Sin nodos activos no se prueba ningún movimiento
+                self.assertEqual(move(d, route, active=[]), route)
+                best = move(d, route, active=[5, 20])
+                self.assertEqual(sorted(best[1:-1]), list(range(1, 40)))
+                self.assertLessEqual(local_search.route_cost(d, best), local_search.route_cost(d, route))
+
+    def test_metodo_desconocido(self):
+        with self.assertRaises(ValueError):
+            local_search.improve(np.zeros((3, 3)), [0, 1, 2], 'simulated_annealing')
+
+
+class MultiStartTestCase(TestCase):
+    def test_reproducible_y_no_peor_que_una_corrida(self):
+        matrix = _random_matrix(40, seed=14)
+        delivery = list(range(1, 40))
+
+        _, single = optimizer._solve_tsp_heuristic(matrix, delivery, 0, None, starts=1)
+        with mock.patch('rutas.multistart.ProcessPoolExecutor', wraps=multistart.ProcessPoolExecutor) as pool:
+            route, total = optimizer._solve_tsp_heuristic(matrix, delivery, 0, None, starts=6, workers=2, seed=7)
+        again, _ = optimizer._solve_tsp_heuristic(matrix, delivery, 0, None, starts=6, workers=1, seed=7)
+
+        # Como rutas.jobs y rutas.escenarios: sin fork de hilos ni conexiones a la BD
+        self.assertEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+        self.assertEqual(route, again)
+        self.assertLessEqual(total, single + 1e-9)
+        self.assertEqual(sorted(route[1:-1]), delivery)
+
+    def test_estadisticas_por_worker(self):
+        d = local_search.cost_array(_random_matrix(20, seed=15))
+        _, stats = multistart.solve(d, list(range(1, 20)), 0, None, ('2opt',), starts=4, workers=1, seed=3)
+
+        self.assertEqual([a['arranque'] for a in stats['arranques']], [0, 1, 2, 3])
+        self.assertEqual(sum(w['arranques'] for w in stats['workers']), 4)
+        self.assertEqual(
+            min(a['costo'] for a in stats['arranques']),
+            stats['arranques'][stats['mejor_arranque']]['costo'],
+        )
+
+
+class AnytimeTestCase(TestCase):
+    def test_respeta_el_tiempo_y_mejora(self):
+        matrix = _random_matrix(400, seed=16)
+        progreso = []
+
+        t0 = time.perf_counter()
+        route, total = optimizer.solve_tsp(matrix, 399, time_limit_ms=300, on_improve=progreso.append)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        self.assertLess(elapsed_ms, 300 + 250)
+        self.assertEqual(sorted(route[1:-1]), list(range(1, 400)))
+        costos = [p['costo'] for p in progreso]
+        self.assertEqual(costos, sorted(costos, reverse=True))
+        self.assertAlmostEqual(costos[-1], total, places=3)
+
+    def test_nunca_peor_que_el_solver_sin_limite(self):
+        for tipo, n in (('uniforme', 50), ('clusters', 30), ('santiago', 30), ('asimetrica', 50)):
+            with self.subTest(instancia=f"{tipo}-{n}"):
+                matrix = benchmark.generar(tipo, n, seed=1)
+                delivery = list(range(1, n + 1))
+                _, untimed = optimizer._solve_tsp_heuristic(
+                    matrix, delivery, 0, None, local_search.DEFAULT_LOCAL_SEARCH, starts=1
+                )
+                route, stats = anytime.solve(
+                    local_search.cost_array(matrix), delivery, 0, None,
+                    local_search.DEFAULT_LOCAL_SEARCH, time_limit_ms=200,
+                )
+                self.assertTrue(stats['base_completa'])
+                self.assertLessEqual(optimizer._route_distance(matrix, route), untimed + 1e-9)
+
+    def test_deadline_corta_la_ruta_base(self):
+        matrix = benchmark.generar('uniforme', 2000, seed=1)
+        d = local_search.cost_array(matrix)
+        progreso = []
+        t0 = time.perf_counter()
+        route, stats = anytime.solve(
+            d, list(range(1, 2001)), 0, None, local_search.DEFAULT_LOCAL_SEARCH, time_limit_ms=100,
+            on_improve=progreso.append,
+        )
+        # Sin esperar a que termine la búsqueda local base (~1 s): lo mejor hasta el deadline
+        self.assertLess((time.perf_counter() - t0) * 1000, 600)
+        self.assertFalse(stats['base_completa'])
+        self.assertEqual(sorted(route[1:-1]), list(range(1, 2001)))
+        self.assertAlmostEqual(progreso[-1]['costo'], local_search.route_cost(d, route), places=3)
+
+    def test_perturbacion_conserva_extremos(self):
+        rng = np.random.default_rng(0)
+        route = list(range(12))
+        kicked, touched = anytime.double_bridge(route, rng)
+        self.assertEqual((kicked[0], kicked[-1]), (0, 11))
+        self.assertEqual(sorted(kicked), route)
+        self.assertEqual(len(touched), 6)
+
+
+def _fake_geocode(url, params, **kwargs):
+    response = mock.Mock()
+    response.json.return_value = {
+        'status': 'OK',
+        'results': [{'geometry': {'location': {'lat': -36.82, 'lng': -73.05}}}],
+    }
+    return response
+
+
+class GeocodingCacheTestCase(TestCase):
+    @mock.patch('rutas.maps_client.requests.Session.get', side_effect=_fake_geocode)
+    def test_direccion_equivalente_usa_cache(self, mock_get):
+        self.assertEqual(geocoding.geocodificar("Av. Colón 123, Concepción", "key"), (-36.82, -73.05))
+        antes = geocoding.estadisticas()
+
+        self.assertEqual(geocoding.geocodificar("av colon  123 concepcion", "key"), (-36.82, -73.05))
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(geocoding.estadisticas()['hits'], antes['hits'] + 1)
+        self.assertEqual(GeocodeCache.objects.get().hits, 1)
+
+    @mock.patch('rutas.maps_client.requests.Session.get', side_effect=_fake_geocode)
+    def test_entrada_vencida_se_vuelve_a_pedir(self, mock_get):
+        geocoding.geocodificar("Bodega", "key")
+        GeocodeCache.objects.update(creado_en=timezone.now() - timedelta(days=365))
+
+        geocoding.geocodificar("Bodega", "key")
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch('rutas.maps_client.requests.Session.get')
+    def test_sin_resultados_no_se_guarda(self, mock_get):
+        mock_get.return_value.json.return_value = {'status': 'ZERO_RESULTS', 'results': []}
+        with self.assertRaises(geocoding.GeocodingError) as ctx:
+            geocoding.geocodificar("calle inexistente", "key")
+        self.assertEqual(ctx.exception.estado, 'ZERO_RESULTS')
+        self.assertFalse(GeocodeCache.objects.exists())
+
+
+CSV_PUNTOS = (
+    "Nombre;Direccion;Latitud;Longitud\n"
+    "Almacén Sur;Av. Colón 123, Concepción;;\n"
+    "Almacén Sur;av colon 123 concepcion;;\n"
+    "Kiosko;Freire 800;-36,82;-73,04\n"
+    ";Sin nombre 1;;\n"
+    "Botillería;O'Higgins 45;-36.8;abc\n"
+    "Minimarket;Calle inexistente;;\n"
+)
+
+
+def _fake_geocode_parcial(url, params, **kwargs):
+    if 'inexistente' in params['address']:
+        response = mock.Mock()
+        response.json.return_value = {'status': 'ZERO_RESULTS', 'results': []}
+        return response
+    return _fake_geocode(url, params)
+
+
+class ImportacionPuntosTestCase(TestCase):
+    @mock.patch('rutas.importacion.requests.Session.get', side_effect=_fake_geocode_parcial)
+    def test_importa_deduplica_y_reporta_por_fila(self, mock_get):
+        PuntoEntrega.objects.create(nombre="Kiosko", direccion="Freire 800", latitud=-36.82, longitud=-73.04)
+
+        resumen = importacion.importar_puntos(importacion.leer_csv(CSV_PUNTOS), "key", rate_limit=0)
+
+        self.assertEqual(resumen['creados'], 1)
+        self.assertEqual(resumen['duplicados'], 2)  # fila repetida en el archivo + Kiosko ya existente
+        self.assertEqual(resumen['geocodificados'], 1)
+        self.assertEqual([e['fila'] for e in resumen['errores']], [5, 6, 7])
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertTrue(PuntoEntrega.objects.filter(nombre="Almacén Sur").exists())
+
+    @mock.patch('rutas.importacion.requests.Session.get', side_effect=_fake_geocode)
+    def test_usa_cache_y_respeta_limite(self, mock_get):
+        geocoding.store([("Av. Colón 123, Concepción", -36.82, -73.05)])
+        filas = [(i + 2, {'nombre': f"P{i}", 'direccion': f"Calle {i}"}) for i in range(5)]
+        filas.append((7, {'nombre': "P5", 'direccion': "AV COLON 123 CONCEPCION"}))
+
+        t0 = time.perf_counter()
+        resumen = importacion.importar_puntos(filas, "key", rate_limit=50, max_workers=4)
+
+        self.assertGreaterEqual(time.perf_counter() - t0, 4 / 50)
+        self.assertEqual((resumen['desde_cache'], resumen['geocodificados'], resumen['creados']), (1, 5, 6))
+        self.assertEqual(mock_get.call_count, 5)
+
+    def test_comando_con_coordenadas(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write("nombre,direccion,latitud,longitud\nA,Calle 1,-36.8,-73.0\nB,Calle 2,-36.9,-73.1\n")
+
+        out = io.StringIO()
+        call_command('importar_puntos', f.name, stdout=out)
+
+        self.assertIn("2 puntos creados", out.getvalue())
+        self.assertEqual(PuntoEntrega.objects.count(), 2)
+
+    @override_settings(RUTAS_JOB_WORKERS=0)
+    @mock.patch('rutas.importacion.requests.Session.get', side_effect=_fake_geocode_parcial)
+    def test_subida_se_importa_en_segundo_plano(self, _):
+        self.client.force_login(User.objects.create_user('admin', password='x'))
+        archivo = SimpleUploadedFile("puntos.csv", CSV_PUNTOS.encode('utf-8'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('importar_puntos'), {'archivo': archivo})
+
+        job = OptimizacionJob.objects.get()
+        self.assertEqual((job.tipo, job.estado), (OptimizacionJob.Tipo.IMPORTACION, OptimizacionJob.Estado.COMPLETADO))
+        self.assertEqual(job.parametros, {'archivo': "puntos.csv"})
+        self.assertEqual(PuntoEntrega.objects.count(), 2)
+
+        self.client.get(reverse('optimizacion_estado', args=[job.pk]))
+        self.assertEqual(self.client.session['importacion']['creados'], 2)
+
+    @override_settings(RUTAS_IMPORT_MAX_FILAS=3, RUTAS_IMPORT_MAX_BYTES=150)
+    def test_subida_con_topes(self):
+        self.client.force_login(User.objects.create_user('admin', password='x'))
+
+        self.client.post(reverse('importar_puntos'), {'archivo': SimpleUploadedFile("a.csv", CSV_PUNTOS.encode())})
+        self.assertIn('supera el máximo de 1 KB', self.client.session['error_message'])
+        self.client.post(reverse('importar_puntos'), {
+            'archivo': SimpleUploadedFile("b.csv", b"nombre,direccion\n" + b"A,Calle 1\n" * 4)
+        })
+        self.assertIn('4 filas', self.client.session['error_message'])
+        self.assertFalse(OptimizacionJob.objects.exists())
+
+
+@override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+class OptimizarRutaStreamTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        self.puntos = [
+            PuntoEntrega.objects.create(
+                nombre=f"P{i}", direccion="x", latitud=-36.80 - i / 100, longitud=-73.04 - (i % 5) / 100
+            )
+            for i in range(20)
+        ]
+
+    @override_settings(RUTAS_JOB_WORKERS=0)
+    @mock.patch('rutas.maps_client.requests.Session.get', side_effect=_fake_geocode)
+    def test_emite_progreso_y_guarda_resultado(self, _):
+        with self.captureOnCommitCallbacks(execute=True):
+            creado = self.client.post(reverse('optimizar_ruta'), {
+                'puntos_seleccionados': [p.id for p in self.puntos],
+                'origen_predefinido': 'Bodega',
+                'time_limit_ms': '200',
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        job = OptimizacionJob.objects.get()
+        self.assertEqual(creado['stream_url'], reverse('optimizar_ruta_stream', args=[job.pk]))
+
+        response = self.client.get(creado['stream_url'])
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        eventos = [
+            (bloque.split('\n')[0][len('event: '):], json.loads(bloque.split('\n')[1][len('data: '):]))
+            for bloque in b''.join(response.streaming_content).decode().strip().split('\n\n')
+        ]
+        nombres = [nombre for nombre, _ in eventos]
+        self.assertIn('progreso', nombres)
+        self.assertEqual(nombres[-1], 'fin')
+        self.assertEqual(len(eventos[0][1]['ruta']), 22)
+
+        plan = RutaPlan.objects.get()
+        self.assertEqual(plan.distancia_total_km, eventos[-1][1]['distancia_km'])
+        self.assertEqual(list(plan.paradas.values_list('orden', flat=True)), list(range(1, 21)))
+
+    @mock.patch('rutas.views.STREAM_MAX_S', 0)
+    def test_stream_corto_pasa_a_polling(self):
+        job = OptimizacionJob.objects.create(usuario=User.objects.get(), estado=OptimizacionJob.Estado.EN_PROCESO)
+        response = self.client.get(reverse('optimizar_ruta_stream', args=[job.pk]))
+        self.assertEqual(b''.join(response.streaming_content).decode(), 'event: pausa\ndata: {}\n\n')
+
+    @override_settings(RUTAS_JOB_WORKERS=0)
+    @mock.patch('rutas.maps_client.requests.Session.get', side_effect=_fake_geocode)
+    def test_formulario_encola_job(self, _):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('optimizar_ruta'), {
+                'puntos_seleccionados': [p.id for p in self.puntos[:5]],
+                'origen_predefinido': 'Bodega',
+                'rendimiento_vehiculo': '10',
+            })
+        self.assertRedirects(response, reverse('mapa'), fetch_redirect_response=False)
+
+        job = OptimizacionJob.objects.get()
+        self.assertEqual(job.estado, OptimizacionJob.Estado.COMPLETADO)
+        self.assertEqual(set(job.tiempos), {
+            'geocodificar_origen_ms', 'cache_resultados_ms', 'matriz_ms', 'resolver_ms', 'guardar_ms', 'total_ms',
+        })
+
+        estado = self.client.get(reverse('optimizacion_estado', args=[job.pk])).json()
+        self.assertTrue(estado['terminado'])
+        session = self.client.session
+        self.assertNotIn('optimizacion_job_id', session)
+
+        plan = RutaPlan.objects.get(pk=job.resultado['plan_id'])
+        etapas = {e['etapa']: e for e in plan.tiempos}
+        self.assertEqual(etapas['matriz']['elementos'], 7 * 7)
+        self.assertEqual(etapas['resolver']['algoritmo'], 'held_karp')
+        self.assertEqual(etapas['guardar']['paradas'], 5)
+        self.assertEqual(plan.rendimiento_km_por_litro, 10.0)
+        self.assertAlmostEqual(plan.litros, plan.distancia_total_km / 10, places=1)
+        tramos = [p.distancia_tramo_km for p in plan.paradas.all()]
+        self.assertEqual(len(tramos), 5)
+        self.assertLessEqual(sum(tramos), plan.distancia_total_km + 1e-6)
+
+        otro = User.objects.create_user('otro', password='x')
+        self.client.force_login(otro)
+        self.assertIsNone(self.client.get(reverse('mapa')).context['plan'])
+
+    @override_settings(RUTAS_JOB_WORKERS=0)
+    def test_job_con_error(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('optimizar_ruta'), {'puntos_seleccionados': [self.puntos[0].id]})
+
+        job = OptimizacionJob.objects.get()
+        self.assertEqual(job.estado, OptimizacionJob.Estado.ERROR)
+        self.client.get(reverse('optimizacion_estado', args=[job.pk]))
+        self.assertEqual(
+            self.client.session['error_message'], 'Debes seleccionar o escribir una dirección de origen.'
+        )
+
+    @override_settings(RUTAS_JOB_STALE_S=60)
+    @mock.patch('rutas.jobs._despachar')
+    def test_recupera_jobs_huerfanos(self, despachar):
+        usuario = User.objects.get(username='repartidor')
+        colgado = OptimizacionJob.objects.create(usuario=usuario, estado=OptimizacionJob.Estado.EN_PROCESO)
+        perdido = OptimizacionJob.objects.create(usuario=usuario)
+        reciente = OptimizacionJob.objects.create(usuario=usuario, estado=OptimizacionJob.Estado.EN_PROCESO)
+        OptimizacionJob.objects.filter(pk__in=[colgado.pk, perdido.pk]).update(
+            actualizado_en=timezone.now() - timedelta(minutes=5)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            estado = self.client.get(reverse('optimizacion_estado', args=[colgado.pk])).json()
+
+        self.assertTrue(estado['terminado'])
+        self.assertEqual(estado['error'], jobs.ERROR_HUERFANO)
+        despachar.assert_called_once_with(perdido.pk)
+        perdido.refresh_from_db()
+        self.assertEqual(perdido.estado, OptimizacionJob.Estado.PENDIENTE)
+        reciente.refresh_from_db()
+        self.assertEqual(reciente.estado, OptimizacionJob.Estado.EN_PROCESO)
+        # Con el latido renovado no se vuelve a reencolar
+        self.assertEqual(jobs.recuperar_huerfanos(), (0, 0))
+
+    def test_stream_solo_lee_jobs_propios(self):
+        job = OptimizacionJob.objects.create(usuario=User.objects.create_user('otro', password='x'))
+        url = reverse('optimizar_ruta_stream', args=[job.pk])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.assertFalse(RutaPlan.objects.exists())
+
+    @override_settings(RUTAS_JOB_WORKERS=0)
+    def test_error_de_validacion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            creado = self.client.post(
+                reverse('optimizar_ruta'), {'puntos_seleccionados': [self.puntos[0].id]},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            ).json()
+        contenido = b''.join(self.client.get(creado['stream_url']).streaming_content).decode()
+        self.assertTrue(contenido.startswith('event: error'))
+
+        vacio = self.client.post(reverse('optimizar_ruta'), {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(vacio.status_code, 400)
+
+
+@override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+@mock.patch('rutas.maps_client.requests.Session.get', side_effect=_fake_geocode)
+class ResultCacheTestCase(TestCase):
+    def setUp(self):
+        self.puntos = [
+            PuntoEntrega.objects.create(nombre=f"P{i}", direccion="x", latitud=-36.8 - i / 100, longitud=-73.0)
+            for i in range(6)
+        ]
+        self.data = QueryDict(mutable=True)
+        self.data.setlist('puntos_seleccionados', [str(p.id) for p in self.puntos])
+        self.data['origen_predefinido'] = 'Bodega'
+
+    def optimizar(self):
+        plan = services.preparar_optimizacion(self.data, 'key')
+        services.guardar_resultado(plan, services.resolver(plan))
+        return plan
+
+    def test_repetir_no_arma_matriz(self, _):
+        primero = self.optimizar()
+        self.assertIsNone(primero['solucion_cache'])
+
+        with mock.patch('rutas.optimizer.get_distance_matrix') as matriz:
+            segundo = self.optimizar()
+        matriz.assert_not_called()
+        self.assertEqual(segundo['llave_cache'], primero['llave_cache'])
+        self.assertEqual(ResultadoCache.objects.get().hits, 1)
+
+        a, b = RutaPlan.objects.order_by('id')
+        self.assertEqual(a.distancia_total_km, b.distancia_total_km)
+        self.assertEqual(
+            list(a.paradas.values_list('punto_id', 'distancia_tramo_km')),
+            list(b.paradas.values_list('punto_id', 'distancia_tramo_km')),
+        )
+
+    def test_parametros_distintos_no_comparten_llave(self, _):
+        primero = self.optimizar()
+        self.data['time_limit_ms'] = '50'
+        self.assertNotEqual(self.optimizar()['llave_cache'], primero['llave_cache'])
+
+    def test_editar_o_borrar_punto_invalida(self, _):
+        self.optimizar()
+        otro = PuntoEntrega.objects.create(nombre="Otro", direccion="y", latitud=-36.7, longitud=-73.1)
+        otro.delete()
+        self.assertEqual(ResultadoCache.objects.count(), 1)
+
+        # Renombrar no cambia la solución; moverlo sí
+        punto = PuntoEntrega.objects.get(pk=self.puntos[3].pk)
+        punto.nombre = 'Renombrado'
+        punto.save()
+        self.puntos[2].direccion = 'otra'
+        self.puntos[2].save(update_fields=['direccion'])
+        self.assertEqual(ResultadoCache.objects.count(), 1)
+
+        punto.latitud = Decimal('-36.5')
+        punto.save()
+        self.assertEqual(ResultadoCache.objects.count(), 0)
+
+        self.optimizar()
+        self.puntos[0].delete()
+        self.assertEqual(ResultadoCache.objects.count(), 0)
+
+    @override_settings(RUTAS_RESULT_CACHE_MAX_ENTRIES=1)
+    def test_desaloja_lru(self, _):
+        # Guardadas en el mismo instante: se desaloja solo la más antigua, no todas las empatadas
+        with mock.patch('rutas.result_cache.timezone.now', return_value=timezone.now()):
+            self.optimizar()
+            self.data['time_limit_ms'] = '50'
+            plan = self.optimizar()
+        self.assertEqual(list(ResultadoCache.objects.values_list('llave', flat=True)), [plan['llave_cache']])
+
+
+class SpatialIndexTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.lats = rng.uniform(-37.0, -36.6, 2000)
+        self.lngs = rng.uniform(-73.2, -72.8, 2000)
+        self.ids = np.arange(1, 2001)
+        self.indice = spatial.IndiceEspacial(self.ids, self.lats, self.lngs)
+
+    def distancias(self, lat, lng):
+        coords = np.column_stack([self.lats, self.lngs])
+        return distance_providers.haversine_matrix([(lat, lng)] + coords.tolist())[0, 1:]
+
+    def test_consultas_igual_a_fuerza_bruta(self):
+        d = self.distancias(-36.8, -73.0)
+        cercanos = self.indice.cercanos(-36.8, -73.0, 15)
+        self.assertEqual([pid for pid, _ in cercanos], list(self.ids[np.argsort(d, kind='stable')[:15]]))
+        self.assertAlmostEqual(cercanos[0][1], d.min(), places=3)
+
+        self.assertEqual(
+            sorted(pid for pid, _ in self.indice.en_radio(-36.8, -73.0, 3.0)), list(self.ids[d <= 3.0])
+        )
+
+        dentro = (self.lats >= -36.9) & (self.lats <= -36.8) & (self.lngs >= -73.1) & (self.lngs <= -73.0)
+        ids_bbox = self.indice.coordenadas_en_bbox(-36.9, -73.1, -36.8, -73.0)[0]
+        self.assertEqual(sorted(ids_bbox), list(self.ids[dentro]))
+
+    def test_actualizacion_incremental(self):
+        cercano = self.indice.cercanos(-36.8, -73.0, 1)[0][0]
+        self.indice.quitar(cercano)
+        self.assertNotEqual(self.indice.cercanos(-36.8, -73.0, 1)[0][0], cercano)
+
+        self.indice.actualizar(5000, -36.8, -73.0)
+        self.indice.actualizar(7, -36.80001, -73.0)
+        self.assertEqual([pid for pid, _ in self.indice.cercanos(-36.8, -73.0, 2)], [5000, 7])
+        self.assertEqual(len(self.indice), 2000)
+
+        # Pasado el umbral se reconstruye el árbol con los cambios
+        quitados = {cercano} | set(range(1, spatial.REBUILD_MIN + 10))
+        for pid in quitados:
+            self.indice.quitar(pid)
+        self.assertFalse(self.indice._buffer)
+        self.assertEqual(len(self.indice), 2000 - len(quitados) + 1)
+
+    def test_senales_y_filtro_en_bd(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            punto = PuntoEntrega.objects.create(nombre="A", direccion="x", latitud=-36.82, longitud=-73.05)
+            PuntoEntrega.objects.create(nombre="B", direccion="y", latitud=-33.45, longitud=-70.66)
+        self.assertEqual(punto.geohash, geohash.encode(-36.82, -73.05))
+        self.assertEqual(spatial.cercanos(-36.8, -73.0, 1)[0][0], punto.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            punto.latitud, punto.longitud = Decimal('-33.40'), Decimal('-70.60')
+            punto.save()
+        self.assertTrue(punto.geohash.startswith(geohash.encode(-33.40, -70.60, 5)))
+        self.assertEqual(spatial.en_radio(-33.40, -70.60, 1.0)[0][0], punto.pk)
+
+        en_area = spatial.filtrar_bbox(PuntoEntrega.objects.all(), -33.5, -70.7, -33.3, -70.5)
+        self.assertEqual(sorted(en_area.values_list('nombre', flat=True)), ['A', 'B'])
+
+        # Editar sin mover no toca el árbol ni lo rearma con la versión nueva
+        with mock.patch.object(spatial.IndiceEspacial, 'actualizar') as actualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                punto.nombre = 'A2'
+                punto.save()
+        actualizar.assert_not_called()
+        arbol = spatial._indice
+        self.assertIs(spatial.indice(), arbol)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            punto.delete()
+        self.assertEqual(spatial.en_radio(-33.40, -70.60, 1.0), [])
+
+    def test_cambios_de_otro_proceso_entre_los_propios(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            a = PuntoEntrega.objects.create(nombre="A", direccion="x", latitud=-36.82, longitud=-73.05)
+            b = PuntoEntrega.objects.create(nombre="B", direccion="y", latitud=-36.90, longitud=-73.10)
+        arbol = spatial.indice()
+
+        # Cambio propio: se aplica por señal y no rearma
+        with self.captureOnCommitCallbacks(execute=True):
+            a.latitud = Decimal('-36.83')
+            a.save()
+        self.assertIs(spatial.indice(), arbol)
+
+        # Otro proceso mueve B (sin señales en este proceso) y después se guarda otro cambio propio
+        PuntoEntrega.objects.filter(pk=b.pk).update(
+            latitud=Decimal('-33.45'), longitud=Decimal('-70.66'), actualizado_en=timezone.now()
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            a.nombre = 'A2'
+            a.save()
+        self.assertEqual(spatial.en_radio(-33.45, -70.66, 1.0)[0][0], b.pk)
+        ids = spatial.en_bbox(-34.0, -71.0, -33.0, -70.0)[0]
+        self.assertEqual(list(ids), [b.pk])
+
+        # Otro proceso agrega un punto justo antes de un cambio propio: no cuadra y se descarta
+        PuntoEntrega.objects.bulk_create([PuntoEntrega(
+            nombre="C", direccion="z", latitud=-36.7, longitud=-72.9, geohash=geohash.encode(-36.7, -72.9),
+        )])
+        with self.captureOnCommitCallbacks(execute=True):
+            a.latitud = Decimal('-36.84')
+            a.save()
+        self.assertEqual(len(spatial.indice()), 3)
+
+    def tearDown(self):
+        spatial.invalidar()
+
+
+class PuntosMapaTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        # Dos grupos apretados y un punto aislado
+        puntos = (
+            [PuntoEntrega(nombre=f"A{i}", direccion="x", latitud=-36.80 + i * 1e-4, longitud=-73.05) for i in range(5)]
+            + [PuntoEntrega(nombre=f"B{i}", direccion="y", latitud=-36.90, longitud=-73.15 + i * 1e-4) for i in range(4)]
+            + [PuntoEntrega(nombre="Solo", direccion="z", latitud=-36.70, longitud=-72.90)]
+        )
+        for punto in puntos:  # bulk_create no pasa por save()
+            punto.geohash = geohash.encode(punto.latitud, punto.longitud)
+        PuntoEntrega.objects.bulk_create(puntos)
+        self.params = {'sur': -37.0, 'oeste': -73.2, 'norte': -36.6, 'este': -72.8, 'zoom': 11}
+
+    def tearDown(self):
+        spatial.invalidar()
+
+    @override_settings(RUTAS_MAPA_MAX_SIN_AGRUPAR=3)
+    def test_agrupa_y_responde_304(self):
+        response = self.client.get(reverse('puntos_mapa'), self.params)
+        data = response.json()
+        self.assertEqual(data['total'], 10)
+        self.assertEqual(sorted(c['cantidad'] for c in data['clusters']), [4, 5])
+        self.assertEqual([p['nombre'] for p in data['puntos']], ['Solo'])
+        self.assertAlmostEqual(max(data['clusters'], key=lambda c: c['cantidad'])['lat'], -36.7998, places=4)
+
+        etag = response['ETag']
+        repetida = self.client.get(reverse('puntos_mapa'), self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repetida.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PuntoEntrega.objects.get(nombre="Solo").delete()
+        nueva = self.client.get(reverse('puntos_mapa'), self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(nueva.status_code, 200)
+        self.assertEqual(nueva.json()['puntos'], [])
+
+    def test_viewport_desde_bd_sin_rearmar_indice(self):
+        # Sin índice en el proceso se filtra por geohash en la BD; el resultado es el mismo
+        spatial.invalidar()
+        params = dict(self.params, norte=-36.75)
+        desde_bd = self.client.get(reverse('puntos_mapa'), params).json()
+        self.assertIsNone(spatial._indice)
+
+        spatial.indice()
+        desde_indice = self.client.get(reverse('puntos_mapa'), params).json()
+        self.assertEqual(
+            sorted(p['nombre'] for p in desde_bd['puntos']), sorted(p['nombre'] for p in desde_indice['puntos'])
+        )
+        self.assertEqual(desde_bd['total'], 9)
+
+    def test_pocos_puntos_sin_agrupar(self):
+        data = self.client.get(reverse('puntos_mapa'), dict(self.params, norte=-36.85)).json()
+        self.assertEqual(data['clusters'], [])
+        self.assertEqual(sorted(p['nombre'] for p in data['puntos']), [f"B{i}" for i in range(4)])
+        self.assertEqual(self.client.get(reverse('puntos_mapa')).status_code, 400)
+
+    @override_settings(RUTAS_MAPA_MAX_PUNTOS_FORMULARIO=4)
+    def test_formulario_limitado_con_todos_los_puntos(self):
+        response = self.client.get(reverse('mapa'))
+        self.assertEqual(len(response.context['puntos_entrega']), 4)
+        self.assertEqual(response.context['puntos_omitidos'], 6)
+        self.assertContains(response, 'name="todos_los_puntos"')
+        self.assertEqual(json.loads(response.context['puntos_entrega_json']), [])
+
+        data = QueryDict('todos_los_puntos=1&origen_predefinido=Bodega')
+        with mock.patch('rutas.services._geocodificar', return_value=(-36.8, -73.0)):
+            with override_settings(RUTAS_DISTANCE_PROVIDER='haversine'):
+                plan = services.preparar_optimizacion(data, 'key')
+        self.assertEqual(len(plan['puntos']), 10)
+
+
+@override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+class IncrementalTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        rng = random.Random(5)
+        self.puntos = [
+            PuntoEntrega.objects.create(
+                nombre=f"P{i}", direccion="x",
+                latitud=round(-36.8 + rng.uniform(-0.05, 0.05), 6),
+                longitud=round(-73.0 + rng.uniform(-0.05, 0.05), 6),
+            )
+            for i in range(30)
+        ]
+        data = QueryDict(mutable=True)
+        data.setlist('puntos_seleccionados', [str(p.id) for p in self.puntos])
+        data['origen_predefinido'] = 'Bodega'
+        with mock.patch('rutas.services._geocodificar', return_value=(-36.8, -73.0)):
+            plan = services.preparar_optimizacion(data, 'key')
+        self.plan = services.guardar_resultado(plan, services.resolver(plan), User.objects.get())
+
+    def test_insercion_mas_barata(self):
+        d = np.array([[0, 1, 5, 1], [1, 0, 1, 5], [5, 1, 0, 2], [1, 5, 2, 0]], dtype=float)
+        # Entre 0 y 1 cuesta 5 + 1 - 1; entre 1 y 3, 1 + 2 - 5
+        self.assertEqual(incremental.insertar_mas_barato(d, [0, 1, 3], 2), ([0, 1, 2, 3], 2))
+
+    def test_agregar_punto_inserta_en_el_plan(self):
+        with mock.patch('rutas.views.services.optimizer.get_distance_matrix') as matriz:
+            self.client.post(reverse('agregar_punto'), {
+                'nombre': 'Nuevo', 'direccion': 'y', 'latitud': '-36.801', 'longitud': '-73.001',
+            })
+        matriz.assert_not_called()
+
+        nuevo_plan = RutaPlan.objects.filter(usuario__username='repartidor').first()
+        self.assertNotEqual(nuevo_plan.pk, self.plan.pk)
+        # Filas del nuevo, origen y destino más el vecindario: no los 33 x 33 pares
+        etapa = next(e for e in nuevo_plan.tiempos if e['etapa'] == 'matriz')
+        self.assertLess(etapa['elementos'], 33 * 33)
+        nombres = list(nuevo_plan.paradas.values_list('nombre', flat=True))
+        self.assertEqual(len(nombres), 31)
+        self.assertIn('Nuevo', nombres)
+        self.assertEqual(list(nuevo_plan.paradas.values_list('orden', flat=True)), list(range(1, 32)))
+        # Una parada más no acorta la ruta, salvo lo poco que gane la búsqueda local
+        self.assertGreaterEqual(nuevo_plan.distancia_total_km, self.plan.distancia_total_km * 0.95)
+
+    def test_matriz_parcial_sin_sentido_contrario_inventado(self):
+        puntos = self.puntos[:4]
+        with mock.patch('rutas.services.incremental.vecindario', return_value=[]):
+            m = services._matriz_incremental(
+                puntos, (-36.8, -73.0), (-36.8, -73.0), [0, 1, 2, 3, 4, 5], [], set(), {(2, 3): 5.0},
+                'key', tiempos.Medicion(),
+            )
+        self.assertEqual(m[2, 3], 5.0)
+        # El tramo guardado es de un solo sentido: 3 -> 2 no se pidió
+        self.assertEqual(m[3, 2], np.inf)
+        self.assertEqual(m[1, 2], np.inf)
+        # Filas y columnas de origen y destino sí se pidieron
+        self.assertTrue(np.isfinite(m[0]).all() and np.isfinite(m[:, 5]).all())
+
+    def test_borrar_punto_repara_el_plan(self):
+        borrado = self.plan.paradas.get(orden=10).punto
+        response = self.client.post(reverse('borrar_punto', args=[borrado.id]))
+        self.assertTrue(response.json()['ok'])
+
+        nuevo_plan = RutaPlan.objects.filter(usuario__username='repartidor').first()
+        self.assertNotEqual(nuevo_plan.pk, self.plan.pk)
+        self.assertEqual(nuevo_plan.paradas.count(), 29)
+        self.assertFalse(nuevo_plan.paradas.filter(punto__isnull=True).exists())
+        self.assertLessEqual(nuevo_plan.distancia_total_km, self.plan.distancia_total_km + 1e-6)
+
+    @override_settings(RUTAS_DISTANCE_PROVIDER='cached', GOOGLE_MAPS_API_KEY='key', RUTAS_JOB_WORKERS=0)
+    def test_trazado_en_segundo_plano(self):
+        borrado = self.plan.paradas.get(orden=3).punto
+        with mock.patch('rutas.services.directions.trazar', return_value=[[[[-36.8, -73.0], [-36.9, -73.1]]]]) \
+                as trazar, mock.patch('rutas.services._matriz_incremental', return_value=np.zeros((31, 31))):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(reverse('borrar_punto', args=[borrado.id]))
+            # La respuesta no esperó a Directions: el trazado quedó en la cola
+            trazar.assert_not_called()
+            job = OptimizacionJob.objects.get(tipo=OptimizacionJob.Tipo.TRAZADO)
+            self.assertEqual(job.estado, OptimizacionJob.Estado.PENDIENTE)
+
+            for callback in callbacks:
+                callback()
+        trazar.assert_called_once()
+        job.refresh_from_db()
+        self.assertEqual(job.estado, OptimizacionJob.Estado.COMPLETADO)
+        self.assertEqual(RutaPlan.objects.get(pk=job.resultado['plan_id']).polilineas[0]['vehiculo'], 1)
+
+
+class FuelCostTestCase(TestCase):
+    def test_escalar_y_array(self):
+        self.assertEqual(optimizer.calculate_fuel_cost(120, 12), 10.0)
+        self.assertEqual(optimizer.calculate_fuel_cost(float('inf'), 12), float('inf'))
+        self.assertEqual(optimizer.calculate_fuel_cost(10, 0), float('inf'))
+        np.testing.assert_allclose(
+            optimizer.calculate_fuel_cost(np.array([12.0, 24.0]), np.array([12.0, 8.0])),
+            [1.0, 3.0],
+        )
+
+
+class CVRPTestCase(TestCase):
+    def test_respeta_capacidad_y_asigna_todo(self):
+        matrix = _random_matrix(41, seed=12)
+        rng = random.Random(12)
+        demands = [0.0] + [rng.uniform(5, 40) for _ in range(40)]
+        vehicles = [
+            {'nombre': 'Camión', 'capacidad_kg': 400, 'rendimiento_km_por_litro': 6},
+            {'nombre': 'Furgón', 'capacidad_kg': 300, 'rendimiento_km_por_litro': 10},
+            {'nombre': 'Auto', 'capacidad_kg': 200, 'rendimiento_km_por_litro': 14},
+        ]
+
+        result = cvrp.solve_cvrp(matrix, demands, vehicles)
+
+        self.assertEqual(result['sin_asignar'], [])
+        visitados = []
+        for ruta in result['rutas']:
+            self.assertEqual((ruta['ruta'][0], ruta['ruta'][-1]), (0, 0))
+            self.assertLessEqual(ruta['carga_kg'], ruta['vehiculo']['capacidad_kg'] + 1e-9)
+            visitados.extend(ruta['ruta'][1:-1])
+        self.assertEqual(sorted(visitados), list(range(1, 41)))
+        self.assertAlmostEqual(
+            result['litros_total'],
+            sum(r['distancia_km'] / r['vehiculo']['rendimiento_km_por_litro'] for r in result['rutas']),
+        )
+
+    def test_parada_que_no_cabe(self):
+        matrix = _random_matrix(5, seed=13)
+        vehicles = [{'nombre': 'Auto', 'capacidad_kg': 50, 'rendimiento_km_por_litro': 12}]
+        result = cvrp.solve_cvrp(matrix, [0, 10, 80, 10, 0], vehicles, end_index=4)
+
+        self.assertEqual(result['sin_asignar'], [2])
+        self.assertEqual(result['rutas'][0]['ruta'][-1], 4)
+        self.assertEqual(sorted(result['rutas'][0]['ruta'][1:-1]), [1, 3])
+
+    def test_demandas_desde_ventas_pendientes(self):
+        cliente = Cliente.objects.create(nombre="Cliente")
+        a = PuntoEntrega.objects.create(nombre="A", direccion="a", latitud=-36.80, longitud=-73.04)
+        b = PuntoEntrega.objects.create(nombre="B", direccion="b", latitud=-36.81, longitud=-73.06)
+        Venta.objects.create(cliente=cliente, punto_entrega=a, kilos_total=Decimal("12.5"))
+        Venta.objects.create(cliente=cliente, punto_entrega=a, kilos_total=Decimal("7.5"))
+        Venta.objects.create(cliente=cliente, punto_entrega=a, kilos_total=Decimal("100"), entregada=True)
+
+        self.assertEqual(services.demandas_por_punto([a, b]), {a.id: Decimal("20"), b.id: Decimal("0")})
+
+
+def _fake_directions_response(params):
+    """Respuesta falsa de Directions: la polilínea es el origen y destino del tramo."""
+    response = mock.Mock()
+    response.raise_for_status.return_value = None
+    response.json.return_value = {
+        'status': 'OK',
+        'routes': [{'overview_polyline': {'points': f"{params['origin']}>{params['destination']}"}}],
+    }
+    return response
+
+
+class DirectionsTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        self.puntos = [
+            PuntoEntrega.objects.create(nombre=f"P{i}", direccion="x", latitud=-36.8 - i / 100, longitud=-73.0)
+            for i in range(30)
+        ]
+        data = QueryDict(mutable=True)
+        data.setlist('puntos_seleccionados', [str(p.id) for p in self.puntos])
+        data['origen_predefinido'] = 'Bodega'
+        with override_settings(RUTAS_DISTANCE_PROVIDER='haversine'), \
+                mock.patch('rutas.services._geocodificar', return_value=(-36.8, -73.0)):
+            plan = services.preparar_optimizacion(data, 'key')
+            self.plan = services.guardar_resultado(plan, services.resolver(plan), User.objects.get())
+
+    def test_tramos_comparten_extremos(self):
+        puntos = list(range(60))
+        tramos = directions.tramos(puntos, max_waypoints=25)
+        self.assertEqual([len(t) for t in tramos], [27, 27, 8])
+        for a, b in zip(tramos, tramos[1:]):
+            self.assertEqual(a[-1], b[0])
+        self.assertEqual(directions.tramos([1, 2]), [[1, 2]])
+
+    @mock.patch('rutas.directions.requests.Session.get')
+    def test_geometria_se_guarda_con_el_plan(self, mock_get):
+        mock_get.side_effect = lambda url, params, **kwargs: _fake_directions_response(params)
+        # 30 paradas más origen y destino: dos tramos de hasta 25 intermedios
+        self.assertEqual(services.trazar_ruta(self.plan, 'key'), 2)
+        self.assertEqual(mock_get.call_count, 2)
+        for c in mock_get.call_args_list:
+            self.assertLessEqual(len(c.kwargs['params']['waypoints'].split('|')), directions.MAX_WAYPOINTS)
+
+        self.plan.refresh_from_db()
+        self.assertEqual([p['vehiculo'] for p in self.plan.polilineas], [1, 1])
+        response = self.client.get(reverse('mapa'))
+        self.assertEqual(json.loads(response.context['polilineas_json']), self.plan.polilineas)
+
+    @override_settings(RUTAS_MAPS_BACKOFF_S=0)
+    @mock.patch('rutas.directions.requests.Session.get')
+    def test_sin_geometria_si_falla_la_api(self, mock_get):
+        mock_get.side_effect = directions.requests.exceptions.ConnectionError("sin red")
+        self.assertEqual(services.trazar_ruta(self.plan, 'key'), 0)
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.polilineas, [])
+
+    @override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+    @mock.patch('rutas.directions.requests.Session.get')
+    def test_haversine_no_traza(self, mock_get):
+        self.assertEqual(services.trazar_ruta(self.plan, 'key'), 0)
+        mock_get.assert_not_called()
+
+
+class BenchmarkTestCase(TestCase):
+    def test_instancias_reproducibles(self):
+        for tipo in benchmark.TIPOS:
+            d = benchmark.generar(tipo, 10, seed=1)
+            self.assertEqual(d.shape, (11, 11))
+            np.testing.assert_array_equal(d, benchmark.generar(tipo, 10, seed=1))
+            self.assertFalse(np.array_equal(d, benchmark.generar(tipo, 10, seed=2)))
+        asimetrica = benchmark.generar('asimetrica', 10)
+        self.assertFalse(np.allclose(asimetrica, asimetrica.T))
+
+    def test_exactos_coinciden_y_reporte(self):
+        reporte = benchmark.ejecutar(
+            benchmark.suite(tamanos_exactos=(6,), tamanos_heuristicos=(), seed=3),
+            solvers=('held_karp', 'fuerza_bruta', 'nn_2opt'), repeticiones=1,
+        )
+        self.assertEqual(reporte['discrepancias'], [])
+        self.assertEqual(len(reporte['resultados']), 3 * len(benchmark.TIPOS))
+        for fila in reporte['resultados']:
+            self.assertTrue(fila['optimo'])
+            self.assertGreaterEqual(fila['gap_pct'], 0)
+            if fila['solver'] != 'nn_2opt':
+                self.assertEqual(fila['gap_pct'], 0)
+
+        filas = benchmark.a_csv(reporte).splitlines()
+        self.assertEqual(filas[0].split(','), list(benchmark.COLUMNAS))
+        self.assertEqual(len(filas), len(reporte['resultados']) + 1)
+
+    def test_comando_compara_con_reporte_base(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            salida = f"{tmp}/base.json"
+            args = ['--tipos', 'uniforme', '--exactos', '6', '--heuristicos', '30',
+                    '--solvers', 'held_karp', 'nn_2opt', '--repeticiones', '1']
+            call_command('benchmark_rutas', *args, '--json', salida, stdout=io.StringIO())
+
+            with open(salida) as f:
+                base = json.load(f)
+            self.assertEqual(len(base['resultados']), 3)
+            # Una base más rápida y más corta de lo posible: todo cuenta como regresión
+            for fila in base['resultados']:
+                fila['ms_mediana'] = 0.001
+                fila['distancia'] /= 2
+            with open(salida, 'w') as f:
+                json.dump(base, f)
+
+            err = io.StringIO()
+            call_command('benchmark_rutas', *args, '--comparar', salida, stdout=io.StringIO(), stderr=err)
+        self.assertEqual(err.getvalue().count('Regresión'), 3)
+
+
+class TiemposTestCase(TestCase):
+    def test_medicion_y_percentiles(self):
+        medicion = tiempos.Medicion()
+        with medicion.etapa('matriz', elementos=4) as etapa:
+            etapa['proveedor'] = 'haversine'
+        with self.assertRaises(ValueError), medicion.etapa('resolver'):
+            raise ValueError
+        self.assertEqual([e['etapa'] for e in medicion.etapas], ['matriz', 'resolver'])
+        self.assertEqual(medicion.etapas[0]['proveedor'], 'haversine')
+        self.assertIn('total_ms', medicion.resumen())
+
+        corridas = [[{'etapa': 'resolver', 'ms': ms}, {'etapa': 'matriz', 'ms': 1.0}] for ms in range(1, 101)]
+        filas = {f['etapa']: f for f in tiempos.percentiles(corridas + [[]])}
+        self.assertEqual(list(filas), ['matriz', 'resolver', 'total'])
+        self.assertEqual(filas['resolver']['corridas'], 100)
+        self.assertAlmostEqual(filas['resolver']['p50'], 50.5)
+        self.assertAlmostEqual(filas['resolver']['p95'], 95.0, places=0)
+        self.assertEqual(filas['total']['max'], 101.0)
+
+    @override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+    def test_pagina_solo_staff(self):
+        data = QueryDict(mutable=True)
+        data.setlist('puntos_seleccionados', [
+            str(PuntoEntrega.objects.create(nombre=f"P{i}", direccion="x", latitud=-36.8 - i / 100, longitud=-73.0).id)
+            for i in range(4)
+        ])
+        data['origen_predefinido'] = 'Bodega'
+        with mock.patch('rutas.services._geocodificar', return_value=(-36.8, -73.0)):
+            plan = services.preparar_optimizacion(data, 'key')
+        services.guardar_resultado(plan, services.resolver(plan))
+
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        self.assertEqual(self.client.get(reverse('tiempos_optimizacion')).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('jefe', password='x', is_staff=True))
+        response = self.client.get(reverse('tiempos_optimizacion'), {'dias': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['corridas'], 1)
+        self.assertEqual(
+            [f['etapa'] for f in response.context['filas']],
+            ['geocodificar_origen', 'cache_resultados', 'matriz', 'resolver', 'guardar', 'total'],
+        )
+
+
+@override_settings(RUTAS_DISTANCE_PROVIDER='haversine')
+class MatrizGlobalTestCase(TestCase):
+    ORIGEN = {'latitud': -36.8, 'longitud': -73.0}
+    DESTINO = {'latitud': -36.85, 'longitud': -73.05}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        rng = random.Random(2)
+        self.puntos = [
+            PuntoEntrega.objects.create(
+                nombre=f"P{i}", direccion="x",
+                latitud=round(-36.8 + rng.uniform(-0.05, 0.05), 6),
+                longitud=round(-73.0 + rng.uniform(-0.05, 0.05), 6),
+            )
+            for i in range(12)
+        ]
+        self.provider = distance_providers.HaversineDistanceProvider()
+
+    def _matriz(self, puntos):
+        return optimizer.get_distance_matrix(puntos, self.ORIGEN, None, self.DESTINO, provider=self.provider)
+
+    def _esperada(self, puntos):
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=''):
+            return self._matriz(puntos)
+
+    def test_subconjunto_sin_recalcular(self):
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=self.dir.name):
+            self._matriz(self.puntos)
+            seleccion = [self.puntos[i] for i in (7, 2, 9, 4)]
+            with mock.patch.object(self.provider, 'matrix_blocks', wraps=self.provider.matrix_blocks) as calculo:
+                matriz_global.submatriz(seleccion, self.provider)
+                calculo.assert_not_called()
+                matriz = self._matriz(seleccion)
+
+        np.testing.assert_array_equal(matriz, self._esperada(seleccion))
+        self.assertEqual(FilaMatrizGlobal.objects.count(), 12)
+
+    def test_puntos_borrados_movidos_y_nuevos(self):
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=self.dir.name):
+            self._matriz(self.puntos)
+            fila_borrada = self.puntos[3].fila_matriz.fila
+            self.puntos[3].delete()
+            nuevo = PuntoEntrega.objects.create(nombre="N", direccion="y", latitud=-36.9, longitud=-73.1)
+            movido = self.puntos[5]
+            movido.latitud, movido.longitud = -36.7, -72.9
+            movido.save()
+
+            seleccion = [self.puntos[0], nuevo, movido, self.puntos[8]]
+            matriz = self._matriz(seleccion)
+
+        # El punto nuevo reutiliza la fila libre, sin restos del punto borrado
+        self.assertEqual(FilaMatrizGlobal.objects.get(punto=nuevo).fila, fila_borrada)
+        np.testing.assert_array_equal(matriz, self._esperada(seleccion))
+
+    def test_solo_pide_pares_faltantes(self):
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=self.dir.name):
+            matriz_global.submatriz(self.puntos[:4], self.provider)
+            nuevo = PuntoEntrega.objects.create(nombre="N", direccion="y", latitud=-36.9, longitud=-73.1)
+            seleccion = self.puntos[:4] + [nuevo]
+            with mock.patch.object(self.provider, 'matrix_blocks', wraps=self.provider.matrix_blocks) as calculo:
+                sub = matriz_global.submatriz(seleccion, self.provider)
+
+        # Fila y columna del punto nuevo: 2 x 4 pares, no 5 x 5
+        pedidos = sum(len(filas) * len(columnas) for filas, columnas in calculo.call_args.args[1])
+        self.assertEqual(pedidos, 8)
+        coords = [(float(p.latitud), float(p.longitud)) for p in seleccion]
+        np.testing.assert_allclose(sub, self.provider.matrix(coords))
+
+    def test_escribe_en_el_archivo_agrandado_por_otro_proceso(self):
+        ruta = None
+        original = self.provider.matrix_blocks
+
+        def agrandar_y_calcular(*args, **kwargs):
+            # Otro proceso agranda (reemplaza) el archivo mientras se piden los pares
+            with matriz_global.bloqueo(ruta):
+                datos = matriz_global.abrir(ruta, 512)
+                del datos
+            return original(*args, **kwargs)
+
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=self.dir.name):
+            ruta = matriz_global.ruta_archivo(self.provider)
+            with mock.patch.object(self.provider, 'matrix_blocks', side_effect=agrandar_y_calcular):
+                sub = matriz_global.submatriz(self.puntos[:5], self.provider)
+            with mock.patch.object(self.provider, 'matrix_blocks') as calculo:
+                again = matriz_global.submatriz(self.puntos[:5], self.provider)
+                calculo.assert_not_called()
+
+        np.testing.assert_array_equal(again, sub)
+
+    def test_crece_y_respeta_el_maximo(self):
+        with override_settings(RUTAS_MATRIZ_GLOBAL_DIR=self.dir.name), \
+                mock.patch.object(matriz_global, 'CAPACIDAD_INICIAL', 4):
+            self._matriz(self.puntos[:3])
+            self._matriz(self.puntos)
+            datos = matriz_global.abrir(matriz_global.ruta_archivo(self.provider))
+            self.assertEqual(datos.shape, (16, 16))
+            del datos
+
+            with override_settings(RUTAS_MATRIZ_GLOBAL_MAX_PUNTOS=12):
+                extra = PuntoEntrega.objects.create(nombre="E", direccion="z", latitud=-36.9, longitud=-73.0)
+                self.assertIsNone(matriz_global.submatriz([extra], self.provider))
+                # Sin lugar en la matriz global se arma la de la selección
+                np.testing.assert_array_equal(self._matriz([extra, self.puntos[0]]),
+                                              self._esperada([extra, self.puntos[0]]))
+
+
+@override_settings(RUTAS_DISTANCE_PROVIDER='haversine', RUTAS_ESCENARIOS_WORKERS=1)
+class EscenariosTestCase(TestCase):
+    BODEGAS = {'Bodega A': (-36.80, -73.00), 'Bodega B': (-36.86, -73.06), 'Bodega C': (-36.75, -73.10)}
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('repartidor', password='x'))
+        rng = random.Random(9)
+        self.puntos = [
+            PuntoEntrega.objects.create(
+                nombre=f"P{i}", direccion="x",
+                latitud=round(-36.8 + rng.uniform(-0.05, 0.05), 6),
+                longitud=round(-73.0 + rng.uniform(-0.05, 0.05), 6),
+            )
+            for i in range(14)
+        ]
+        self.geocodificar = mock.patch(
+            'rutas.services._geocodificar', side_effect=lambda direccion, *args: self.BODEGAS[direccion],
+        )
+        self.geocodificar.start()
+        self.addCleanup(self.geocodificar.stop)
+
+    def _data(self, origenes, **campos):
+        data = QueryDict(mutable=True)
+        data.setlist('puntos_seleccionados', [str(p.id) for p in self.puntos])
+        data.setlist('origenes_escenario', origenes)
+        data.update(campos)
+        return data
+
+    def test_ranking_igual_a_optimizar_cada_origen(self):
+        filas = services.evaluar_escenarios(self._data(list(self.BODEGAS), precio_bencina='1000'), 'key')
+
+        self.assertEqual(len(filas), 3)
+        self.assertEqual([f['costo'] for f in filas], sorted(f['costo'] for f in filas))
+        for fila in filas:
+            self.assertEqual(fila['destino'], fila['origen'])
+            plan = services.preparar_optimizacion(
+                self._data([], origen_predefinido=fila['origen']), 'key',
+            )
+            self.assertAlmostEqual(fila['distancia_km'], services.resolver(plan)['distancia_km'], places=2)
+            self.assertAlmostEqual(fila['costo'], fila['litros'] * 1000, delta=10)
+
+    def test_destinos_candidatos_y_pool(self):
+        data = self._data(['Bodega A', 'Bodega B'])
+        data.setlist('destinos_escenario', ['Bodega C', 'Bodega A'])
+        en_serie = services.evaluar_escenarios(data, 'key')
+        self.assertEqual(len(en_serie), 4)
+
+        with override_settings(RUTAS_ESCENARIOS_WORKERS=2):
+            en_paralelo = services.evaluar_escenarios(data, 'key')
+        for a, b in zip(en_serie, en_paralelo):
+            self.assertEqual((a['origen'], a['destino'], a['distancia_km']), (b['origen'], b['destino'], b['distancia_km']))
+
+    def test_vista(self):
+        data = self._data(['Bodega A', 'custom', 'Bodega B'], origen_custom='Bodega B')
+        response = self.client.post(reverse('evaluar_escenarios'), dict(data.lists()))
+        self.assertEqual(sorted(f['origen'] for f in response.json()['escenarios']), ['Bodega A', 'Bodega B'])
+
+        response = self.client.post(reverse('evaluar_escenarios'), dict(self._data([]).lists()))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('origen candidato', response.json()['error'])
+
+
+def _respuesta(status_code=200, **data):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = maps_client.requests.exceptions.HTTPError(f"HTTP {status_code}")
+    return response
+
+
+@override_settings(RUTAS_MAPS_BACKOFF_S=0, RUTAS_MAPS_MAX_RETRIES=2)
+class MapsClientTestCase(TestCase):
+    def setUp(self):
+        maps_client.reiniciar_metricas()
+
+    @mock.patch('rutas.maps_client.requests.Session.get')
+    def test_reintenta_sobre_cuota_y_5xx(self, mock_get):
+        mock_get.side_effect = [
+            _respuesta(status='OVER_QUERY_LIMIT'), _respuesta(503), _respuesta(status='OK', results=[]),
+        ]
+        self.assertEqual(maps_client.get_json('geocode', {'address': 'x'})['status'], 'OK')
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(mock_get.call_args.kwargs['timeout'], (3.05, 10))
+
+        metricas = maps_client.metricas()['geocode']
+        self.assertEqual((metricas['requests'], metricas['errores'], metricas['reintentos']), (3, 1, 2))
+        self.assertIsNotNone(metricas['p95_ms'])
+
+    @mock.patch('rutas.maps_client.requests.Session.get')
+    def test_agota_reintentos(self, mock_get):
+        mock_get.side_effect = maps_client.requests.exceptions.ReadTimeout("lento")
+        with self.assertRaises(maps_client.requests.exceptions.RequestException):
+            maps_client.get_json('distancematrix', {})
+        self.assertEqual(mock_get.call_count, 3)
+
+        # Un 4xx no se reintenta
+        mock_get.reset_mock(side_effect=True)
+        mock_get.return_value = _respuesta(403)
+        with self.assertRaises(maps_client.requests.exceptions.HTTPError):
+            maps_client.get_json('distancematrix', {})
+        self.assertEqual(mock_get.call_count, 1)
+
+    @override_settings(RUTAS_MAPS_HEDGE_MS=20)
+    @mock.patch('rutas.maps_client.requests.Session.get')
+    def test_hedging_usa_la_primera_respuesta(self, mock_get):
+        liberar = threading.Event()
+
+        def get(url, params, timeout):
+            if mock_get.call_count == 1:
+                liberar.wait(5)
+                return _respuesta(status='LENTO')
+            return _respuesta(status='OK')
+
+        mock_get.side_effect = get
+        try:
+            self.assertEqual(maps_client.get_json('directions', {})['status'], 'OK')
+        finally:
+            liberar.set()
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(maps_client.metricas()['directions']['cubiertas'], 1)
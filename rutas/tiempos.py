@@ -0,0 +1,90 @@
+# rutas/tiempos.py
+"""
+Tiempos por etapa del pipeline de optimización.
+
+Cada corrida junta sus etapas en una Medicion (plan['medicion'] en
+rutas.services) y quedan guardadas con el plan en RutaPlan.tiempos, una
+lista de dicts {'etapa', 'inicio_ms', 'ms', ...atributos}:
+- geocodificar_origen / geocodificar_destino
+- cache_resultados: 'acierto'
+- matriz: 'elementos' (pares origen-destino) y 'proveedor'
+- resolver: 'algoritmo' y, si aplica, 'iteraciones'
+- guardar: 'paradas'
+- trazar: 'tramos' (requests a Directions)
+
+percentiles() agrega p50/p95 por etapa para la página de staff
+(views.tiempos_optimizacion).
+"""
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+ETAPAS = (
+    'geocodificar_origen', 'geocodificar_destino', 'cache_resultados', 'matriz', 'resolver', 'guardar', 'trazar',
+)
+
+
+class Medicion:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.etapas = []
+
+    @contextmanager
+    def etapa(self, nombre, **atributos):
+        """
+        Mide el bloque. Los atributos se pueden completar dentro del bloque
+        (el dict que entrega el with es el mismo que se guarda).
+        """
+        inicio = time.perf_counter()
+        registro = {'etapa': nombre, 'inicio_ms': round((inicio - self.t0) * 1000, 1), **atributos}
+        try:
+            yield registro
+        finally:
+            registro['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            self.etapas.append(registro)
+
+    def resumen(self):
+        """{etapa_ms: ms} (suma si una etapa se repite) más total_ms."""
+        resumen = {}
+        for registro in self.etapas:
+            clave = f"{registro['etapa']}_ms"
+            resumen[clave] = round(resumen.get(clave, 0) + registro['ms'], 1)
+        resumen['total_ms'] = round((time.perf_counter() - self.t0) * 1000, 1)
+        return resumen
+
+
+def percentiles(corridas):
+    """
+    Args:
+        corridas: iterable de listas de etapas (RutaPlan.tiempos)
+
+    Returns:
+        lista de dicts {'etapa', 'corridas', 'p50', 'p95', 'max'} en ms, en
+        el orden de ETAPAS, más 'total' (suma de las etapas de cada corrida)
+    """
+    por_etapa = {}
+    totales = []
+    for etapas in corridas:
+        if not etapas:
+            continue
+        for registro in etapas:
+            por_etapa.setdefault(registro['etapa'], []).append(registro['ms'])
+        totales.append(sum(registro['ms'] for registro in etapas))
+
+    nombres = [e for e in ETAPAS if e in por_etapa] + sorted(set(por_etapa) - set(ETAPAS))
+    filas = [_fila(nombre, por_etapa[nombre]) for nombre in nombres]
+    if totales:
+        filas.append(_fila('total', totales))
+    return filas
+
+
+def _fila(etapa, valores):
+    p50, p95 = np.percentile(np.asarray(valores, dtype=np.float64), [50, 95])
+    return {
+        'etapa': etapa,
+        'corridas': len(valores),
+        'p50': round(float(p50), 1),
+        'p95': round(float(p95), 1),
+        'max': round(float(max(valores)), 1),
+    }
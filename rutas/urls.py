@@ -4,7 +4,14 @@ from . import views
 urlpatterns = [
     path('', views.mapa_view, name='mapa'),
     path('agregar_punto/', views.agregar_punto, name='agregar_punto'),
+    path('importar_puntos/', views.importar_puntos, name='importar_puntos'),
+    path('puntos_mapa/', views.puntos_mapa, name='puntos_mapa'),
+    path('puntos_cercanos/', views.puntos_cercanos, name='puntos_cercanos'),
     path('optimizar_ruta/', views.optimizar_ruta, name='optimizar_ruta'),
+    path('optimizacion/<int:job_id>/stream/', views.optimizar_ruta_stream, name='optimizar_ruta_stream'),
+    path('escenarios/', views.evaluar_escenarios, name='evaluar_escenarios'),
+    path('optimizacion/<int:job_id>/', views.optimizacion_estado, name='optimizacion_estado'),
     path('borrar_puntos/', views.borrar_puntos, name='borrar_puntos'),
     path('borrar_punto/<int:punto_id>/', views.borrar_punto, name='borrar_punto'),
+    path('tiempos/', views.tiempos_optimizacion, name='tiempos_optimizacion'),
 ]
@@ -1,22 +1,41 @@
 # rutas/views.py
+import hashlib
 import json
 import requests
 import logging
+import time
+
+from datetime import timedelta
 
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.db.models import Max, Min
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import ensure_csrf_cookie
 
-from .models import PuntoEntrega
-from . import optimizer
+from .models import OptimizacionJob, PuntoEntrega, RutaPlan
+from . import geocoding, importacion, jobs, maps_client, services, spatial, tiempos
+from .services import DEFAULT_FUEL_PRICE, DEFAULT_RENDIMIENTO
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_FUEL_PRICE = 1250
-DEFAULT_RENDIMIENTO = getattr(optimizer, 'AUTO_RENDIMIENTO_KM_POR_LITRO', 12)
+MAX_PUNTOS_CERCANOS = 200
+MAX_PUNTOS_FORMULARIO = 500
+CLUSTER_PX = 60
+MAX_SIN_AGRUPAR = 300
+MAX_ZOOM = 22
+DIAS_TIEMPOS = 7
+MAX_CORRIDAS_TIEMPOS = 2000
+STREAM_INTERVALO_S = 0.5
+# Cada stream ocupa un worker síncrono: pasado este tiempo se cierra con
+# 'pausa' y el navegador sigue consultando optimizacion_estado
+STREAM_MAX_S = 45
 
 
 @login_required
@@ -24,56 +43,80 @@ DEFAULT_RENDIMIENTO = getattr(optimizer, 'AUTO_RENDIMIENTO_KM_POR_LITRO', 12)
 def mapa_view(request):
     """
     Muestra el mapa, la lista de puntos, el formulario de origen/destino
-    y los resultados de la última optimización.
-    - En el MAPA solo se muestran los puntos seleccionados en la última optimización.
-    - En el LISTADO/FORM aparecen todos los puntos para poder elegir nuevos subconjuntos.
+    y el último plan de ruta del usuario (RutaPlan).
+    - En el MAPA se muestran las paradas del plan en orden; el resto de los
+      puntos los pide main.js por viewport (puntos_mapa).
+    - En el LISTADO/FORM aparecen los puntos para elegir nuevos subconjuntos:
+      todos si no pasan de RUTAS_MAPA_MAX_PUNTOS_FORMULARIO, si no las paradas
+      del plan y los primeros por id, más la opción "todos los puntos".
     """
-    puntos_entrega = PuntoEntrega.objects.all().order_by('orden_optimo', 'id')
-
     selected_ids = request.session.get('selected_ids')
+    plan = RutaPlan.objects.filter(usuario=request.user).first()
+
+    orden_por_punto = {}
+    puntos_para_mapa = []
+    if plan is not None:
+        paradas = list(plan.paradas.select_related('punto'))
+        orden_por_punto = {p.punto_id: p.orden for p in paradas if p.punto_id is not None}
+        puntos_para_mapa = [
+            {
+                'id': p.punto_id,
+                'nombre': p.nombre,
+                'direccion': p.punto.direccion if p.punto_id else '',
+                'latitud': p.latitud,
+                'longitud': p.longitud,
+                'orden': p.orden,
+            }
+            for p in paradas
+        ]
 
-    if selected_ids:
-        puntos_para_mapa = PuntoEntrega.objects.filter(
-            id__in=selected_ids
-        ).order_by('orden_optimo', 'id')
+    max_formulario = getattr(settings, 'RUTAS_MAPA_MAX_PUNTOS_FORMULARIO', MAX_PUNTOS_FORMULARIO)
+    total_puntos = PuntoEntrega.objects.count()
+    if total_puntos <= max_formulario:
+        puntos_entrega = list(PuntoEntrega.objects.order_by('id'))
     else:
-        puntos_para_mapa = puntos_entrega
-
-    puntos_json = json.dumps([
-        {
-            'id': p.id,
-            'nombre': p.nombre,
-            'direccion': p.direccion,
-            'latitud': float(p.latitud),
-            'longitud': float(p.longitud),
-            'orden_optimo': p.orden_optimo,
-        }
-        for p in puntos_para_mapa
-    ])
+        del_plan = PuntoEntrega.objects.filter(paradas__plan=plan).order_by('id') if plan else []
+        puntos_entrega = list(del_plan[:max_formulario])
+        resto = PuntoEntrega.objects.exclude(paradas__plan=plan) if plan else PuntoEntrega.objects.all()
+        puntos_entrega += resto.order_by('id')[:max_formulario - len(puntos_entrega)]
+    for p in puntos_entrega:
+        p.orden = orden_por_punto.get(p.id)
+    puntos_entrega.sort(key=lambda p: (p.orden is None, p.orden or 0, p.id))
+
+    limites = PuntoEntrega.objects.aggregate(
+        sur=Min('latitud'), norte=Max('latitud'), oeste=Min('longitud'), este=Max('longitud')
+    )
 
+    job_id = request.session.get('optimizacion_job_id')
     context = {
         'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
-        'puntos_entrega_json': puntos_json,
+        'puntos_entrega_json': json.dumps(puntos_para_mapa),
+        'polilineas_json': json.dumps(plan.polilineas if plan else []),
+        'puntos_mapa_url': reverse('puntos_mapa'),
+        'limites_puntos_json': json.dumps(
+            {k: float(v) for k, v in limites.items()} if total_puntos else None
+        ),
         'puntos_entrega': puntos_entrega,
+        'total_puntos': total_puntos,
+        'puntos_omitidos': total_puntos - len(puntos_entrega),
+        'plan': plan,
 
-        'total_distance_km': request.session.pop('total_distance_km', None),
-        'fuel_consumed_liters': request.session.pop('fuel_consumed_liters', None),
-        'fuel_cost_clp': request.session.pop('fuel_cost_clp', None),
-        'precio_bencina': request.session.pop('precio_bencina', DEFAULT_FUEL_PRICE),
+        'precio_bencina': plan.precio_bencina if plan else DEFAULT_FUEL_PRICE,
+        'rendimiento_vehiculo': plan.rendimiento_km_por_litro if plan else DEFAULT_RENDIMIENTO,
 
-        'rendimiento_vehiculo': request.session.pop('rendimiento_vehiculo', DEFAULT_RENDIMIENTO),
-
-        'direccion_origen': request.session.pop('direccion_origen', ''),
-        'direccion_destino': request.session.pop('direccion_destino', ''),
-
-        'origen_lat': request.session.pop('origen_lat', None),
-        'origen_lng': request.session.pop('origen_lng', None),
-        'destino_lat': request.session.pop('destino_lat', None),
-        'destino_lng': request.session.pop('destino_lng', None),
+        'origen_lat': plan.origen_lat if plan else None,
+        'origen_lng': plan.origen_lng if plan else None,
+        'destino_lat': plan.destino_lat if plan else None,
+        'destino_lng': plan.destino_lng if plan else None,
 
         'error_message': request.session.pop('error_message', None),
+        'importacion': request.session.pop('importacion', None),
 
         'selected_ids': selected_ids,
+        'optimizacion_job_id': job_id,
+        'importando': OptimizacionJob.objects.filter(
+            pk=job_id, tipo=OptimizacionJob.Tipo.IMPORTACION
+        ).exists() if job_id else False,
     }
 
     return render(request, "rutas/mapa.html", context)
@@ -83,6 +126,8 @@ def mapa_view(request):
 def agregar_punto(request):
     """
     Agrega un punto de entrega. Si no vienen lat/lng, geocodifica la dirección.
+    Si el usuario tiene un plan, el punto se inserta en él sin re-optimizar
+    de cero (services.reoptimizar_incremental).
     """
     if request.method != 'POST':
         return redirect('mapa')
@@ -97,26 +142,16 @@ def agregar_punto(request):
     latitud = request.POST.get('latitud')
     longitud = request.POST.get('longitud')
 
-    # Geocodificación si no se proporcionan lat/lng
+    # Geocodificación si no se proporcionan lat/lng (con caché por dirección)
     if not latitud or not longitud:
         try:
-            geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                "address": direccion,
-                "key": settings.GOOGLE_MAPS_API_KEY
-            }
-            response = requests.get(geocode_url, params=params)
-            data = response.json()
-            if data['status'] == 'OK' and data['results']:
-                location = data['results'][0]['geometry']['location']
-                latitud = location['lat']
-                longitud = location['lng']
-            else:
-                request.session['error_message'] = (
-                    f"No se pudo geocodificar la dirección: {direccion}. "
-                    f"Estado: {data.get('status')}"
-                )
-                return redirect('mapa')
+            latitud, longitud = geocoding.geocodificar(direccion, settings.GOOGLE_MAPS_API_KEY)
+        except geocoding.GeocodingError as e:
+            request.session['error_message'] = (
+                f"No se pudo geocodificar la dirección: {direccion}. "
+                f"Estado: {e.estado}"
+            )
+            return redirect('mapa')
         except requests.exceptions.RequestException as e:
             logger.error(f"Error geocodificando dirección para {request.user.username}: {e}")
             request.session['error_message'] = f"Error de conexión con la API de geocodificación: {e}"
@@ -142,213 +177,333 @@ def agregar_punto(request):
     )
     
     logger.info(f"Punto #{punto.id} agregado por {request.user.username}: {nombre}")
+
+    plan = RutaPlan.objects.filter(usuario=request.user).first()
+    if plan is not None and _reoptimizar_incremental(request, plan, nuevos=[punto]):
+        selected_ids = request.session.get('selected_ids')
+        if selected_ids:
+            request.session['selected_ids'] = selected_ids + [str(punto.id)]
     return redirect('mapa')
 
 
 @login_required
-def optimizar_ruta(request):
+@require_POST
+def importar_puntos(request):
     """
-    Toma los puntos de entrega seleccionados, el origen/destino,
-    construye la matriz de distancias, resuelve el TSP y guarda
-    el orden óptimo + métricas de consumo/costo en sesión.
+    Encola la importación de un CSV subido (rutas.importacion en
+    rutas.jobs) y vuelve al mapa; al terminar, optimizacion_estado deja el
+    resumen con los errores por fila en sesión para mostrarlo en el mapa.
+    Archivos sobre RUTAS_IMPORT_MAX_BYTES o RUTAS_IMPORT_MAX_FILAS filas se
+    rechazan (para cargas mayores está el comando importar_puntos).
     """
-    if request.method != 'POST':
+    archivo = request.FILES.get('archivo')
+    if archivo is None:
+        request.session['error_message'] = 'Debes seleccionar un archivo CSV.'
         return redirect('mapa')
 
-    # 0) LEER PUNTOS SELECCIONADOS DEL FORMULARIO
-    selected_ids = request.POST.getlist('puntos_seleccionados')
-    
-    logger.info(
-        f"Usuario {request.user.username} optimizando ruta con "
-        f"{len(selected_ids)} puntos seleccionados"
-    )
-
-    if not selected_ids:
-        logger.warning(f"Usuario {request.user.username} intentó optimizar sin puntos")
+    max_bytes = getattr(settings, 'RUTAS_IMPORT_MAX_BYTES', importacion.DEFAULT_MAX_BYTES)
+    if archivo.size > max_bytes:
         request.session['error_message'] = (
-            'Debes seleccionar al menos un punto de entrega para optimizar la ruta.'
+            f'El archivo supera el máximo de {-(-max_bytes // 1024)} KB; usa el comando importar_puntos.'
         )
         return redirect('mapa')
 
-    # Guardar selección en sesión
-    request.session['selected_ids'] = selected_ids
-
-    # Obtener sólo los puntos seleccionados
-    puntos_entrega_db = list(
-        PuntoEntrega.objects.filter(id__in=selected_ids).order_by('id')
-    )
-
-    if not puntos_entrega_db:
+    try:
+        contenido = archivo.read().decode('utf-8')
+    except UnicodeDecodeError:
+        archivo.seek(0)
+        contenido = archivo.read().decode('latin-1')  # CSV exportado desde Excel
+
+    max_filas = getattr(settings, 'RUTAS_IMPORT_MAX_FILAS', importacion.DEFAULT_MAX_FILAS)
+    filas = len(importacion.leer_csv(contenido))
+    if filas > max_filas:
         request.session['error_message'] = (
-            'Los puntos seleccionados no existen o fueron eliminados.'
+            f'El archivo tiene {filas} filas y el máximo es {max_filas}; usa el comando importar_puntos.'
         )
         return redirect('mapa')
 
-    # 1) ORIGEN
-    origen_predef = request.POST.get('origen_predefinido', '').strip()
-    origen_custom = request.POST.get('origen_custom', '').strip()
+    job = jobs.encolar_importacion(request.user, archivo.name, contenido)
+    request.session['optimizacion_job_id'] = job.pk
+    logger.info(f"Importación de {archivo.name} ({filas} filas) encolada por {request.user.username}")
+    return redirect('mapa')
 
-    if origen_predef == 'custom':
-        direccion_origen = origen_custom
-    elif origen_predef:
-        direccion_origen = origen_predef
-    else:
-        request.session['error_message'] = 'Debes seleccionar o escribir una dirección de origen.'
-        return redirect('mapa')
 
-    if not direccion_origen:
-        request.session['error_message'] = 'La dirección de origen no puede estar vacía.'
-        return redirect('mapa')
+@login_required
+@require_GET
+def puntos_mapa(request):
+    """
+    Puntos dentro del rectángulo visible (sur, oeste, norte, este) para el
+    zoom del mapa, con spatial.en_bbox (índice en memoria o geohash en la
+    BD). Con más de
+    RUTAS_MAPA_MAX_SIN_AGRUPAR puntos se agrupan por celdas de
+    RUTAS_MAPA_CLUSTER_PX px: cada celda con más de un punto es un cluster
+    con cantidad y centroide. El ETag combina la versión de los puntos con
+    los parámetros, así mover el mapa de vuelta responde 304.
+    """
+    try:
+        sur, oeste, norte, este = (float(request.GET[c]) for c in ('sur', 'oeste', 'norte', 'este'))
+        zoom = min(max(int(request.GET.get('zoom', 12)), 0), MAX_ZOOM)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parámetros sur, oeste, norte, este o zoom inválidos.'}, status=400)
+
+    celda_px = getattr(settings, 'RUTAS_MAPA_CLUSTER_PX', CLUSTER_PX)
+    max_sin_agrupar = getattr(settings, 'RUTAS_MAPA_MAX_SIN_AGRUPAR', MAX_SIN_AGRUPAR)
+
+    version = spatial.version_datos()
+    etag = quote_etag(hashlib.md5(
+        f"{version}|{sur}|{oeste}|{norte}|{este}|{zoom}|{celda_px}|{max_sin_agrupar}".encode()
+    ).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    ids, lats, lngs = spatial.en_bbox(sur, oeste, norte, este, version)
+
+    clusters = []
+    sueltos = range(len(ids))
+    if len(ids) > max_sin_agrupar:
+        grupo, cantidad, lat_media, lng_media = spatial.agrupar_en_grilla(lats, lngs, zoom, celda_px)
+        sueltos = (cantidad[grupo] == 1).nonzero()[0]
+        clusters = [
+            {
+                'lat': round(float(lat_media[g]), 6),
+                'lng': round(float(lng_media[g]), 6),
+                'cantidad': int(cantidad[g]),
+            }
+            for g in (cantidad > 1).nonzero()[0]
+        ]
+
+    puntos = PuntoEntrega.objects.in_bulk([int(ids[i]) for i in sueltos])
+    response = JsonResponse({
+        'total': len(ids),
+        'clusters': clusters,
+        'puntos': [
+            {
+                'id': p.id,
+                'nombre': p.nombre,
+                'direccion': p.direccion,
+                'lat': float(p.latitud),
+                'lng': float(p.longitud),
+            }
+            for p in sorted(puntos.values(), key=lambda p: p.id)
+        ],
+    })
+    response['ETag'] = etag
+    # El navegador guarda la respuesta pero revalida cada vez (If-None-Match)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
-    # 2) DESTINO
-    destino_predef = request.POST.get('destino_predefinido', '').strip()
-    destino_custom = request.POST.get('destino_custom', '').strip()
 
-    if destino_predef == 'custom':
-        direccion_destino = destino_custom
-    elif destino_predef == 'same_origin' or not destino_predef:
-        direccion_destino = direccion_origen
+@login_required
+def puntos_cercanos(request):
+    """
+    Puntos de entrega más cercanos a (lat, lng) según el índice espacial
+    (rutas.spatial): los k más cercanos o, con radio_km, todos los del radio.
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        k = min(int(request.GET.get('k', 10)), MAX_PUNTOS_CERCANOS)
+        radio_km = float(request.GET['radio_km']) if request.GET.get('radio_km') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parámetros lat, lng, k o radio_km inválidos.'}, status=400)
+
+    if radio_km is not None:
+        encontrados = spatial.en_radio(lat, lng, radio_km)[:MAX_PUNTOS_CERCANOS]
     else:
-        direccion_destino = destino_predef
-
-    if not direccion_destino:
-        request.session['error_message'] = 'La dirección de destino no puede estar vacía.'
-        return redirect('mapa')
+        encontrados = spatial.cercanos(lat, lng, max(k, 1))
 
-    # 3) GEOCODIFICAR ORIGEN
-    geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
-    try:
-        params_origen = {
-            "address": direccion_origen,
-            "key": settings.GOOGLE_MAPS_API_KEY
+    puntos = PuntoEntrega.objects.in_bulk([pid for pid, _ in encontrados])
+    return JsonResponse({'puntos': [
+        {
+            'id': pid,
+            'nombre': puntos[pid].nombre,
+            'direccion': puntos[pid].direccion,
+            'lat': float(puntos[pid].latitud),
+            'lng': float(puntos[pid].longitud),
+            'distancia_km': round(km, 3),
         }
-        resp_o = requests.get(geocode_url, params=params_origen)
-        data_o = resp_o.json()
-
-        if data_o['status'] == 'OK' and data_o['results']:
-            loc_o = data_o['results'][0]['geometry']['location']
-            lat_inicio = float(loc_o['lat'])
-            lng_inicio = float(loc_o['lng'])
-            punto_inicio_coords = {'latitud': lat_inicio, 'longitud': lng_inicio}
-            request.session['origen_lat'] = lat_inicio
-            request.session['origen_lng'] = lng_inicio
-        else:
-            request.session['error_message'] = (
-                f"No se pudo geocodificar la dirección de origen: {direccion_origen} "
-                f"(estado: {data_o.get('status')})."
-            )
-            return redirect('mapa')
-    except Exception as e:
-        logger.error(f"Error geocodificando origen: {e}", exc_info=True)
-        request.session['error_message'] = f"Error al geocodificar la dirección de origen: {e}"
-        return redirect('mapa')
+        # Un punto recién borrado en otro proceso puede seguir en el índice
+        for pid, km in encontrados if pid in puntos
+    ]})
 
-    # 4) GEOCODIFICAR DESTINO
-    destino_coords = None
-    try:
-        if direccion_destino == direccion_origen:
-            destino_coords = {'latitud': lat_inicio, 'longitud': lng_inicio}
-            request.session['destino_lat'] = lat_inicio
-            request.session['destino_lng'] = lng_inicio
-        else:
-            params_dest = {
-                "address": direccion_destino,
-                "key": settings.GOOGLE_MAPS_API_KEY
-            }
-            resp_d = requests.get(geocode_url, params=params_dest)
-            data_d = resp_d.json()
-            if data_d['status'] == 'OK' and data_d['results']:
-                loc_d = data_d['results'][0]['geometry']['location']
-                lat_dest = float(loc_d['lat'])
-                lng_dest = float(loc_d['lng'])
-                destino_coords = {'latitud': lat_dest, 'longitud': lng_dest}
-                request.session['destino_lat'] = lat_dest
-                request.session['destino_lng'] = lng_dest
-            else:
-                request.session['error_message'] = (
-                    f"No se pudo geocodificar la dirección destino: {direccion_destino} "
-                    f"(estado: {data_d.get('status')})."
-                )
-                return redirect('mapa')
-    except Exception as e:
-        logger.error(f"Error geocodificando destino: {e}", exc_info=True)
-        request.session['error_message'] = f"Error al geocodificar la dirección destino: {e}"
+
+@login_required
+def optimizar_ruta(request):
+    """
+    Encola la optimización de los puntos seleccionados (rutas.jobs) y vuelve
+    al mapa de inmediato; main.js consulta optimizacion_estado hasta que el
+    job termina y recarga para mostrar el orden y las métricas.
+
+    Desde fetch (X-Requested-With) responde JSON con el id del job y las URLs
+    de estado y de progreso (optimizar_ruta_stream) en vez de redirigir.
+    """
+    if request.method != 'POST':
         return redirect('mapa')
+    ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
-    # 5) MATRIZ DE DISTANCIAS
-    distance_matrix = optimizer.get_distance_matrix(
-        puntos_entrega_db,
-        punto_inicio_coords,
-        settings.GOOGLE_MAPS_API_KEY,
-        dest_coords=destino_coords,
+    todos = bool(request.POST.get('todos_los_puntos'))
+    selected_ids = request.POST.getlist('puntos_seleccionados')
+    logger.info(
+        f"Usuario {request.user.username} optimizando ruta con "
+        f"{'todos los' if todos else len(selected_ids)} puntos seleccionados"
     )
 
-    if distance_matrix is None:
-        request.session['error_message'] = (
-            'No se pudo obtener la matriz de distancias. '
-            'Revisa la clave API o la conexión.'
-        )
+    if not selected_ids and not todos:
+        logger.warning(f"Usuario {request.user.username} intentó optimizar sin puntos")
+        mensaje = 'Debes seleccionar al menos un punto de entrega para optimizar la ruta.'
+        if ajax:
+            return JsonResponse({'error': mensaje}, status=400)
+        request.session['error_message'] = mensaje
         return redirect('mapa')
 
-    num_delivery_points = len(puntos_entrega_db)
-    end_index = num_delivery_points + 1 if destino_coords is not None else None
+    _recordar_seleccion(request, selected_ids, todos)
 
-    # 6) OPTIMIZAR RUTA
-    optimized_route_indices, total_distance_km = optimizer.solve_tsp(
-        distance_matrix,
-        num_delivery_points,
-        start_index=0,
-        end_index=end_index,
-    )
+    job = jobs.encolar(request.user, request.POST)
+    request.session['optimizacion_job_id'] = job.pk
 
-    if not optimized_route_indices:
-        request.session['error_message'] = (
-            'No se pudo optimizar la ruta. Verifica los puntos o el algoritmo.'
-        )
-        return redirect('mapa')
+    if ajax:
+        return JsonResponse({
+            'id': job.pk,
+            'estado_url': reverse('optimizacion_estado', args=[job.pk]),
+            'stream_url': reverse('optimizar_ruta_stream', args=[job.pk]),
+        })
+    return redirect('mapa')
 
-    # 7) GUARDAR ORDEN ÓPTIMO
-    for i, matrix_idx in enumerate(optimized_route_indices[1:-1]):
-        if 1 <= matrix_idx <= num_delivery_points:
-            punto = puntos_entrega_db[matrix_idx - 1]
-            punto.orden_optimo = i + 1
-            punto.save()
 
-    # 8) CONSUMO Y COSTO
-    rendimiento_str = request.POST.get('rendimiento_vehiculo', '').strip()
-    try:
-        if rendimiento_str:
-            rendimiento_vehiculo = float(rendimiento_str)
-        else:
-            rendimiento_vehiculo = DEFAULT_RENDIMIENTO
-    except ValueError:
-        rendimiento_vehiculo = DEFAULT_RENDIMIENTO
+@login_required
+def optimizacion_estado(request, job_id):
+    """
+    Estado de un job de optimización (JSON para el polling de main.js).
+    El resultado queda como RutaPlan (mapa_view muestra el último del
+    usuario); si falló, el error pasa a la sesión para mostrarlo en el mapa.
+    Antes se revisan los jobs huérfanos, así un job colgado termina en error.
+    """
+    jobs.recuperar_huerfanos()
+    job = get_object_or_404(OptimizacionJob, pk=job_id, usuario=request.user)
+
+    terminado = job.estado in (OptimizacionJob.Estado.COMPLETADO, OptimizacionJob.Estado.ERROR)
+    if terminado and request.session.get('optimizacion_job_id') == job.pk:
+        del request.session['optimizacion_job_id']
+        if job.estado == OptimizacionJob.Estado.ERROR:
+            request.session['error_message'] = job.error
+        elif job.tipo == OptimizacionJob.Tipo.IMPORTACION:
+            request.session['importacion'] = job.resultado
+
+    return JsonResponse({
+        'id': job.pk,
+        'estado': job.estado,
+        'terminado': terminado,
+        'error': job.error,
+        'tiempos': job.tiempos,
+        'creado_en': job.creado_en.isoformat(),
+        'terminado_en': job.terminado_en.isoformat() if job.terminado_en else None,
+    })
+
+
+@login_required
+@require_GET
+def optimizar_ruta_stream(request, job_id):
+    """
+    Progreso de un job de optimización del usuario por server-sent events.
+    Solo lectura: el job lo crea optimizar_ruta (POST con CSRF) y aquí se
+    consulta cada STREAM_INTERVALO_S hasta que termina o pasan
+    STREAM_MAX_S: con workers síncronos (runserver, gunicorn sync) cada
+    pestaña abierta ocupa uno, así que el stream es corto y lo que resta de
+    una optimización larga se sigue por polling.
+
+    Eventos:
+    - progreso: {'costo', 'ms', 'iteracion', 'ruta': [[lat, lng], ...]} por cada mejora
+    - fin: {'distancia_km', 'url'} con el resultado ya guardado como RutaPlan
+    - error: {'mensaje'}
+    - pausa: {} el job sigue en curso; consultar optimizacion_estado
+    """
+    job = get_object_or_404(OptimizacionJob, pk=job_id, usuario=request.user)
+
+    response = StreamingHttpResponse(_stream_job(job.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: no acumular el stream
+    return response
+
+
+def _stream_job(job_id):
+    """Emite el progreso guardado en el job cada vez que cambia, y el resultado al terminar."""
+    limite = time.monotonic() + STREAM_MAX_S
+    ultimo = None
+    while True:
+        job = OptimizacionJob.objects.only('estado', 'progreso', 'resultado', 'error').get(pk=job_id)
+        if job.progreso and job.progreso != ultimo:
+            ultimo = job.progreso
+            yield _sse('progreso', job.progreso)
+
+        if job.estado == OptimizacionJob.Estado.COMPLETADO:
+            plan = RutaPlan.objects.filter(pk=(job.resultado or {}).get('plan_id')).first()
+            yield _sse('fin', {
+                'distancia_km': plan.distancia_total_km if plan is not None else None,
+                'url': reverse('mapa'),
+            })
+            return
+        if job.estado == OptimizacionJob.Estado.ERROR:
+            yield _sse('error', {'mensaje': job.error})
+            return
+        if time.monotonic() >= limite:
+            yield _sse('pausa', {})
+            return
+        time.sleep(STREAM_INTERVALO_S)
+
+
+def _sse(evento, data):
+    return f"event: {evento}\ndata: {json.dumps(data)}\n\n"
 
-    fuel_consumed = optimizer.calculate_fuel_cost(total_distance_km, rendimiento_vehiculo)
 
-    precio_bencina_str = request.POST.get('precio_bencina', '').strip()
+@login_required
+@require_POST
+def evaluar_escenarios(request):
+    """
+    Compara los orígenes (y destinos) candidatos marcados en el formulario
+    para la selección actual (services.evaluar_escenarios). Devuelve el
+    ranking en JSON; no guarda ningún plan.
+    """
     try:
-        precio_bencina = float(precio_bencina_str) if precio_bencina_str else DEFAULT_FUEL_PRICE
-    except ValueError:
-        precio_bencina = DEFAULT_FUEL_PRICE
+        filas = services.evaluar_escenarios(request.POST, settings.GOOGLE_MAPS_API_KEY)
+    except services.OptimizacionError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Error comparando escenarios: {e}", exc_info=True)
+        return JsonResponse({'error': 'No se pudieron comparar los escenarios.'}, status=500)
 
-    fuel_cost = fuel_consumed * precio_bencina
+    logger.info(f"Usuario {request.user.username} comparó {len(filas)} escenarios")
+    return JsonResponse({'escenarios': filas})
 
-    # Guardar en sesión
-    request.session['total_distance_km'] = round(total_distance_km, 2)
-    request.session['fuel_consumed_liters'] = round(fuel_consumed, 2)
-    request.session['fuel_cost_clp'] = round(fuel_cost, 0)
-    request.session['precio_bencina'] = precio_bencina
-    request.session['rendimiento_vehiculo'] = rendimiento_vehiculo
-    request.session['direccion_origen'] = direccion_origen
-    request.session['direccion_destino'] = direccion_destino
 
-    logger.info(
-        f"Ruta optimizada por {request.user.username}: {total_distance_km:.2f} km, "
-        f"{fuel_consumed:.2f} L, ${fuel_cost:.0f} CLP"
-    )
+def _reoptimizar_incremental(request, plan, nuevos=()):
+    """
+    Rehace el plan tras agregar o borrar puntos y encola su trazado por
+    calles, así la respuesta no espera a Directions; un error no anula el
+    cambio del punto.
+    """
+    try:
+        nuevo_plan = services.reoptimizar_incremental(
+            plan, settings.GOOGLE_MAPS_API_KEY, nuevos=nuevos, usuario=request.user
+        )
+        if nuevo_plan is not None and services.puede_trazar(settings.GOOGLE_MAPS_API_KEY):
+            jobs.encolar_trazado(request.user, nuevo_plan)
+        return nuevo_plan
+    except services.OptimizacionError as e:
+        request.session['error_message'] = f"El punto se guardó, pero no se pudo actualizar la ruta: {e}"
+    except Exception as e:
+        logger.error(f"Error en la re-optimización incremental del plan #{plan.pk}: {e}", exc_info=True)
+        request.session['error_message'] = 'El punto se guardó, pero no se pudo actualizar la ruta.'
+    return None
 
-    return redirect('mapa')
+
+def _recordar_seleccion(request, selected_ids, todos):
+    # Sin selección en sesión el formulario marca todos los puntos
+    if todos:
+        request.session.pop('selected_ids', None)
+    else:
+        request.session['selected_ids'] = selected_ids
 
 
 @login_required
@@ -358,6 +513,9 @@ def borrar_puntos(request):
     """
     if request.method == "POST":
         count = PuntoEntrega.objects.count()
+        # Sin puntos no vale la pena mantener el árbol con todo marcado como
+        # borrado; descartarlo antes evita aplicar cada borrado por separado
+        spatial.invalidar()
         PuntoEntrega.objects.all().delete()
         logger.warning(f"{count} puntos borrados por {request.user.username}")
         
@@ -372,15 +530,21 @@ def borrar_puntos(request):
 def borrar_punto(request, punto_id):
     """
     Borra un solo punto de entrega (usado por el fetch JS).
+    Si estaba en el último plan del usuario, el plan se repara sin la parada.
     Devuelve JSON para que el frontend sepa si fue OK.
     """
     try:
         punto = get_object_or_404(PuntoEntrega, id=punto_id)
         nombre = punto.nombre
+        plan = RutaPlan.objects.filter(usuario=request.user).first()
+        en_plan = plan is not None and plan.paradas.filter(punto=punto).exists()
         punto.delete()
         
         logger.info(f"Punto #{punto_id} ({nombre}) borrado por {request.user.username}")
 
+        if en_plan:
+            _reoptimizar_incremental(request, plan)
+
         # Actualizar la selección en sesión si existía
         selected_ids = request.session.get('selected_ids')
         if selected_ids:
@@ -391,4 +555,31 @@ def borrar_punto(request, punto_id):
         return JsonResponse({"ok": True})
     except Exception as e:
         logger.error(f"Error borrando punto #{punto_id}: {e}", exc_info=True)
-        return JsonResponse({"ok": False, "error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+
+@staff_member_required
+@require_GET
+def tiempos_optimizacion(request):
+    """
+    p50/p95 por etapa (rutas.tiempos) de las optimizaciones de los últimos
+    días, más las métricas de Google Maps de este proceso (rutas.maps_client).
+    """
+    try:
+        dias = max(1, int(request.GET.get('dias', DIAS_TIEMPOS)))
+    except ValueError:
+        dias = DIAS_TIEMPOS
+
+    corridas = list(
+        RutaPlan.objects
+        .filter(creado_en__gte=timezone.now() - timedelta(days=dias))
+        .exclude(tiempos=[])
+        .values_list('tiempos', flat=True)[:MAX_CORRIDAS_TIEMPOS]
+    )
+    return render(request, 'rutas/tiempos.html', {
+        'dias': dias,
+        'corridas': len(corridas),
+        'filas': tiempos.percentiles(corridas),
+        'recientes': corridas[:20],
+        'maps': maps_client.metricas(),
+    })